@@ -0,0 +1,122 @@
+"""
+    Table of the current parameters of every active channel, so that
+    real-time readers get the gain, corners, clip, cutoff and magnitude
+    corrections of a channel with one primary key lookup instead of
+    joining channel_data, simple_response, channelmap_ampparms,
+    channelmap_codaparms and stacorrections with offdate > now filters.
+
+    ir_activechannel has one row per NET.STA.SEEDCHAN.LOCATION for the
+    channel epoch that is open at the time of the refresh (the latest one,
+    when epochs overlap). The loads refresh the rows of the stations they
+    loaded once they have been written, and closeStation and deleteStation
+    refresh the stations they change, whenever the table exists. Epochs
+    that open or close later are picked up by the next refresh of their
+    station, or by refreshing all stations, e.g. daily:
+
+        refresh_active_channels(session)
+        session.commit()
+
+    Readers that need to be exact between refreshes compare offdate:
+
+        channel = active_channel(session, "UW", "SEP", "EHZ", "")
+        if channel is not None and channel.offdate > now:
+            print(channel.gain, channel.gain_units, channel.clip, channel.ml_corr)
+"""
+import datetime
+import logging
+
+from sqlalchemy import and_, inspect, or_, select, tuple_
+
+from .profiling import stage, count
+from .schema import Channel, SimpleResponse, AmpParms, CodaParms, StaCorrection, ActiveChannel
+
+# stacorrections corr_type: ir_activechannel column
+CORRECTIONS = {"ml": "ml_corr", "me": "me_corr", "md": "md_corr"}
+
+# maximum number of stations per statement
+CHUNK_SIZE = 500
+
+def refresh_active_channels(session, stations=None, now=None):
+    """
+        Replaces the ir_activechannel rows of stations, a list of (net, sta),
+        or of all stations when not given, by the channel epochs that are
+        open at now (default the current UTC time). Does not commit.
+        Returns the number of rows written.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    table = ActiveChannel.__table__
+    written = 0
+    with stage("active_channels"):
+        if stations is None:
+            session.execute(table.delete())
+            written += _insert(session, None, now)
+        else:
+            stations = sorted(set(stations))
+            for i in range(0, len(stations), CHUNK_SIZE):
+                chunk = stations[i:i + CHUNK_SIZE]
+                session.execute(table.delete().where(tuple_(table.c.net, table.c.sta).in_(chunk)))
+                written += _insert(session, chunk, now)
+    count("active_channels", written)
+    logging.info("Refreshed {} active channels".format(written))
+    return written
+
+def active_channel(session, net, sta, seedchan, location):
+    """ the ActiveChannel of a channel, None when it is not active; location "" or "--" is the blank location """
+    if location in (None, "", "--"):
+        location = "  "
+    return session.get(ActiveChannel, (net, sta, seedchan, location))
+
+def has_active_channels(session):
+    """ True when the database has the ir_activechannel table """
+    return inspect(session.connection()).has_table(ActiveChannel.__tablename__)
+
+def _insert(session, stations, now):
+    """ inserts the active channels of stations (all when None), returns the number of rows """
+    rows = _rows(session, stations, now)
+    if rows:
+        session.execute(ActiveChannel.__table__.insert(), rows)
+    return len(rows)
+
+def _rows(session, stations, now):
+    """ the ir_activechannel rows of stations, as dictionaries """
+    query = select(Channel.net, Channel.sta, Channel.seedchan, Channel.location, Channel.ondate, Channel.offdate,
+                   Channel.channel, Channel.samprate, Channel.lat, Channel.lon, Channel.elev,
+                   SimpleResponse.gain, SimpleResponse.gain_units, SimpleResponse.low_freq_corner,
+                   SimpleResponse.high_freq_corner, SimpleResponse.natural_frequency,
+                   SimpleResponse.damping_constant, SimpleResponse.dlogsens, AmpParms.clip,
+                   CodaParms.cutoff, CodaParms.gain_corr, CodaParms.summary_wt).\
+            outerjoin(SimpleResponse, _same_epoch(SimpleResponse)).\
+            outerjoin(AmpParms, _same_epoch(AmpParms)).\
+            outerjoin(CodaParms, _same_epoch(CodaParms)).\
+            where(*_open(Channel, stations, now)).\
+            order_by(Channel.net, Channel.sta, Channel.seedchan, Channel.location, Channel.ondate)
+    channels = {}
+    for row in session.execute(query):
+        # ordered by ondate, the latest of overlapping epochs wins
+        values = dict(row._mapping)
+        for column in CORRECTIONS.values():
+            values[column] = None
+        values["lddate"] = now
+        channels[(row.net, row.sta, row.seedchan, row.location)] = values
+
+    query = select(StaCorrection.net, StaCorrection.sta, StaCorrection.seedchan, StaCorrection.location,
+                   StaCorrection.corr_type, StaCorrection.corr).\
+            where(StaCorrection.corr_type.in_(sorted(CORRECTIONS)), *_open(StaCorrection, stations, now)).\
+            order_by(StaCorrection.ondate)
+    for row in session.execute(query):
+        values = channels.get((row.net, row.sta, row.seedchan, row.location))
+        if values is not None:
+            values[CORRECTIONS[row.corr_type]] = row.corr
+    return list(channels.values())
+
+def _open(model, stations, now):
+    """ conditions selecting the epochs of model open at now, of stations when given """
+    conditions = [model.ondate <= now, or_(model.offdate == None, model.offdate > now)]
+    if stations is not None:
+        conditions.append(tuple_(model.net, model.sta).in_(stations))
+    return conditions
+
+def _same_epoch(model):
+    return and_(model.net == Channel.net, model.sta == Channel.sta, model.seedchan == Channel.seedchan,
+                model.location == Channel.location, model.ondate == Channel.ondate)
@@ -0,0 +1,156 @@
+"""
+    The channel epochs a load inserted, updated or deleted.
+
+    A ChangeSet reads the channel level tables of the stations of a load
+    before and after the load, with one query per table each time, and
+    compares them, ignoring lddate. Epochs that inventory2db deleted and
+    wrote again with the same values are therefore not reported, only real
+    changes are. The result can be written as JSON, sent as PostgreSQL
+    NOTIFY payloads and appended to the ir_changelog table, so that
+    consumers only have to reload the channels that changed.
+
+        changes = ChangeSet()
+        inventory2db(session, inventory, changes=changes)
+        changes.write("-")
+        changes.notify(session, "aqms_ir_changes")
+"""
+import json
+import logging
+import sys
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+from .profiling import stage, count
+from .queries import database_rows
+from .schema import ChangeLog
+
+# tables whose rows are part of a channel epoch
+CHANGE_TABLES = ["channel_data", "simple_response", "channelmap_ampparms", "channelmap_codaparms", "sensitivity"]
+
+KINDS = ["inserted", "updated", "deleted"]
+
+# PostgreSQL limits NOTIFY payloads to 8000 bytes
+MAX_PAYLOAD = 7900
+
+class ChangeSet(object):
+    """ inserted, updated and deleted channel epochs, each a set of (net, sta, location, seedchan, ondate) """
+
+    def __init__(self):
+        self.stations = set()
+        self.rows = None
+        self.changes = OrderedDict((kind, set()) for kind in KINDS)
+
+    def before(self, session, stations):
+        """ reads the rows of stations, a list of (net, sta), before they are loaded """
+        self.stations = set(stations)
+        with stage("changes"):
+            self.rows = self._read(session)
+        return
+
+    def after(self, session):
+        """ reads the rows of the stations again and determines the changes """
+        if self.rows is None:
+            raise ValueError("ChangeSet.before has not been called")
+        with stage("changes"):
+            rows = self._read(session)
+        inserted, updated, deleted = self.changes["inserted"], self.changes["updated"], self.changes["deleted"]
+        for table in CHANGE_TABLES:
+            before, after = self.rows[table], rows[table]
+            for pk in set(before) | set(after):
+                values = after.get(pk, before.get(pk))
+                epoch = (values["net"], values["sta"], values["location"], values["seedchan"], values["ondate"])
+                if table == "channel_data" and pk not in before:
+                    inserted.add(epoch)
+                elif table == "channel_data" and pk not in after:
+                    deleted.add(epoch)
+                elif pk not in before or pk not in after or not _same(before[pk], after[pk]):
+                    updated.add(epoch)
+        updated.difference_update(inserted | deleted)
+        self.rows = None
+        for kind in KINDS:
+            count("changes_{}".format(kind), len(self.changes[kind]))
+        return self
+
+    def _read(self, session):
+        return dict((table, database_rows(session, table, self.stations)) for table in CHANGE_TABLES)
+
+    def __len__(self):
+        return sum(len(epochs) for epochs in self.changes.values())
+
+    def entries(self):
+        """ list of dictionaries describing the changed epochs, sorted by channel """
+        entries = []
+        for kind in KINDS:
+            for net, sta, location, seedchan, ondate in self.changes[kind]:
+                entries.append(OrderedDict([("change", kind), ("net", net), ("sta", sta),
+                                            ("location", (location or "").strip()), ("seedchan", seedchan),
+                                            ("ondate", ondate.isoformat() if ondate is not None else None)]))
+        entries.sort(key=lambda e: (e["net"], e["sta"], e["location"], e["seedchan"], e["ondate"] or ""))
+        return entries
+
+    def as_dict(self):
+        document = OrderedDict((kind, len(self.changes[kind])) for kind in KINDS)
+        document["channels"] = self.entries()
+        return document
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def write(self, filename):
+        """ writes the change set as JSON to filename, - is stdout """
+        if filename == "-":
+            sys.stdout.write(self.to_json(indent=2) + "\n")
+            return
+        with open(filename, "w") as fp:
+            fp.write(self.to_json(indent=2))
+        return
+
+    def notify(self, session, channel="aqms_ir_changes"):
+        """
+            Sends the changed epochs with pg_notify on channel, as JSON lists
+            of entries, in as many notifications as the payload limit requires.
+            Returns the number of notifications, 0 when the database is not PostgreSQL.
+        """
+        if session.get_bind().dialect.name != "postgresql":
+            logging.warning("NOTIFY needs PostgreSQL, not sending the changes")
+            return 0
+        sent = 0
+        for payload in _payloads(self.entries()):
+            session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+            sent += 1
+        session.commit()
+        return sent
+
+    def log(self, session):
+        """ appends the changed epochs to the ir_changelog table, returns the number of rows """
+        rows = [dict(net=net, sta=sta, location=location, seedchan=seedchan, ondate=ondate, change=kind)
+                for kind in KINDS for net, sta, location, seedchan, ondate in sorted(self.changes[kind])]
+        if not rows:
+            return 0
+        try:
+            session.execute(ChangeLog.__table__.insert(), rows)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logging.error("Unable to add the changes to {}: {}".format(ChangeLog.__tablename__, e))
+            return 0
+        return len(rows)
+
+def _same(before, after):
+    """ True when two rows have the same values, apart from lddate """
+    return all(before.get(column) == value for column, value in after.items() if column != "lddate")
+
+def _payloads(entries):
+    """ JSON lists of entries, each shorter than MAX_PAYLOAD """
+    chunk = []
+    size = 2
+    for entry in entries:
+        encoded = json.dumps(entry)
+        if chunk and size + len(encoded) + 1 > MAX_PAYLOAD:
+            yield "[" + ",".join(chunk) + "]"
+            chunk, size = [], 2
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        yield "[" + ",".join(chunk) + "]"
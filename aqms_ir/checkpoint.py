@@ -0,0 +1,97 @@
+"""
+    Checkpoints of long loads, so that a load that died can be resumed.
+
+    The checkpoint file is a JSON document with the SHA-256 of the input
+    file, the selection and load options, and the stations (NET.STA) that
+    have been committed completely.
+    It is written atomically (a temporary file renamed over the old one)
+    every batch stations and at the end of the load.
+
+        checkpoint = Checkpoint("UW.xml.checkpoint", file_hash("UW.xml"), resume=True,
+                                options={"station": "S*", "active": False, "include_pz": False})
+        inventory2db(session, inventory, checkpoint=checkpoint)
+
+    Stations that were not completed, e.g. removed but not written again
+    when the load died, are loaded again when the load is resumed.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from .profiling import count
+
+# stations completed between two writes of the checkpoint file
+BATCH = 20
+
+def file_hash(filename):
+    """ SHA-256 of the contents of filename """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class Checkpoint(object):
+    """
+        :param filename: checkpoint file
+        :param input_hash: file_hash of the file that is loaded
+        :param resume: read the completed stations from filename; when the
+            file exists it has to belong to the same input and options
+        :param batch: stations completed between two writes
+        :param options: selection and load options that change the stations
+            loaded, e.g. {"station": "S*", "active": True, "include_pz": False}
+        :raises ValueError: when resuming with a checkpoint of another input or other options
+    """
+    def __init__(self, filename, input_hash, resume=False, batch=BATCH, options=None):
+        self.filename = filename
+        self.input_hash = input_hash
+        self.batch = batch
+        # as read back from the file, e.g. tuples become lists
+        self.options = json.loads(json.dumps(options or {}, sort_keys=True))
+        # stations completed by the load that is resumed, these are skipped
+        self.resumed = set()
+        # stations completed by this load
+        self.stations = set()
+        self.pending = 0
+        if resume and os.path.exists(filename):
+            with open(filename) as fp:
+                document = json.load(fp)
+            if document.get("sha256") != input_hash:
+                raise ValueError("Checkpoint {} belongs to another input file".format(filename))
+            if document.get("options", {}) != self.options:
+                raise ValueError("Checkpoint {} was written with other options: {}".format(
+                                 filename, json.dumps(document.get("options", {}), sort_keys=True)))
+            self.resumed = set(document.get("stations", []))
+            logging.info("Resuming, {} stations have been loaded already".format(len(self.resumed)))
+
+    def done(self, net, sta):
+        """ True when station net.sta has been completed by the load that is resumed """
+        if "{}.{}".format(net, sta) in self.resumed:
+            count("stations_resumed")
+            return True
+        return False
+
+    def complete(self, net, sta):
+        """ marks station net.sta as completed, writes the checkpoint every batch stations """
+        self.stations.add("{}.{}".format(net, sta))
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.save()
+        return
+
+    def save(self):
+        """ writes the checkpoint file atomically """
+        document = OrderedDict([("sha256", self.input_hash), ("options", self.options),
+                                ("updated", datetime.datetime.utcnow().isoformat()),
+                                ("stations", sorted(self.resumed | self.stations))])
+        temporary = "{}.tmp".format(self.filename)
+        with open(temporary, "w") as fp:
+            json.dump(document, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temporary, self.filename)
+        self.pending = 0
+        return
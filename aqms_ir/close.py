@@ -0,0 +1,124 @@
+"""
+    Closing of open epochs, e.g. when stations are decommissioned.
+
+    Sets offdate of the epochs that are open at the end time, for any
+    number of stations and channel patterns, with one UPDATE per table,
+    all in one transaction.
+
+        close_epochs(session, ["UW.ABC", "UW.DE*", ("CC", "SEP")], endtime=datetime.datetime(2024, 10, 1))
+        close_epochs(session, ["UW.ABC"], channel="EN?")
+"""
+import datetime
+import logging
+from collections import OrderedDict
+
+from sqlalchemy import and_, func, or_, select, true
+
+from .schema import Station, Channel, SimpleResponse, AmpParms, CodaParms, Sensitivity
+from .schema import Poles_Zeros, StaCorrection, LoadManifest
+from .active_channels import has_active_channels, refresh_active_channels
+from .manifest import has_manifest
+from .patterns import match_pattern
+
+# channel level tables whose epochs are closed
+CHANNEL_MODELS = [Channel, SimpleResponse, AmpParms, CodaParms, Sensitivity, Poles_Zeros, StaCorrection]
+
+def close_epochs(session, stations, channel=None, location=None, endtime=None, dry_run=False):
+    """
+        Closes the open epochs of stations at endtime (default now, UTC).
+
+        :param stations: list of "NET.STA" strings or (net, sta) tuples,
+            wildcards (* and ?) are allowed in both codes
+        :param channel: channel pattern; when given, only the matching
+            channels are closed and the station epochs remain open
+        :param location: location pattern, "--" is the blank location
+        :param dry_run: only count the epochs that would be closed
+        :returns: dictionary with the number of epochs closed per table
+        :raises ValueError: when a station is not NET.STA, before changing anything
+        :raises: the database error, after rolling back all tables
+    """
+    if endtime is None:
+        endtime = datetime.datetime.utcnow()
+    elif hasattr(endtime, "datetime"):
+        endtime = endtime.datetime
+    stations = [_split(station) for station in stations]
+    if not stations:
+        return OrderedDict()
+
+    models = list(CHANNEL_MODELS)
+    if channel is None and location is None:
+        models.insert(0, Station)
+
+    closed = OrderedDict()
+    try:
+        for model in models:
+            conditions = [_stations(model, stations),
+                          model.ondate < endtime,
+                          or_(model.offdate == None, model.offdate > endtime)]
+            if model is not Station:
+                conditions.extend(c for c in (match_pattern(model.seedchan, channel),
+                                              match_pattern(model.location, location, location=True))
+                                  if c is not None)
+            if dry_run:
+                closed[model.__tablename__] = session.execute(select(func.count()).select_from(model).
+                                                              where(*conditions)).scalar()
+                continue
+            values = {"offdate": endtime}
+            if "lddate" in model.__table__.c:
+                values["lddate"] = func.now()
+            result = session.execute(model.__table__.update().where(*conditions).values(**values))
+            closed[model.__tablename__] = result.rowcount
+        if not dry_run:
+            if has_manifest(session):
+                # the next load with a manifest has to load these stations again
+                session.execute(LoadManifest.__table__.delete().where(_stations(LoadManifest, stations)))
+            if has_active_channels(session):
+                # the closed channels are no longer active
+                matched = session.execute(select(Channel.net, Channel.sta).distinct().
+                                          where(_stations(Channel, stations))).all()
+                refresh_active_channels(session, [tuple(row) for row in matched])
+            session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.error("Unable to close epochs, nothing has been changed: {}".format(e))
+        raise
+    for table, n in closed.items():
+        logging.info("{} {} epochs in {}".format("Would close" if dry_run else "Closed", n, table))
+    return closed
+
+def _stations(model, stations):
+    """ condition matching any of the (net, sta) patterns """
+    matches = []
+    for net, sta in stations:
+        conditions = [c for c in (match_pattern(model.net, net), match_pattern(model.sta, sta)) if c is not None]
+        matches.append(and_(*conditions) if conditions else true())
+    return or_(*matches)
+
+def read_stations(fp):
+    """
+        The stations of a file object with NET.STA one per line, blank lines
+        and everything after a # are ignored.
+
+        :raises ValueError: listing the line numbers of the malformed lines
+    """
+    stations = []
+    errors = []
+    for number, line in enumerate(fp, 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        try:
+            stations.append(_split(line))
+        except ValueError:
+            errors.append("line {}: {!r}".format(number, line))
+    if errors:
+        raise ValueError("expected NET.STA, not {}".format(", ".join(errors)))
+    return stations
+
+def _split(station):
+    if isinstance(station, (tuple, list)):
+        return tuple(station)
+    codes = station.split(".")
+    if len(codes) != 2 or not all(codes) or any(c.isspace() for c in station):
+        raise ValueError("{!r} is not NET.STA".format(station))
+    return tuple(codes)
@@ -0,0 +1,125 @@
+"""
+    Reading and writing of gzip and zstd compressed StationXML as streams:
+    nothing is decompressed to a temporary file and the uncompressed
+    document never has to fit in memory.
+
+    Input is recognized by its magic bytes, whatever its name; output is
+    compressed according to the extension of the file name (.gz, .zst) or
+    the compression asked for.
+
+        with open_input("UW.xml.zst") as source:
+            for event, element in etree.iterparse(source):
+                ...
+        with open_output("UW.xml.gz") as fp:
+            inventory.write(fp, format="STATIONXML")
+
+    zstd needs the zstandard package (pip install zstandard).
+"""
+import gzip
+import io
+from contextlib import contextmanager
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+COMPRESSIONS = [GZIP, ZSTD]
+
+MAGIC = [(b"\x1f\x8b", GZIP), (b"\x28\xb5\x2f\xfd", ZSTD)]
+
+EXTENSIONS = {".gz": GZIP, ".gzip": GZIP, ".zst": ZSTD, ".zstd": ZSTD}
+
+# extension added to a file name that has none for the compression
+SUFFIX = {GZIP: ".gz", ZSTD: ".zst"}
+
+def compression_of(filename):
+    """ compression of filename according to its extension, None when it has none """
+    name = filename.lower()
+    for extension, compression in EXTENSIONS.items():
+        if name.endswith(extension):
+            return compression
+    return None
+
+def sniff(fileobj):
+    """ compression of a buffered binary file object by its magic bytes, without consuming them """
+    head = fileobj.peek(4)[:4]
+    for magic, compression in MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+@contextmanager
+def open_input(source):
+    """
+        Yields source itself when it is not compressed, otherwise a binary
+        file object that decompresses source while it is read. source is a
+        path or a binary file object.
+    """
+    if hasattr(source, "read"):
+        raw = source if hasattr(source, "peek") else io.BufferedReader(_Readable(source))
+        opened = None
+    else:
+        raw = opened = open(source, "rb")
+    try:
+        compression = sniff(raw)
+        if compression is None:
+            # lxml reads a path faster than a python file object
+            yield source if opened is not None or raw is source else raw
+        elif compression == GZIP:
+            with gzip.GzipFile(fileobj=raw, mode="rb") as fp:
+                yield fp
+        else:
+            with _zstandard().ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=False) as fp:
+                yield fp
+    finally:
+        if opened is not None:
+            opened.close()
+
+@contextmanager
+def open_output(target, compression=None, level=None):
+    """
+        Yields a binary file object that writes to target, a path or a binary
+        file object, compressed with compression (gzip, zstd or None). When
+        not given, the compression follows the extension of target.
+    """
+    if compression is None and not hasattr(target, "write"):
+        compression = compression_of(target)
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression {}, use one of {}".format(compression, ", ".join(COMPRESSIONS)))
+    if hasattr(target, "write"):
+        raw, opened = target, None
+    else:
+        raw = opened = open(target, "wb")
+    try:
+        if compression is None:
+            yield raw
+        elif compression == GZIP:
+            # no name and time stamp, the same document always compresses to the same bytes
+            with gzip.GzipFile(filename="", fileobj=raw, mode="wb", compresslevel=level or 6, mtime=0) as fp:
+                yield fp
+        else:
+            writer = _zstandard().ZstdCompressor(level=level or 3).stream_writer(raw, closefd=False)
+            with writer as fp:
+                yield fp
+    finally:
+        if opened is not None:
+            opened.close()
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression needs the zstandard package, pip install zstandard")
+    return zstandard
+
+class _Readable(io.RawIOBase):
+    """ raw stream reading from a file object without peek, e.g. a socket file """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        data = self.fileobj.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
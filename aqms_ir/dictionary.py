@@ -0,0 +1,154 @@
+"""
+    Lookups in the AQMS dictionary tables d_abbreviation, d_unit and d_format.
+    Each method returns the id of the entry matching the description, name,
+    etc. and creates a new entry if none exists yet.
+
+    On PostgreSQL and SQLite a new entry is added with a single
+    INSERT ... ON CONFLICT DO NOTHING RETURNING id. With the unique indexes
+    of aqms_ir.migrate in place this cannot create duplicates when several
+    loaders add the same entry at the same time. d_unit entries conflict on
+    (name, COALESCE(description, '')), the expression of its unique index,
+    so units without a description are not duplicated either.
+"""
+import logging
+
+from sqlalchemy import func, literal_column
+
+from .migrate import UNIT_INDEX, has_index
+from .profiling import stage, count
+from .schema import Abbreviation, Format, Unit
+
+def get_abbreviation_id(session, description):
+    """
+       get id from d_abbreviation with
+       same description (creates a new entry
+       if none exists yet).
+    """
+    result = session.query(Abbreviation).filter_by(description=description).first()
+    if result:
+        return result.id
+    else:
+        try:
+            return _insert(session, Abbreviation, description=description)
+        except Exception as e:
+            session.rollback()
+            logging.error("Not able to commit abbreviation {} and get id: {}".format(description,e))
+    return None
+
+def get_unit_id(session, unit_name, unit_description):
+    """
+       get id from d_unit with
+       same unit name and description (creates a new entry
+       if none exists yet).
+    """
+    result = session.query(Unit).filter_by(name=unit_name, description=unit_description).first()
+    if result:
+        return result.id
+    else:
+        try:
+            return _insert(session, Unit, name=unit_name, description=unit_description)
+        except Exception as e:
+            session.rollback()
+            logging.error("Not able to commit unit {} and get unit id: {}".format(unit_name,e))
+    return None
+
+def get_format_id(session, format_name=None):
+    """
+       get id from d_format
+       (creates a new entry
+       if none exists yet).
+    """
+    if not format_name:
+        format_name="UNKNOWN"
+
+    result = session.query(Format).filter_by(name=format_name).first()
+
+    if result:
+        return result.id
+    else:
+        try:
+            return _insert(session, Format, name=format_name)
+        except Exception as e:
+            session.rollback()
+            logging.error("Not able to commit format_name {} and get format id: {}".format(format_name,e))
+    return None
+
+def _insert(session, model, **values):
+    """
+        Adds an entry to a dictionary table and returns its id. When another
+        session added the same entry first, returns the id of that entry.
+    """
+    insert = dialect_insert(session)
+    if insert is None:
+        session.add(model(**values))
+        session.commit()
+    else:
+        statement = insert(model).values(**values).\
+                    on_conflict_do_nothing(index_elements=_conflict_target(session, model)).returning(model.id)
+        entry_id = session.execute(statement).scalar()
+        session.commit()
+        if entry_id is not None:
+            return entry_id
+    return _entry(session, model, values).id
+
+def _entry(session, model, values):
+    """ the entry with values, a unit without description matches "" like the d_unit index """
+    if model is Unit:
+        return session.query(Unit).filter(Unit.name == values.get("name"),
+            func.coalesce(Unit.description, "") == (values.get("description") or "")).first()
+    return session.query(model).filter_by(**values).first()
+
+def _conflict_target(session, model):
+    """ ON CONFLICT target of model, None (any unique index) unless it is d_unit with the index of UNIT_INDEX """
+    if model is Unit and has_index(session.connection(), UNIT_INDEX):
+        # a literal, a bound parameter would not match the index expression
+        return [Unit.name, func.coalesce(Unit.description, literal_column("''"))]
+    return None
+
+def dialect_insert(session):
+    """ insert construct with ON CONFLICT support for the database of session, None if there is none """
+    name = session.get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+class DictionaryCache(object):
+    """
+        Remembers the dictionary ids that have been looked up during a load,
+        so that each distinct description costs one lookup per session.
+        Caches of different sessions (threads) can share ids, the ids are
+        committed before they are cached.
+    """
+    def __init__(self, session, ids=None):
+        self.session = session
+        self.ids = ids if ids is not None else {}
+
+    def abbreviation(self, description):
+        return self._lookup(("abbreviation", description), get_abbreviation_id, description)
+
+    def unit(self, unit):
+        """ unit is a (name, description) tuple or None """
+        if not unit:
+            return None
+        return self._lookup(("unit",) + tuple(unit), get_unit_id, *unit)
+
+    def format(self, format_name=None):
+        return self._lookup(("format", format_name), get_format_id, format_name)
+
+    def resolve(self, kind, value):
+        """ kind is one of abbreviation, unit, format """
+        return getattr(self, kind)(value)
+
+    def _lookup(self, key, method, *args):
+        if key in self.ids:
+            count("dictionary_cache_hits")
+            return self.ids[key]
+        with stage("dictionary_lookup"):
+            value = method(self.session, *args)
+        if value is not None:
+            self.ids[key] = value
+        return value
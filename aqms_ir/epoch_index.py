@@ -0,0 +1,206 @@
+"""
+    In-memory index of the channel epochs in the Instrument Response
+    tables, for answering many "gain, corners, clip and cutoff of
+    NET.STA.LOC.CHA at time T" questions without a query each.
+
+    The index is built with one query joining channel_data with
+    simple_response, channelmap_ampparms and channelmap_codaparms, and
+    keeps per channel a sorted list of ondates that is searched with
+    bisect. refresh() only reloads the stations that have rows with a
+    newer lddate than the last build or refresh, less a margin, or another
+    number of channel_data rows than indexed, e.g. after deleteStation or
+    epochs removed by the UpsertSink. The lddate of a row is the start of
+    the transaction that wrote it (PostgreSQL now()), so a transaction
+    that was still running at the last refresh commits rows older than
+    that refresh; the margin is the longest such transaction expected.
+
+        index = ChannelIndex(session)
+        epoch = index.lookup("UW", "SEP", "EHZ", "", UTCDateTime(2020, 1, 1))
+        if epoch:
+            print(epoch.gain, epoch.gain_units, epoch.clip)
+        ...
+        index.refresh()
+"""
+import bisect
+import datetime
+import logging
+from collections import namedtuple
+
+from sqlalchemy import and_, func, or_, select
+
+from .schema import Channel, SimpleResponse, AmpParms, CodaParms
+
+# values kept per channel epoch
+ChannelEpoch = namedtuple("ChannelEpoch", ["net", "sta", "seedchan", "location", "ondate", "offdate",
+                                           "samprate", "gain", "gain_units", "low_freq_corner",
+                                           "high_freq_corner", "natural_frequency", "damping_constant",
+                                           "clip", "cutoff"])
+
+# tables whose lddate is checked by refresh
+TABLES = [Channel, SimpleResponse, AmpParms, CodaParms]
+
+# maximum number of stations per query when refreshing
+CHUNK_SIZE = 500
+
+# rows this much older than the last build or refresh are checked again by refresh
+MARGIN = datetime.timedelta(minutes=15)
+
+class ChannelIndex(object):
+    """
+        Channel epochs of the database of session, by NET.STA.LOC.CHA and time.
+
+        :param networks: list of network codes to index, default all
+        :param margin: datetime.timedelta, the stations with rows this much
+            older than the last build or refresh are reloaded by refresh, in
+            case they were committed by a transaction that started before it
+    """
+    def __init__(self, session, networks=None, margin=MARGIN):
+        self.session = session
+        self.networks = networks
+        self.margin = margin
+        self.epochs = {}
+        self.lddate = None
+        self.build()
+
+    def build(self):
+        """ (re)loads all channel epochs """
+        lddate = self._last_lddate()
+        epochs = {}
+        for epoch in self._query():
+            _add(epochs, epoch)
+        self.epochs = epochs
+        self.lddate = lddate
+        logging.info("Indexed {} channel epochs of {} channels".format(len(self), len(self.epochs)))
+        return self
+
+    def refresh(self):
+        """
+            Reloads the stations that have been loaded since the last build or
+            refresh (less the margin), and the stations whose number of channel_data rows is not
+            the number indexed, so that deleted stations and epochs disappear
+            even when the remaining rows did not change. Returns the number of
+            stations reloaded.
+        """
+        if self.lddate is None:
+            self.build()
+            return len(set(key[:2] for key in self.epochs))
+        lddate = self._last_lddate()
+        stations = set()
+        for model in TABLES:
+            query = select(model.net, model.sta).distinct().where(model.lddate >= self.lddate - self.margin)
+            if self.networks:
+                query = query.where(model.net.in_(self.networks))
+            stations.update(tuple(row) for row in self.session.execute(query))
+        stations.update(self._changed_counts())
+
+        stations = sorted(stations)
+        for i in range(0, len(stations), CHUNK_SIZE):
+            chunk = stations[i:i + CHUNK_SIZE]
+            epochs = {}
+            for epoch in self._query(chunk):
+                _add(epochs, epoch)
+            for key in [key for key in self.epochs if key[:2] in set(chunk)]:
+                del self.epochs[key]
+            self.epochs.update(epochs)
+        self.lddate = lddate
+        logging.info("Refreshed {} stations".format(len(stations)))
+        return len(stations)
+
+    def lookup(self, net, sta, seedchan, location, time):
+        """
+            The ChannelEpoch of a channel that is open at time (datetime or
+            UTCDateTime), None when there is none. Location "" or "--" is
+            the blank location.
+        """
+        entry = self.epochs.get((net, sta, seedchan, _location(location)))
+        if entry is None:
+            return None
+        ondates, epochs = entry
+        time = _datetime(time)
+        i = bisect.bisect_right(ondates, time) - 1
+        if i < 0:
+            return None
+        epoch = epochs[i]
+        if epoch.offdate is not None and time >= epoch.offdate:
+            return None
+        return epoch
+
+    def epochs_of(self, net, sta, seedchan, location):
+        """ all ChannelEpochs of a channel, oldest first """
+        entry = self.epochs.get((net, sta, seedchan, _location(location)))
+        return list(entry[1]) if entry else []
+
+    def __len__(self):
+        return sum(len(entry[1]) for entry in self.epochs.values())
+
+    def _changed_counts(self):
+        """ stations whose number of channel_data rows differs from the number of epochs indexed """
+        indexed = {}
+        for key, (ondates, epochs) in self.epochs.items():
+            indexed[key[:2]] = indexed.get(key[:2], 0) + len(epochs)
+        query = select(Channel.net, Channel.sta, func.count()).group_by(Channel.net, Channel.sta)
+        if self.networks:
+            query = query.where(Channel.net.in_(self.networks))
+        counts = dict(((net, sta), n) for net, sta, n in self.session.execute(query))
+        return set(station for station in set(indexed) | set(counts) if indexed.get(station) != counts.get(station))
+
+    def _last_lddate(self):
+        """ most recent lddate in the indexed tables, taken before reading them """
+        lddate = None
+        for model in TABLES:
+            query = select(func.max(model.lddate))
+            if self.networks:
+                query = query.where(model.net.in_(self.networks))
+            value = self.session.execute(query).scalar()
+            if isinstance(value, str):
+                value = datetime.datetime.fromisoformat(value)
+            if value is not None and (lddate is None or value > lddate):
+                lddate = value
+        return lddate
+
+    def _query(self, stations=None):
+        """ generator of the ChannelEpochs of all (or the listed (net, sta)) stations """
+        query = select(Channel.net, Channel.sta, Channel.seedchan, Channel.location, Channel.ondate,
+                       Channel.offdate, Channel.samprate, SimpleResponse.gain, SimpleResponse.gain_units,
+                       SimpleResponse.low_freq_corner, SimpleResponse.high_freq_corner,
+                       SimpleResponse.natural_frequency, SimpleResponse.damping_constant,
+                       AmpParms.clip, CodaParms.cutoff).\
+                outerjoin(SimpleResponse, _same_epoch(SimpleResponse)).\
+                outerjoin(AmpParms, _same_epoch(AmpParms)).\
+                outerjoin(CodaParms, _same_epoch(CodaParms)).\
+                order_by(Channel.net, Channel.sta, Channel.seedchan, Channel.location, Channel.ondate)
+        if self.networks:
+            query = query.where(Channel.net.in_(self.networks))
+        if stations:
+            query = query.where(or_(*[and_(Channel.net == net, Channel.sta == sta) for net, sta in stations]))
+        for row in self.session.execute(query.execution_options(stream_results=True)):
+            yield ChannelEpoch(*[_value(value) for value in row])
+
+def _same_epoch(model):
+    return and_(model.net == Channel.net, model.sta == Channel.sta, model.seedchan == Channel.seedchan,
+                model.location == Channel.location, model.ondate == Channel.ondate)
+
+def _add(epochs, epoch):
+    """ appends epoch to the sorted lists of its channel, rows arrive ordered by ondate """
+    ondates, channel_epochs = epochs.setdefault((epoch.net, epoch.sta, epoch.seedchan, epoch.location), ([], []))
+    ondates.append(epoch.ondate)
+    channel_epochs.append(epoch)
+    return
+
+def _value(value):
+    if value is not None and value.__class__.__name__ == "Decimal":
+        return float(value)
+    return value
+
+def _location(location):
+    if location in (None, "", "--"):
+        return "  "
+    return location
+
+def _datetime(time):
+    """ datetime of a datetime, UTCDateTime or ISO string """
+    if hasattr(time, "datetime"):
+        return time.datetime
+    if isinstance(time, str):
+        return datetime.datetime.fromisoformat(time.rstrip("Z"))
+    return time
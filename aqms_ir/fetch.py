@@ -0,0 +1,102 @@
+"""
+    Retrieval of StationXML from several FDSN station webservices at the
+    same time, merged into one inventory.
+
+    The services are queried concurrently, so a fetch takes as long as the
+    slowest service. The inventories are merged in the order the services
+    are given, whatever order they arrive in: a station epoch of a service
+    is dropped when it overlaps an epoch of the same NET.STA from a service
+    earlier in the list. Epochs that only a later service has, e.g. older
+    ones, are kept.
+
+        results = fetch_inventories(["IRIS", "NCEDC", "SCEDC"], network="BK,NC", level="response")
+        inventory = merge_inventories([(service, inventory) for service, inventory in results.items()
+                                       if not isinstance(inventory, Exception)])
+
+    Services are obspy FDSN client keys or base urls, e.g. http://localhost:8080
+    for a local stand-in server; service discovery is skipped for urls.
+"""
+import copy
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# seconds to wait for a service
+TIMEOUT = 120
+
+def client(service, timeout=TIMEOUT):
+    """ obspy FDSN Client of service, a client key or a base url """
+    from obspy.clients.fdsn import Client
+    if service.startswith("http://") or service.startswith("https://"):
+        return Client(service, timeout=timeout, _discover_services=False)
+    return Client(service, timeout=timeout)
+
+def fetch_inventories(services, client_factory=client, **kwargs):
+    """
+        Queries get_stations(**kwargs) of all services concurrently. Returns an
+        OrderedDict service: Inventory, in the order of services, with the
+        exception instead of the inventory for services that failed.
+    """
+    def fetch(service):
+        try:
+            inventory = client_factory(service).get_stations(**kwargs)
+            logging.info("Retrieved {} networks from {}".format(len(inventory.networks), service))
+            return inventory
+        except Exception as e:
+            logging.warning("No data from {}: {}".format(service, e))
+            return e
+
+    results = OrderedDict()
+    if not services:
+        return results
+    with ThreadPoolExecutor(max_workers=len(services)) as executor:
+        for service, result in zip(services, executor.map(fetch, services)):
+            results[service] = result
+    return results
+
+def merge_inventories(inventories, source=None):
+    """
+        Merges inventories, a list of (service, Inventory) in order of
+        precedence, into one Inventory with the networks and their stations
+        sorted by code and start date. The Network attributes are taken
+        from the first inventory that has the network.
+    """
+    from obspy import Inventory
+
+    networks = OrderedDict()
+    # (net, sta): [(service, station epoch)] that have been kept
+    kept = {}
+    dropped = 0
+    for service, inventory in inventories:
+        for network in inventory.networks:
+            merged = networks.get(network.code)
+            if merged is None:
+                merged = copy.copy(network)
+                merged.stations = []
+                networks[network.code] = merged
+            for station in network.stations:
+                epochs = kept.setdefault((network.code, station.code), [])
+                other = [(s, epoch) for s, epoch in epochs if s != service]
+                if any(_overlaps(station, epoch) for s, epoch in other):
+                    logging.info("Dropped {}.{} {} - {} of {}, it overlaps an epoch of {}".format(network.code,
+                                 station.code, station.start_date, station.end_date, service,
+                                 ", ".join(sorted(set(s for s, epoch in other if _overlaps(station, epoch))))))
+                    dropped += 1
+                    continue
+                epochs.append((service, station))
+                merged.stations.append(station)
+    for network in networks.values():
+        network.stations.sort(key=lambda station: (station.code, _start(station)))
+    if dropped:
+        logging.info("Dropped {} overlapping station epochs".format(dropped))
+    return Inventory(networks=[networks[code] for code in sorted(networks)],
+                     source=source if source is not None else ",".join(service for service, inventory in inventories))
+
+def _start(epoch):
+    return epoch.start_date.timestamp if epoch.start_date is not None else float("-inf")
+
+def _end(epoch):
+    return epoch.end_date.timestamp if epoch.end_date is not None else float("inf")
+
+def _overlaps(a, b):
+    return _start(a) < _end(b) and _start(b) < _end(a)
@@ -0,0 +1,130 @@
+"""
+    Reentrant loading of inventories, for services that run several loads
+    at the same time, e.g. one thread per network.
+
+    A Loader carries the configuration of the loads, a session factory, the
+    dictionary ids found so far and a cache of the calculated responses. Every load gets its own session, sink
+    and LoadReport, so loads with different options can run concurrently
+    in threads of the same process.
+
+        loader = Loader(sessionmaker(bind=engine), active=True, sink_factory=CoreSink)
+        report = loader.load_file("UW.xml", station="SEP,ABC")
+"""
+import threading
+from contextlib import contextmanager
+
+from . import sqlstats
+from .dictionary import DictionaryCache
+from .inv2schema import inventory2db, stream2db
+from .manifest import Manifest
+from .profiling import collect, current
+from .report import LoadReport
+from .rows import ResponseCache
+from .sinks import ORMSink
+from .xmlfilter import read_stationxml, iter_stationxml
+
+class Loader(object):
+    """
+        :param session_factory: callable returning a new sqlalchemy Session,
+            e.g. a sessionmaker
+        :param active: only load currently active stations/channels
+        :param include_pz: also load the poles and zeros
+        :param sink_factory: callable (session, report=, dictionary=) returning
+            an aqms_ir.sinks.DatabaseSink, default ORMSink
+        :param stacor_rules: rules for the default station corrections, see
+            aqms_ir.stacorrections
+        :param constant_memory: load_file reads and loads one station at a
+            time, see aqms_ir.inv2schema.stream2db
+        :param manifest: load_file skips the stations whose StationXML did not
+            change since they were loaded, see aqms_ir.manifest
+        :param active_channels: refresh the ir_activechannel rows of the
+            loaded stations, by default when the table exists, see
+            aqms_ir.active_channels
+    """
+    def __init__(self, session_factory, active=False, include_pz=False, sink_factory=None, stacor_rules=None,
+                 constant_memory=False, manifest=False, active_channels=None):
+        self.session_factory = session_factory
+        self.active = active
+        self.include_pz = include_pz
+        self.sink_factory = sink_factory if sink_factory is not None else ORMSink
+        self.stacor_rules = stacor_rules
+        self.constant_memory = constant_memory
+        self.manifest = manifest
+        self.active_channels = active_channels
+        # dictionary ids shared by the sessions of all loads
+        self.dictionary_ids = {}
+        self.responses = ResponseCache()
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def load(self, inventory, report=None, timings=None, changes=None, checkpoint=None, sql=None):
+        """
+            Loads an obspy Inventory in a new session. Returns the
+            LoadReport of this load (report, when provided). Stage timings
+            and counters go to timings, when provided, otherwise to the
+            Timings collecting in the calling thread. The changed channel
+            epochs go to changes, an aqms_ir.changes.ChangeSet, when provided.
+            The stations listed by checkpoint, an aqms_ir.checkpoint.Checkpoint,
+            are skipped and the loaded ones are added to it. The SQL of the
+            load is accounted in sql, an aqms_ir.sqlstats.SQLStats, when provided.
+        """
+        return self._run(inventory2db, inventory, report, timings, changes=changes, checkpoint=checkpoint,
+                         sql=sql)
+
+    def load_file(self, filename, report=None, timings=None, changes=None, checkpoint=None, sql=None,
+                  **selection):
+        """
+            Loads the StationXML file filename, selection is passed on to
+            aqms_ir.xmlfilter.read_stationxml. With constant_memory the
+            file is read and loaded one station at a time, changes is not
+            supported then.
+        """
+        if timings is None:
+            timings = current()
+        fingerprints = {} if self.manifest else None
+        if self.constant_memory:
+            if changes is not None:
+                raise ValueError("A change set can not be determined in constant memory mode")
+            return self._run(stream2db, iter_stationxml(filename, active=self.active, fingerprints=fingerprints,
+                             **selection), report, timings, checkpoint=checkpoint, fingerprints=fingerprints,
+                             sql=sql)
+        with collect(timings):
+            inventory = read_stationxml(filename, active=self.active, fingerprints=fingerprints, **selection)
+        return self._run(inventory2db, inventory, report, timings, changes=changes, checkpoint=checkpoint,
+                         fingerprints=fingerprints, sql=sql)
+
+    def _run(self, function, inventory, report, timings, fingerprints=None, sql=None, **kwargs):
+        """
+            calls function (inventory2db or stream2db) with a new session and sink,
+            and a manifest of fingerprints when given
+        """
+        if timings is None:
+            timings = current()
+        if report is None:
+            report = LoadReport()
+        session = self.session_factory()
+        try:
+            sink = self.sink_factory(session, report=report,
+                                     dictionary=DictionaryCache(session, self.dictionary_ids))
+            if fingerprints is not None:
+                kwargs["manifest"] = Manifest(session, fingerprints,
+                                              options={"active": self.active, "include_pz": self.include_pz})
+            if sql is not None:
+                sqlstats.instrument(session.get_bind())
+            with collect(timings), _collect_sql(sql):
+                report = function(session, inventory, active=self.active, include_pz=self.include_pz,
+                                  sink=sink, report=report, stacor_rules=self.stacor_rules,
+                                  responses=self.responses, active_channels=self.active_channels, **kwargs)
+        finally:
+            session.close()
+        with self._lock:
+            self.loads += 1
+        return report
+
+@contextmanager
+def _collect_sql(sql):
+    if sql is None:
+        yield None
+        return
+    with sqlstats.collect(sql):
+        yield sql
@@ -0,0 +1,130 @@
+"""
+    Load manifest: the fingerprint of every station as it was last loaded,
+    so that a load can skip the stations whose StationXML did not change.
+
+    The fingerprints are SHA-256 hashes of the canonical XML of the
+    Station elements, after the selection has been applied, computed by
+    aqms_ir.xmlfilter while parsing. The ir_loadmanifest table holds the
+    fingerprint, combined with the load options, and the MANIFEST_VERSION
+    of every station loaded with a manifest. A station whose fingerprint
+    and version match is not removed, its responses are not calculated and
+    nothing is written. The fingerprint covers all station epochs of a
+    NET.STA, which are skipped or loaded together.
+
+        fingerprints = {}
+        inventory = read_stationxml("UW.xml", fingerprints=fingerprints)
+        manifest = Manifest(session, fingerprints, options={"active": False, "include_pz": False})
+        inventory2db(session, inventory, manifest=manifest)
+
+    Loads without a manifest, deleteStation and closeStation remove the
+    entries of the stations they change, so that the next load with a
+    manifest loads them again.
+"""
+import datetime
+import hashlib
+import json
+import logging
+
+from sqlalchemy import inspect, tuple_
+
+from .profiling import stage, count
+from .retry import retry
+from .schema import LoadManifest
+
+# version of the rows a load writes for a station, stations loaded by another
+# version are loaded again; bump it whenever the same StationXML gives other rows
+MANIFEST_VERSION = "1"
+
+class Manifest(object):
+    """
+        :param session: sqlalchemy Session
+        :param fingerprints: dictionary {(net, sta): fingerprint} filled by
+            aqms_ir.xmlfilter.read_stationxml or iter_stationxml; stations
+            without a fingerprint are always loaded
+        :param options: load options that change the rows of a station,
+            e.g. {"active": True, "include_pz": False}
+        :param version: version of the rows of a load, stations loaded by
+            another version are loaded again
+    """
+    def __init__(self, session, fingerprints, options=None, version=MANIFEST_VERSION):
+        self.session = session
+        self.fingerprints = fingerprints
+        self.options = json.dumps(options or {}, sort_keys=True)
+        self.version = version
+        # {(net, sta): (fingerprint, version)}, read on first use
+        self.stored = None
+        # stations with rows that could not be written by this load
+        self.failed = set()
+
+    def fingerprint(self, net, sta):
+        """ fingerprint of station net.sta with the load options, None when unknown """
+        fingerprint = self.fingerprints.get((net, sta))
+        if fingerprint is None:
+            return None
+        return hashlib.sha256((self.options + fingerprint).encode("utf-8")).hexdigest()
+
+    def unchanged(self, net, sta):
+        """ True when station net.sta has been loaded from the same StationXML """
+        fingerprint = self.fingerprint(net, sta)
+        if fingerprint is None:
+            return False
+        if self._stored().get((net, sta)) == (fingerprint, self.version):
+            count("stations_unchanged")
+            return True
+        return False
+
+    def forget(self, net, sta):
+        """ removes station net.sta from the manifest, before it is changed """
+        if self._stored().pop((net, sta), None) is None:
+            return
+        with stage("manifest"):
+            retry(lambda: self._commit(lambda: forget(self.session, [(net, sta)])), session=self.session)
+        return
+
+    def fail(self, net, sta):
+        """ marks station net.sta as not loaded completely, it is not recorded by this load """
+        self.failed.add((net, sta))
+        return
+
+    def record(self, net, sta):
+        """ stores the fingerprint of station net.sta after all of its epochs have been loaded """
+        fingerprint = self.fingerprint(net, sta)
+        if fingerprint is None or (net, sta) in self.failed:
+            return
+        row = LoadManifest(net=net, sta=sta, fingerprint=fingerprint, version=self.version,
+                           lddate=datetime.datetime.utcnow())
+        with stage("manifest"):
+            retry(lambda: self._commit(lambda: self.session.merge(row)), session=self.session)
+        self._stored()[(net, sta)] = (fingerprint, self.version)
+        return
+
+    def _stored(self):
+        if self.stored is None:
+            with stage("manifest"):
+                # the manifest has a row per station, small enough to read at once
+                self.stored = dict(((row.net, row.sta), (row.fingerprint, row.version))
+                                   for row in self.session.query(LoadManifest))
+        return self.stored
+
+    def _commit(self, function):
+        function()
+        self.session.commit()
+        return
+
+def has_manifest(session):
+    """ True when the database has the ir_loadmanifest table """
+    return inspect(session.connection()).has_table(LoadManifest.__tablename__)
+
+def forget(session, stations):
+    """
+        Removes stations, a list of (net, sta), from the manifest without
+        committing. Returns the number of entries removed.
+    """
+    stations = sorted(set(stations))
+    if not stations:
+        return 0
+    table = LoadManifest.__table__
+    result = session.execute(table.delete().where(tuple_(table.c.net, table.c.sta).in_(stations)))
+    if result.rowcount:
+        logging.info("Removed {} stations from {}".format(result.rowcount, LoadManifest.__tablename__))
+    return result.rowcount
@@ -0,0 +1,126 @@
+"""
+    Idempotent migrations of an existing AQMS Instrument Response schema.
+
+    Adds unique indexes on the dictionary lookup columns, which also make
+    the INSERT ... ON CONFLICT DO NOTHING in aqms_ir.dictionary safe when
+    several loaders run at the same time, and an index on
+    stacorrections(net, sta). The d_unit index is on the expression
+    (name, COALESCE(description, '')), so that units without a description
+    are unique as well; it replaces an index of the same name on the plain
+    columns. Indexes that already exist (under any name, on the same
+    columns, or under the same name for expression indexes) are left
+    alone, so migrate() can be run any number of times.
+
+        from aqms_ir.migrate import migrate
+        for name, status in migrate(engine):
+            print(name, status)
+"""
+import contextlib
+import logging
+from collections import namedtuple
+
+from sqlalchemy import inspect, text
+
+# name, table, columns (or SQL expressions), unique
+IndexMigration = namedtuple("IndexMigration", ["name", "table", "columns", "unique"])
+
+# NULL descriptions are distinct in a unique index on (name, description)
+UNIT_INDEX = IndexMigration("ux_d_unit_name_description", "d_unit", ["name", "COALESCE(description, '')"], True)
+
+MIGRATIONS = [
+    IndexMigration("ux_d_abbreviation_description", "d_abbreviation", ["description"], True),
+    UNIT_INDEX,
+    IndexMigration("ux_d_format_name", "d_format", ["name"], True),
+    IndexMigration("ix_stacorrections_net_sta", "stacorrections", ["net", "sta"], False),
+]
+
+def migrate(engine, dry_run=False, migrations=MIGRATIONS):
+    """
+        Applies the migrations that have not been applied yet.
+
+        :param dry_run: only report what would be done
+        :returns: list of (name, status), status is one of exists, created,
+            pending (dry_run), duplicates (unique index not created because
+            the table has duplicate entries) or missing table
+    """
+    results = []
+    for migration in migrations:
+        inspector = inspect(engine)
+        if not inspector.has_table(migration.table):
+            logging.warning("Table {} does not exist, skipping {}".format(migration.table, migration.name))
+            results.append((migration.name, "missing table"))
+            continue
+        if _exists(engine, inspector, migration):
+            results.append((migration.name, "exists"))
+            continue
+        if migration.unique:
+            duplicates = _duplicates(engine, migration)
+            if duplicates:
+                logging.error("Not adding {}: {} has {} duplicate {} entries, e.g. {}".format(migration.name,
+                              migration.table, len(duplicates), ",".join(migration.columns), duplicates[0]))
+                results.append((migration.name, "duplicates"))
+                continue
+        if dry_run:
+            results.append((migration.name, "pending"))
+            continue
+        with engine.begin() as connection:
+            if any(_is_expression(column) for column in migration.columns):
+                # replaces an index of the same name on the plain columns
+                connection.execute(text("DROP INDEX IF EXISTS {}".format(migration.name)))
+            connection.execute(text(_ddl(migration)))
+        logging.info("Created {}".format(migration.name))
+        results.append((migration.name, "created"))
+    return results
+
+def has_index(connection, migration):
+    """ True when the index of migration exists in the database of connection (an engine or connection) """
+    inspector = inspect(connection)
+    return inspector.has_table(migration.table) and _exists(connection, inspector, migration)
+
+def _exists(connection, inspector, migration):
+    """ True when an index or unique constraint on the same columns exists """
+    if any(_is_expression(column) for column in migration.columns):
+        # expression indexes are not reflected (SQLite) or reflected as rewritten SQL,
+        # look for an expression index of the same name
+        return migration.name in _expression_indexes(connection, inspector, migration.table)
+    for index in inspector.get_indexes(migration.table):
+        if index["column_names"] == migration.columns and (index.get("unique") or not migration.unique):
+            return True
+    if migration.unique:
+        for constraint in inspector.get_unique_constraints(migration.table):
+            if constraint["column_names"] == migration.columns:
+                return True
+    return False
+
+def _is_expression(column):
+    return "(" in column
+
+def _expression_indexes(connection, inspector, table):
+    """ names of the indexes of table on expressions """
+    if inspector.dialect.name == "sqlite":
+        query = text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table")
+        with _connect(connection) as sqlite:
+            names = [row[0] for row in sqlite.execute(query, {"table": table})]
+            # index_info has cid -2 for expressions
+            return set(name for name in names
+                       if any(row[1] == -2 for row in sqlite.execute(text('PRAGMA index_info("{}")'.format(name)))))
+    return set(index["name"] for index in inspector.get_indexes(table) if None in index["column_names"])
+
+def _connect(connection):
+    """ context of a connection of an engine, or of a connection that is left open """
+    if hasattr(connection, "connect"):
+        return connection.connect()
+    return contextlib.nullcontext(connection)
+
+def _duplicates(engine, migration):
+    """ values that occur more than once, NULLs do not violate a unique index """
+    columns = ", ".join(migration.columns)
+    not_null = " AND ".join("{} IS NOT NULL".format(column) for column in migration.columns)
+    query = "SELECT {0}, COUNT(*) FROM {1} WHERE {2} GROUP BY {0} HAVING COUNT(*) > 1".format(columns,
+            migration.table, not_null)
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.execute(text(query))]
+
+def _ddl(migration):
+    return "CREATE {}INDEX {} ON {} ({})".format("UNIQUE " if migration.unique else "", migration.name,
+                                                 migration.table, ", ".join(migration.columns))
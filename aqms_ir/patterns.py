@@ -0,0 +1,38 @@
+"""
+    FDSN style NET/STA/LOC/CHA patterns as SQL conditions.
+
+        match_pattern(Channel.seedchan, "[BEH]H?,EN*")
+"""
+from sqlalchemy import or_
+
+def match_pattern(column, pattern, location=False):
+    """
+        SQL condition for an FDSN pattern, None when it matches everything.
+        Besides * and ? the pattern may contain character sets like
+        [BEHS][HNL][123ENZ], which are expanded. Location codes "" and "--"
+        mean the blank location "  ".
+    """
+    if pattern is None or pattern == "*":
+        return None
+    conditions = []
+    for value in pattern.split(","):
+        value = value.strip()
+        if location and value in ("", "--"):
+            value = "  "
+        if value == "*":
+            return None
+        for expanded in _expand_sets(value):
+            if "*" in expanded or "?" in expanded:
+                conditions.append(column.like(expanded.replace("*", "%").replace("?", "_")))
+            else:
+                conditions.append(column == expanded)
+    return or_(*conditions)
+
+def _expand_sets(pattern):
+    """ all patterns obtained by replacing each [...] set with one of its characters """
+    start = pattern.find("[")
+    end = pattern.find("]", start)
+    if start < 0 or end < 0:
+        return [pattern]
+    return [pattern[:start] + character + rest for character in pattern[start + 1:end]
+            for rest in _expand_sets(pattern[end + 1:])]
@@ -0,0 +1,169 @@
+"""
+    Wall-clock timing and counters for the stages of a load (XML parsing,
+    dictionary lookups, simple_response, get_cliplevel, inserts per table,
+    commits, deletes).
+
+    Timings are only collected inside a collect() block, elsewhere stage()
+    and count() cost next to nothing. The active Timings object is kept per
+    thread, so concurrent loads do not mix their numbers.
+
+        timings = Timings()
+        with collect(timings):
+            with stage("xml_parse"):
+                inventory = read_inventory(xmlfile)
+            ...
+        timings.write("load.prom")
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+_current = threading.local()
+
+class Timings(object):
+    """
+        Accumulates the number of calls and seconds spent per stage,
+        and plain counters.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.started = time.time()
+        self._start = default_timer()
+
+    def add(self, name, seconds, calls=1):
+        entry = self.stages.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+        return
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        return
+
+    def merge(self, other):
+        """ adds the stages and counters of another Timings object """
+        for name, (calls, seconds) in other.stages.items():
+            self.add(name, seconds, calls)
+        for name, n in other.counters.items():
+            self.count(name, n)
+        return self
+
+    def elapsed(self):
+        return default_timer() - self._start
+
+    def as_dict(self):
+        return OrderedDict([
+            ("started", self.started),
+            ("elapsed", self.elapsed()),
+            ("stages", OrderedDict((name, {"calls": calls, "seconds": seconds})
+                                   for name, (calls, seconds) in self.stages.items())),
+            ("counters", OrderedDict(self.counters)),
+        ])
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def to_prometheus(self, prefix="aqms_ir_load"):
+        """ Prometheus text exposition format, e.g. for the node_exporter textfile collector """
+        lines = []
+        lines.append("# HELP {}_stage_seconds_total Wall-clock seconds spent per load stage".format(prefix))
+        lines.append("# TYPE {}_stage_seconds_total counter".format(prefix))
+        for name, (calls, seconds) in self.stages.items():
+            lines.append('{}_stage_seconds_total{{stage="{}"}} {:.6f}'.format(prefix, name, seconds))
+        lines.append("# HELP {}_stage_calls_total Number of calls per load stage".format(prefix))
+        lines.append("# TYPE {}_stage_calls_total counter".format(prefix))
+        for name, (calls, seconds) in self.stages.items():
+            lines.append('{}_stage_calls_total{{stage="{}"}} {}'.format(prefix, name, calls))
+        lines.append("# HELP {}_count_total Load counters".format(prefix))
+        lines.append("# TYPE {}_count_total counter".format(prefix))
+        for name, n in self.counters.items():
+            lines.append('{}_count_total{{name="{}"}} {}'.format(prefix, name, n))
+        lines.append("# HELP {}_duration_seconds Wall-clock duration of the load".format(prefix))
+        lines.append("# TYPE {}_duration_seconds gauge".format(prefix))
+        lines.append("{}_duration_seconds {:.6f}".format(prefix, self.elapsed()))
+        lines.append("# HELP {}_start_time_seconds Start of the load, seconds since the epoch".format(prefix))
+        lines.append("# TYPE {}_start_time_seconds gauge".format(prefix))
+        lines.append("{}_start_time_seconds {:.3f}".format(prefix, self.started))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename):
+        """
+            Writes the timings to filename, in Prometheus textfile format when the
+            name ends in .prom, as JSON otherwise. The file is replaced atomically.
+        """
+        if filename.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = self.to_json()
+        tmpfile = "{}.{}.tmp".format(filename, os.getpid())
+        with open(tmpfile, "w") as fp:
+            fp.write(content)
+        os.rename(tmpfile, filename)
+        return
+
+    def summary(self):
+        """ human readable table, slowest stage first """
+        lines = ["{:<32} {:>10} {:>12}".format("stage", "calls", "seconds")]
+        for name, (calls, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            lines.append("{:<32} {:>10} {:>12.3f}".format(name, calls, seconds))
+        for name, n in self.counters.items():
+            lines.append("{:<32} {:>10}".format(name, n))
+        lines.append("{:<32} {:>10} {:>12.3f}".format("total", "", self.elapsed()))
+        return "\n".join(lines)
+
+def current():
+    """ the Timings object collecting in this thread, or None """
+    return getattr(_current, "timings", None)
+
+@contextmanager
+def collect(timings):
+    """ makes timings the active Timings object of this thread """
+    previous = current()
+    _current.timings = timings
+    try:
+        yield timings
+    finally:
+        _current.timings = previous
+
+@contextmanager
+def stage(name):
+    """ times the enclosed block as one call of stage name """
+    timings = current()
+    if timings is None:
+        yield
+        return
+    start = default_timer()
+    try:
+        yield
+    finally:
+        timings.add(name, default_timer() - start)
+
+def count(name, n=1):
+    """ increments counter name of the active Timings object, if any """
+    timings = current()
+    if timings is not None:
+        timings.count(name, n)
+    return
+
+@contextmanager
+def profile(filename):
+    """
+        runs the enclosed block under cProfile and dumps the statistics to filename,
+        does nothing when filename is None.
+    """
+    if not filename:
+        yield None
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
@@ -0,0 +1,70 @@
+"""
+    Queries of the rows aqms_ir writes, shared by verify and changes.
+
+    database_rows reads the rows of a table for a set of stations with one
+    query, keyed by primary key, with the dictionary columns (net_id, inid,
+    unit_signal, unit_calib, format_id) replaced by their descriptions so
+    that they compare with the rows of aqms_ir.rows:
+
+        rows = database_rows(session, "channel_data", set([("UW", "SEP")]))
+"""
+import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from .schema import Abbreviation, Unit, Format
+from .sinks import MODELS
+
+def primary_key(table, values):
+    """ primary key tuple of a row or of a dictionary of column values """
+    get = values.get if isinstance(values, dict) else lambda name: getattr(values, name)
+    return tuple(get(column.key) for column in MODELS[table].__table__.primary_key.columns)
+
+def database_rows(session, table, stations, active=False):
+    """
+        {primary key: {column: value}} of all rows of table for stations, a set of
+        (net, sta), with one query, only the epochs open now when active.
+        Dictionary columns hold descriptions, units (name, description).
+    """
+    model = MODELS[table]
+    columns = list(model.__table__.columns)
+    joins = []
+    if table == "station_data":
+        network = aliased(Abbreviation)
+        columns.append(network.description.label("_net_id"))
+        joins.append((network, model.net_id == network.id))
+    elif table == "channel_data":
+        instrument = aliased(Abbreviation)
+        signal = aliased(Unit)
+        calib = aliased(Unit)
+        data_format = aliased(Format)
+        columns.extend([instrument.description.label("_inid"), signal.name.label("_unit_signal_name"),
+                        signal.description.label("_unit_signal_description"), calib.name.label("_unit_calib_name"),
+                        calib.description.label("_unit_calib_description"), data_format.name.label("_format_id")])
+        joins.extend([(instrument, model.inid == instrument.id), (signal, model.unit_signal == signal.id),
+                      (calib, model.unit_calib == calib.id), (data_format, model.format_id == data_format.id)])
+    query = select(*columns)
+    for target, condition in joins:
+        query = query.outerjoin(target, condition)
+    query = query.where(model.net.in_(sorted(set(net for net, sta in stations))),
+                        model.sta.in_(sorted(set(sta for net, sta in stations))))
+    if active:
+        query = query.where(model.offdate > datetime.datetime.utcnow())
+
+    rows = {}
+    for row in session.execute(query):
+        values = dict(row._mapping)
+        if (values["net"], values["sta"]) not in stations:
+            continue
+        if table == "station_data":
+            values["net_id"] = values.pop("_net_id")
+        elif table == "channel_data":
+            values["inid"] = values.pop("_inid")
+            values["format_id"] = values.pop("_format_id")
+            for column in ("unit_signal", "unit_calib"):
+                name = values.pop("_{}_name".format(column))
+                description = values.pop("_{}_description".format(column))
+                values[column] = (name, description) if values[column] is not None else None
+        rows[primary_key(table, values)] = values
+    return rows
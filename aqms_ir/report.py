@@ -0,0 +1,99 @@
+"""
+    LoadReport: outcome of one load, returned by inventory2db.
+
+    Keeps per-table counts of rows that were and were not written, and a
+    bounded sample of the failures with their error text, keyed by
+    NET.STA.LOC.CHA.ondate. Reports of loads that ran in parallel can be
+    combined with merge().
+"""
+import json
+from collections import OrderedDict
+
+# maximum number of failures kept per table
+MAX_SAMPLES = 100
+
+class LoadReport(object):
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.counts = OrderedDict()
+        self.failures = OrderedDict()
+
+    def _counts(self, table):
+        return self.counts.setdefault(table, OrderedDict([("good", 0), ("bad", 0)]))
+
+    def success(self, table, key=None):
+        self._counts(table)["good"] += 1
+        return
+
+    def failure(self, table, key, error=None):
+        self._counts(table)["bad"] += 1
+        samples = self.failures.setdefault(table, [])
+        if len(samples) < self.max_samples:
+            samples.append(OrderedDict([("key", key), ("error", None if error is None else str(error))]))
+        return
+
+    def good(self, table):
+        return self.counts.get(table, {}).get("good", 0)
+
+    def bad(self, table):
+        return self.counts.get(table, {}).get("bad", 0)
+
+    def tables_with_failures(self):
+        return [table for table, counts in self.counts.items() if counts["bad"] > 0]
+
+    def __bool__(self):
+        """ True when nothing failed """
+        return not self.tables_with_failures()
+    __nonzero__ = __bool__
+
+    def merge(self, other):
+        """ adds the counts and failure samples of another LoadReport, returns self """
+        for table, counts in other.counts.items():
+            mine = self._counts(table)
+            mine["good"] += counts["good"]
+            mine["bad"] += counts["bad"]
+        for table, samples in other.failures.items():
+            mine = self.failures.setdefault(table, [])
+            mine.extend(samples[:max(0, self.max_samples - len(mine))])
+        return self
+
+    def as_dict(self):
+        return OrderedDict([("counts", self.counts), ("failures", self.failures)])
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    @classmethod
+    def from_dict(cls, document, max_samples=MAX_SAMPLES):
+        report = cls(max_samples=max_samples)
+        for table, counts in document.get("counts", {}).items():
+            report._counts(table).update(counts)
+        for table, samples in document.get("failures", {}).items():
+            report.failures[table] = [OrderedDict([("key", s["key"]), ("error", s["error"])]) for s in samples]
+        return report
+
+    @classmethod
+    def from_json(cls, text, max_samples=MAX_SAMPLES):
+        return cls.from_dict(json.loads(text), max_samples=max_samples)
+
+    def summary(self, bad_only=True, abbreviated=False):
+        """ text listing the counts per table and, unless abbreviated, the failures """
+        indent = "    "
+        lines = []
+        for table, counts in self.counts.items():
+            if bad_only and not counts["bad"]:
+                continue
+            lines.append("{}: {} good, {} bad".format(table, counts["good"], counts["bad"]))
+            if abbreviated:
+                continue
+            samples = self.failures.get(table, [])
+            for sample in samples:
+                lines.append("{}{}: {}".format(indent, sample["key"], sample["error"]))
+            if counts["bad"] > len(samples):
+                lines.append("{}... {} more".format(indent, counts["bad"] - len(samples)))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "LoadReport: {}".format(", ".join("{}={}/{}".format(table, c["good"], c["bad"])
+                                                  for table, c in self.counts.items()))
@@ -0,0 +1,64 @@
+"""
+    Retries of database work that failed for a transient reason: a dropped
+    connection, a connection pool timeout, a serialization failure or
+    deadlock.
+
+        retry(lambda: insert_and_commit(rows), session=session)
+
+    Other errors, e.g. constraint violations, are raised right away.
+"""
+import logging
+import time
+
+from sqlalchemy import exc
+
+from .profiling import count
+
+# number of retries after the first attempt
+RETRIES = 3
+
+# seconds before the first retry, doubled for every next one
+BACKOFF = 1.0
+
+# serialization_failure and deadlock_detected, the transaction can be run again
+SQLSTATES = ("40001", "40P01")
+
+def is_transient(error):
+    """
+        True when error is worth retrying: the connection was lost, no
+        connection could be had from the pool in time, or the database
+        aborted the transaction for a serialization failure or deadlock.
+        Other OperationalErrors, e.g. a missing table, are permanent.
+    """
+    if isinstance(error, (exc.DisconnectionError, exc.TimeoutError)):
+        return True
+    if isinstance(error, exc.DBAPIError):
+        return error.connection_invalidated or _sqlstate(error.orig) in SQLSTATES
+    return False
+
+def _sqlstate(error):
+    """ SQLSTATE of a DBAPI error, psycopg2 (pgcode) or psycopg 3 (sqlstate) """
+    return getattr(error, "pgcode", None) or getattr(error, "sqlstate", None)
+
+def retry(function, retries=RETRIES, backoff=BACKOFF, session=None):
+    """
+        Returns function(), called up to retries more times when it raises a
+        transient error, waiting backoff, 2*backoff, 4*backoff ... seconds in
+        between. session is rolled back before every retry. The last error
+        is raised when all attempts failed.
+    """
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                raise
+            if session is not None:
+                session.rollback()
+            delay = backoff * 2 ** attempt
+            attempt += 1
+            count("retries")
+            logging.warning("Transient database error, retry {} of {} in {:.1f} s: {}".format(attempt, retries,
+                            delay, e))
+            time.sleep(delay)
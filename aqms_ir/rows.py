@@ -0,0 +1,477 @@
+"""
+    Lightweight row records for the AQMS Instrument Response tables and
+    a pure traversal of an obspy Inventory that produces them.
+
+    The traversal does not touch the database: values that live in the
+    dictionary tables (d_abbreviation, d_unit, d_format) are carried as
+    descriptions and resolved to ids by the sink that persists the rows,
+    see aqms_ir.sinks.
+"""
+import datetime
+import logging
+
+from .profiling import stage, count
+
+# station or channel end-date when none has been provided
+DEFAULT_ENDDATE = datetime.datetime(3000,1,1)
+
+# noise level in m/s used for determining cutoff level for Md
+CUTOFF_GM = 1.7297e-7
+
+# units for seismic channels
+SEISMIC_UNITS = ['M/S', 'm/s', 'M/S**2', 'm/s**2', 'M/S/S', 'm/s/s', 'CM/S', 'cm/s', 'CM/S**2', 'cm/s**2', 'CM/S/S', 'cm/s/s', 'M', 'm', 'CM', 'cm']
+# simple_response DU/M/S or DU/M/S**2 or counts/(cm/sec) counts/(cm/sec2)
+GAIN_UNITS = {'M/S' : 'DU/M/S',
+              'm/s' : 'DU/M/S',
+              'M/S**2' : 'DU/M/S**2',
+              'm/s**2' : 'DU/M/S**2',
+              'M/S/S' : 'DU/M/S**2',
+              'm/s/s' : 'DU/M/S**2',
+              'CM/S' : 'counts/(cm/sec)',
+              'cm/s': 'counts/(cm/sec)',
+              'CM/S**2' : 'counts/(cm/sec2)',
+              'cm/s**2' : 'counts/(cm/sec2)',
+              'CM/S/S' : 'counts/(cm/sec2)',
+              'cm/s/s' : 'counts/(cm/sec2)',
+              'M' : 'DU/M',
+              'm' : 'DU/M',
+              'CM' : 'counts/cm',
+              'cm' : 'counts/cm'
+             }
+
+class Row(object):
+    """
+        Base class of the row records. Subclasses list their fields in
+        __slots__, the name of the table they belong to in table, and
+        the columns whose value has to be looked up in a dictionary table
+        in lookups: {column: (dictionary, field)}, where dictionary is
+        one of abbreviation, unit or format.
+    """
+    __slots__ = ()
+    table = None
+    lookups = {}
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError("{} has no fields {}".format(self.__class__.__name__, list(kwargs)))
+
+    def as_dict(self):
+        """ all fields, including the unresolved dictionary values """
+        return dict((name, getattr(self,name)) for name in self.__slots__)
+
+    def columns(self):
+        """ fields that map directly onto a column of the table """
+        skip = set(field for dictionary, field in self.lookups.values())
+        return dict((name, getattr(self,name)) for name in self.__slots__ if name not in skip)
+
+    def key(self):
+        """ NET.STA.LOC.CHA.ondate, identifies the epoch in logs and load reports """
+        return "{}.{}.{}.{}.{}".format(self.net, self.sta, (self.location or "").strip(),
+                                       self.seedchan, _isoformat(self.ondate))
+
+    def __repr__(self):
+        return "{}: {}".format(self.__class__.__name__, ", ".join("{}={}".format(name,getattr(self,name)) for name in self.__slots__))
+
+class StationRow(Row):
+    table = "station_data"
+    lookups = {"net_id": ("abbreviation", "network_description")}
+    __slots__ = ("net", "sta", "ondate", "offdate", "lat", "lon", "elev", "staname", "network_description")
+
+    def key(self):
+        return "{}.{}.{}".format(self.net, self.sta, _isoformat(self.ondate))
+
+class ChannelRow(Row):
+    table = "channel_data"
+    lookups = {"inid": ("abbreviation", "instrument"),
+               "unit_signal": ("unit", "signal_unit"),
+               "unit_calib": ("unit", "calib_unit"),
+               "format_id": ("format", "format_name")}
+    __slots__ = ("net", "sta", "seedchan", "location", "ondate", "offdate", "lat", "lon", "elev",
+                 "edepth", "azimuth", "dip", "samprate", "flags", "instrument", "signal_unit",
+                 "calib_unit", "format_name")
+
+class SimpleResponseRow(Row):
+    table = "simple_response"
+    __slots__ = ("net", "sta", "seedchan", "location", "ondate", "offdate", "channel",
+                 "natural_frequency", "damping_constant", "gain", "gain_units",
+                 "low_freq_corner", "high_freq_corner")
+
+class CodaParmsRow(Row):
+    table = "channelmap_codaparms"
+    __slots__ = ("net", "sta", "seedchan", "location", "ondate", "offdate", "channel", "cutoff")
+
+class AmpParmsRow(Row):
+    table = "channelmap_ampparms"
+    __slots__ = ("net", "sta", "seedchan", "location", "ondate", "offdate", "channel", "clip")
+
+class SensitivityRow(Row):
+    table = "sensitivity"
+    __slots__ = ("net", "sta", "seedchan", "location", "ondate", "offdate", "stage_seq",
+                 "sensitivity", "frequency")
+
+class PolesZerosRow(Row):
+    """
+        One poles_zeros row. pz_name, zeros and poles end up in the pz and
+        pz_data tables, the sink fills in pz_key.
+    """
+    table = "poles_zeros"
+    lookups = {"unit_in": ("unit", "input_unit"),
+               "unit_out": ("unit", "output_unit")}
+    __slots__ = ("net", "sta", "seedchan", "location", "ondate", "offdate", "stage_seq",
+                 "tf_type", "ao", "af", "input_unit", "output_unit", "pz_name", "zeros", "poles")
+
+    def columns(self):
+        columns = Row.columns(self)
+        for name in ("pz_name", "zeros", "poles"):
+            del columns[name]
+        return columns
+
+def inventory2rows(inventory, active=False, include_pz=False, responses=None, report=None):
+    """
+        Generator of the rows for all stations and channels in an obspy Inventory.
+
+        :param active: only produce currently active stations and channels
+        :param include_pz: also produce poles_zeros rows
+        :param report: aqms_ir.report.LoadReport that receives the failed
+            normalization checks of the responses, they are logged without it
+    """
+    for network in inventory.networks:
+        for station in network.stations:
+            for row in station2rows(network, station, inventory.source, active=active, include_pz=include_pz,
+                                    responses=responses, report=report):
+                yield row
+
+def station2rows(network, station, source, active=False, include_pz=False, responses=None, report=None):
+    """
+        Generator of the StationRow and the rows of all its channels.
+        Produces nothing when active is True and the station has been closed.
+        The normalization checks of the responses of all channels are
+        evaluated in one pass, see aqms_ir.util.stage_diagnostics.
+    """
+    station_row = StationRow(net=network.code, sta=station.code, ondate=station.start_date.datetime,
+                             offdate=_offdate(station), lat=station.latitude, lon=station.longitude,
+                             elev=station.elevation, staname=station.site.name,
+                             network_description=network.description)
+
+    if active and station_row.offdate < datetime.datetime.utcnow():
+        logging.info("Station {}.{} not active, not adding".format(network.code,station.code))
+        return
+    count("stations")
+    yield station_row
+
+    diagnostics = _station_diagnostics(station.channels, active)
+    for channel in station.channels:
+        try:
+            rows = channel2rows(network.code, station.code, channel, source, active=active, include_pz=include_pz,
+                                responses=responses, diagnostics=diagnostics.get(id(channel)), report=report)
+        except Exception as e:
+            logging.error("Unable to add channel {} to db: {}".format(channel.code, e))
+            continue
+        count("channels")
+        for row in rows:
+            yield row
+
+def channel2rows(network_code, station_code, channel, source, active=False, include_pz=False, responses=None,
+                 diagnostics=None, report=None):
+    """
+        Returns a list with the ChannelRow and the response rows of an obspy Channel.
+        The list is empty when active is True and the channel has been closed.
+        responses is an optional ResponseCache, diagnostics the stage_diagnostics
+        of the response when they have been evaluated already, failed ones go
+        to report, an optional LoadReport.
+    """
+    description = None
+    if source != "IRIS-DMC":
+        try:
+            description = "{},{},{}".format(channel.sensor.model,channel.sensor.description,channel.sensor.manufacturer)
+        except Exception as e:
+            logging.error("Unable to change sensor description of channel {}.{} to db: {}".format(station_code,channel.code, e))
+    if description is None:
+        description = channel.sensor.description
+
+    calib_unit = (channel.calibration_units, channel.calibration_units_description)
+    if hasattr(channel.response,"instrument_sensitivity") and channel.response.instrument_sensitivity:
+        sensitivity = channel.response.instrument_sensitivity
+        signal_unit = (sensitivity.input_units, sensitivity.input_units_description)
+    elif hasattr(channel.response,"instrument_polynomial") and channel.response.instrument_polynomial:
+        polynomial = channel.response.instrument_polynomial
+        signal_unit = (polynomial.input_units, polynomial.input_units_description)
+    else:
+        signal_unit = None
+
+    channel_row = ChannelRow(net=network_code, sta=station_code, seedchan=channel.code,
+                             location=fix(channel.location_code), ondate=channel.start_date.datetime,
+                             offdate=_offdate(channel), instrument=description, signal_unit=signal_unit,
+                             calib_unit=calib_unit)
+
+    # skip if active is true and the channel's offdate pre-dates today
+    if active and channel_row.offdate < datetime.datetime.utcnow():
+        logging.info("Channel {}.{}.{}.{} not active, not adding".format(network_code,station_code,channel.code,channel.location_code))
+        return []
+
+    channel_row.lat = channel.latitude
+    channel_row.lon = channel.longitude
+    channel_row.elev = channel.elevation
+    channel_row.edepth = channel.depth
+    channel_row.azimuth = float(channel.azimuth)
+    channel_row.dip = float(channel.dip)
+    channel_row.samprate = float(channel.sample_rate)
+    channel_row.flags = ''.join(t[0] for t in channel.types)
+
+    rows = [channel_row]
+    if channel.response:
+        try:
+            _response_rows(rows, network_code, station_code, channel, description, include_pz, responses,
+                           diagnostics, report)
+        except Exception as e:
+            logging.error("Unable to add response for {}.{}.{} to db: {}".format(network_code,station_code,channel.code,e))
+
+    return rows
+
+def _response_rows(rows, network_code, station_code, channel, description, include_pz, responses=None,
+                   diagnostics=None, report=None):
+    """
+        Appends the simple_response, channelmap_codaparms, channelmap_ampparms,
+        sensitivity and (optionally) poles_zeros rows of a channel to rows.
+    """
+    # for now, only fill simple_response, channelmap_ampparms and channelmap_codaparms tables
+    _simple_response_rows(rows, network_code, station_code, channel, description, responses, diagnostics, report)
+
+    # overall sensitivity
+    if hasattr(channel.response,"instrument_sensitivity") and channel.response.instrument_sensitivity:
+        rows.append(SensitivityRow(net=network_code, sta=station_code, seedchan=channel.code,
+                                   location=fix(channel.location_code), ondate=channel.start_date.datetime,
+                                   offdate=_offdate(channel), stage_seq=0,
+                                   sensitivity=channel.response.instrument_sensitivity.value,
+                                   frequency=channel.response.instrument_sensitivity.frequency))
+
+    if include_pz:
+        pz_row = _poles_zeros_row(network_code, station_code, channel)
+        if pz_row:
+            rows.append(pz_row)
+    return
+
+def _simple_response_rows(rows, network_code, station_code, channel, description, responses=None,
+                          diagnostics=None, report=None):
+    if not hasattr(channel.response,"instrument_sensitivity") or not channel.response.instrument_sensitivity:
+        logging.warning("{}-{} does not have an instrument sensitivity, no response".format(station_code,channel.code))
+        return
+
+    if not hasattr(channel.response.instrument_sensitivity,"input_units") or \
+           channel.response.instrument_sensitivity.input_units not in SEISMIC_UNITS:
+        logging.warning("{}-{} is not a seismic component, no response".format(station_code,channel.code))
+        return
+
+    if responses is None:
+        responses = ResponseCache(size=0)
+    fn, damping, lowest_freq, highest_freq, gain = responses.simple_response(channel.sample_rate,channel.response,
+                                                                             diagnostics)
+
+    common = dict(net=network_code, sta=station_code, seedchan=channel.code,
+                  location=fix(channel.location_code), ondate=channel.start_date.datetime,
+                  offdate=_offdate(channel), channel=channel.code)
+
+    # gcda codes(rad2,ampgen) currently only understand DU/M/S or DU/M/S**2
+    simple_response_row = SimpleResponseRow(natural_frequency=fn, damping_constant=damping, gain=gain,
+                                            gain_units=GAIN_UNITS[channel.response.instrument_sensitivity.input_units],
+                                            low_freq_corner=highest_freq, high_freq_corner=lowest_freq, **common)
+    rows.append(simple_response_row)
+    _report_diagnostics(report, simple_response_row.key(), diagnostics)
+
+    # next fill channelmap_codaparms (only for seismic channels, verticals)
+    if channel.dip != 0.0:
+        cutoff = gain * CUTOFF_GM # cutoff in counts
+        # this is too low for strong-motion channels, multiply with 1000 to get something reasonable
+        if channel.code[1] == "N":
+            cutoff = 1000.0 * cutoff
+        rows.append(CodaParmsRow(cutoff=cutoff, **common))
+
+    # next fill channelmap_ampparms, for seismic channels only, all components
+    clip = channel_cliplevel(network_code, station_code, channel, description, gain)
+    if clip == -1:
+        logging.error("No valid clip level found for {}".format(channel))
+    rows.append(AmpParmsRow(clip=clip, **common))
+    return
+
+def _station_diagnostics(channels, active=False):
+    """
+        stage_diagnostics of the channels that get a simple response, in one
+        pass, as {id(channel): [StageDiagnostic]}. Empty when the batch can
+        not be evaluated, the channels are then checked one by one.
+    """
+    from .util import stage_diagnostics
+
+    now = datetime.datetime.utcnow()
+    responses = [(id(channel), channel.response) for channel in channels
+                 if _has_simple_response(channel) and not (active and _offdate(channel) < now)]
+    diagnostics = {}
+    if not responses:
+        return diagnostics
+    try:
+        with stage("diagnostics"):
+            for diagnostic in stage_diagnostics(responses):
+                diagnostics.setdefault(diagnostic.channel, []).append(diagnostic)
+    except Exception as e:
+        logging.debug("Unable to check the responses in one pass: {}".format(e))
+        return {}
+    return diagnostics
+
+def _has_simple_response(channel):
+    sensitivity = getattr(channel.response, "instrument_sensitivity", None) if channel.response else None
+    return bool(sensitivity) and getattr(sensitivity, "input_units", None) in SEISMIC_UNITS
+
+def _report_diagnostics(report, key, diagnostics):
+    """ records the failed normalization checks of a channel in report, logs them without one """
+    from .util import describe
+
+    failed = [describe(diagnostic) for diagnostic in diagnostics or [] if not diagnostic.ok]
+    if not failed:
+        return
+    if report is None:
+        logging.warning("{}: {}".format(key, "; ".join(failed)))
+    else:
+        report.failure("normalization", key, "; ".join(failed))
+    return
+
+class ResponseCache(object):
+    """
+        Remembers the results of aqms_ir.util.simple_response, keyed on the
+        sample rate and the values of the response stages, so that channels
+        with identical responses (other components, other epochs, the same
+        file loaded again) are only calculated once. Holds at most size
+        responses, nothing when size is 0.
+    """
+    def __init__(self, size=10000):
+        self.size = size
+        self.responses = {}
+
+    def simple_response(self, sample_rate, response, diagnostics=None):
+        from .util import simple_response
+
+        key = _response_key(sample_rate, response) if self.size else None
+        if key is not None and key in self.responses:
+            count("response_cache_hits")
+            return self.responses[key]
+        with stage("simple_response"):
+            value = simple_response(sample_rate, response, diagnostics)
+        if key is not None and len(self.responses) < self.size:
+            self.responses[key] = value
+        return value
+
+def _response_key(sample_rate, response):
+    """ hashable summary of everything simple_response looks at, None if there is none """
+    try:
+        sensitivity = response.instrument_sensitivity
+        stages = tuple((getattr(s, "stage_gain", None), getattr(s, "normalization_factor", None),
+                        getattr(s, "normalization_frequency", None),
+                        tuple(complex(p) for p in getattr(s, "poles", None) or []),
+                        tuple(complex(z) for z in getattr(s, "zeros", None) or []))
+                       for s in response.response_stages)
+        return (float(sample_rate), sensitivity.value, sensitivity.frequency, sensitivity.input_units, stages)
+    except Exception:
+        return None
+
+def channel_cliplevel(network_code, station_code, channel, description, gain):
+    """
+        Returns the clip level in counts of a channel, -1 if unknown.
+        description is the instrument description as stored in d_abbreviation.
+    """
+    from .util import parse_instrument_identifier, get_cliplevel
+
+    clip = -1
+    if network_code in ["UW", "CC", "UO", "HW"]:
+
+        # get sensor and logger info
+        if "=" in description and "-" in description:
+            # PNSN instrument identifier
+            sensor, sensor_sn, logger, logger_sn = parse_instrument_identifier(description)
+        elif len(description.split(",")) == 3:
+            # possibly instrument identifier from SIS dataless->IRIS->StationXML
+            sensor, sensor_sn, logger, logger_sn = parse_instrument_identifier(description)
+        else:
+            # from SIS with all fields entered
+            sensor = channel.sensor.type
+            sensor_sn = channel.sensor.serial_number
+            logger = channel.data_logger.type
+            logger_sn = channel.data_logger.serial_number
+
+        if sensor and not logger and sensor == "None":
+            # no information, assume old analog, force earthworm digitizer cliplevel.
+            logger = "LEGACY"
+
+        logging.info("{}-{}: channel equipment: {}-{}={}-{}".format(station_code,channel.code,sensor,sensor_sn,logger,logger_sn))
+
+        try:
+            with stage("get_cliplevel"):
+                clip = get_cliplevel(sensor,sensor_sn,logger,logger_sn, gain)
+        except Exception as err:
+            logging.error("Cannot determine cliplevel {}: {}".format(channel.sensor,err))
+
+    else:
+        # first see if there is something like 2g,3g,4g in instrument identifier
+        if "2g" in description:
+            clip = gain * 2 * 9.8
+        elif "4g" in description:
+            clip = gain * 4 * 9.8
+        elif "1g" in description:
+            clip = gain * 9.8
+        elif "3g" in description:
+            clip = gain * 3 * 9.8
+        elif channel.code[1] == "N" or channel.code[1] == "L":
+            # strong-motion, assume 4g
+            clip = gain * 4 * 9.8
+        elif channel.code[0:2] in ["EH", "SH"]:
+            # short-period
+            clip = gain * 0.0001
+        elif channel.code[0:2] in ["LH", "MH", "BH", "HH"]:
+            # 1 cm/s
+            clip = gain * 0.0100
+    return clip
+
+def _poles_zeros_row(network_code, station_code, channel):
+    """
+       TO DO:
+            - get the name of the poles_zeros response if it exists (pz.name), USE IT for PZ table. If not,
+              see if there is a sensor description and use it. If not, make something up like you did here.
+            - If the named response is already in the database PZ table, use its pz_key to retrieve the info from PZ_Data,
+              if the poles and zeros are the same, do not add another entry to PZ and PZ_Data.
+            - get the stage_sequence number from it, pz.stage_sequence_number and USE IT for Poles_Zeros.stage_seq.
+    """
+    try:
+        pz = channel.response.get_paz()
+    except Exception as e:
+        pz = None
+    if not pz:
+        logging.warning("sta:{} chan:{} has no pz stage!".format(station_code, channel.code))
+        return None
+
+    # May need to expand testing to determine if this is A (Laplace - rad/s) or B (Hz - /s)
+    tf_type='B'
+    if "LAPLACE" in pz.pz_transfer_function_type or "RADIAN" in pz.pz_transfer_function_type:
+        tf_type='A'
+
+    return PolesZerosRow(net=network_code, sta=station_code, seedchan=channel.code,
+                         location=fix(channel.location_code), ondate=channel.start_date.datetime,
+                         offdate=_offdate(channel), stage_seq=0, tf_type=tf_type,
+                         ao=pz.normalization_factor, af=pz.normalization_frequency,
+                         input_unit=(pz.input_units, pz.input_units_description),
+                         output_unit=(pz.output_units, pz.output_units_description),
+                         pz_name="Key to polezero response for sta:%s cha:%s" % (station_code, channel.code),
+                         zeros=list(pz.zeros), poles=list(pz.poles))
+
+def _isoformat(date):
+    return date.isoformat() if date is not None else None
+
+def _offdate(epoch):
+    """ end date of an obspy Station or Channel, DEFAULT_ENDDATE if open """
+    if hasattr(epoch,"end_date") and epoch.end_date:
+        return epoch.end_date.datetime
+    return DEFAULT_ENDDATE
+
+def fix(location):
+    if location == "":
+        return "  "
+    else:
+        return location
@@ -4,7 +4,7 @@
 import datetime
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import text
+from sqlalchemy import func
 from sqlalchemy import Column, DateTime, Integer, Numeric, String, ForeignKey
 from sqlalchemy import Sequence
 
@@ -59,7 +59,7 @@ class Station(Base):
     word_32 = Column('word_32', Numeric, nullable=False, default=3210)
     word_16 = Column('word_16', Numeric, nullable=False, default=10)
     offdate = Column('offdate', DateTime, default=datetime.datetime(3000,1,1))
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
 
     def __repr__(self):
         return "Station: net={}, sta={}, ondate={}, staname={}, lat={}, lon={}, elev={}".\
@@ -95,7 +95,7 @@ class Channel(Base):
     clock_drift = Column('clock_drift', Numeric)
     flags = Column('flags', String(27), info="channel flags", default="CG")
     offdate = Column('offdate', DateTime, default=datetime.datetime(3000,1,1))
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
 
     def __repr__(self):
         return "Channel: net={}, sta={}, seedchan={}, location={}, ondate={}, offdate={}".\
@@ -118,7 +118,7 @@ class SimpleResponse(Base):
     low_freq_corner = Column('low_freq_corner', Numeric)
     high_freq_corner = Column('high_freq_corner', Numeric)
     offdate = Column('offdate', DateTime, default=datetime.datetime(3000,1,1))
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
     dlogsens = Column('dlogsens', Numeric)
 
     def __repr__(self):
@@ -141,7 +141,7 @@ class AmpParms(Base):
     channel = Column('channel', String(8))
     channelsrc = Column('channelsrc', String(8), default="SEED")
     clip = Column('clip', Numeric)
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
 
     def __repr__(self):
         return "AmpParms: net={}, sta={}, seedchan={}, location={}, ondate={}, \
@@ -163,7 +163,7 @@ class CodaParms(Base):
     cutoff = Column('cutoff', Numeric)
     gain_corr = Column('gain_corr', Numeric)
     summary_wt = Column('summary_wt', Numeric)
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
 
     def __repr__(self):
         return "CodaParms: net={}, sta={}, seedchan={}, location={}, ondate={}, \
@@ -186,7 +186,7 @@ class Sensitivity(Base):
     channelsrc = Column('channelsrc', String(8), default="SEED")
     sensitivity = Column('sensitivity', Numeric)
     frequency = Column('frequency', Numeric)
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
 
     def __repr__(self):
         return "Sensitivity: net={}, sta={}, seedchan={}, location={}, ondate={}, \
@@ -241,7 +241,7 @@ class Poles_Zeros(Base):
     unit_out = Column('unit_out', Integer, nullable=False)
     ao = Column('ao', Numeric, nullable=False)
     af = Column('af', Numeric)
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
 
     def __repr__(self):
         return "Poles_Zeros: net={}, sta={}, seedchan={}, location={}, ondate={}, \
@@ -265,7 +265,7 @@ class PZ(Base):
 
     key  = Column('key', Integer, Sequence('pzseq'), primary_key=True, nullable=False)
     name = Column('name', String(80))
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
 
     def __repr__(self):
         return "class PZ: key={}, name=[{}]".format(self.key, self.name)
@@ -315,10 +315,91 @@ class StaCorrection(Base):
     corr = Column('corr', Numeric, nullable=False)
     corr_flag = Column('corr_flag', String(1))
     corr_type = Column('corr_type', String(3), primary_key=True, nullable=False)
-    lddate = Column('lddate', DateTime, server_default=text('NOW()'))
+    lddate = Column('lddate', DateTime, server_default=func.now())
 
     def __repr__(self):
         return "StaCorrection: net={}, sta={}, seedchan={}, location={}, ondate={}, \
                 offdate={}, corr={}, corr_type={}".\
                 format(self.net, self.sta, self.seedchan, self.location, self.ondate, \
                 self.offdate, self.corr, self.corr_type)
+
+class ChangeLog(Base):
+    """ channel epochs inserted, updated or deleted by the loads, see aqms_ir.changes """
+    __tablename__ = "ir_changelog"
+
+    id = Column('id', Integer, Sequence('irchangeseq'), primary_key=True, nullable=False)
+    net = Column('net', String(8), nullable=False)
+    sta = Column('sta', String(6), nullable=False)
+    seedchan = Column('seedchan', String(3), nullable=False)
+    location = Column('location', String(2), nullable=False)
+    ondate = Column('ondate', DateTime, nullable=False)
+    change = Column('change', String(8), nullable=False)
+    lddate = Column('lddate', DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return "ChangeLog: id={}, net={}, sta={}, seedchan={}, location={}, ondate={}, change={}".\
+                format(self.id, self.net, self.sta, self.seedchan, self.location, self.ondate, self.change)
+
+class LoadManifest(Base):
+    """ fingerprint of the StationXML of every station as it was last loaded, see aqms_ir.manifest """
+    __tablename__ = "ir_loadmanifest"
+
+    net = Column('net', String(8), primary_key=True, nullable=False)
+    sta = Column('sta', String(6), primary_key=True, nullable=False)
+    fingerprint = Column('fingerprint', String(64), nullable=False)
+    version = Column('version', String(16), nullable=False)
+    lddate = Column('lddate', DateTime, nullable=False)
+
+    def __repr__(self):
+        return "LoadManifest: net={}, sta={}, fingerprint={}, version={}, lddate={}".\
+                format(self.net, self.sta, self.fingerprint, self.version, self.lddate)
+
+class ActiveChannel(Base):
+    """ current parameters of every active channel, one row per channel, see aqms_ir.active_channels """
+    __tablename__ = "ir_activechannel"
+
+    net = Column('net', String(8), primary_key=True, nullable=False)
+    sta = Column('sta', String(6), primary_key=True, nullable=False)
+    seedchan = Column('seedchan', String(3), primary_key=True, nullable=False)
+    location = Column('location', String(2), primary_key=True, nullable=False)
+    ondate = Column('ondate', DateTime, nullable=False)
+    offdate = Column('offdate', DateTime)
+    channel = Column('channel', String(8))
+    samprate = Column('samprate', Numeric)
+    lat = Column('lat', Numeric)
+    lon = Column('lon', Numeric)
+    elev = Column('elev', Numeric)
+    gain = Column('gain', Numeric)
+    gain_units = Column('gain_units', String)
+    low_freq_corner = Column('low_freq_corner', Numeric)
+    high_freq_corner = Column('high_freq_corner', Numeric)
+    natural_frequency = Column('natural_frequency', Numeric)
+    damping_constant = Column('damping_constant', Numeric)
+    dlogsens = Column('dlogsens', Numeric)
+    clip = Column('clip', Numeric)
+    cutoff = Column('cutoff', Numeric)
+    gain_corr = Column('gain_corr', Numeric)
+    summary_wt = Column('summary_wt', Numeric)
+    ml_corr = Column('ml_corr', Numeric)
+    me_corr = Column('me_corr', Numeric)
+    md_corr = Column('md_corr', Numeric)
+    lddate = Column('lddate', DateTime, nullable=False)
+
+    def __repr__(self):
+        return "ActiveChannel: net={}, sta={}, seedchan={}, location={}, ondate={}, offdate={}, gain={} ({}), \
+                clip={}, cutoff={}, ml_corr={}, me_corr={}".\
+                format(self.net, self.sta, self.seedchan, self.location, self.ondate, self.offdate, \
+                self.gain, self.gain_units, self.clip, self.cutoff, self.ml_corr, self.me_corr)
+
+# tables of optional features, only created when the feature is asked for
+OPTIONAL_MODELS = [ChangeLog, LoadManifest, ActiveChannel]
+
+def create_tables(engine, optional=()):
+    """
+        Creates the tables that do not exist yet, of the OPTIONAL_MODELS only
+        those of the models listed in optional.
+    """
+    skipped = [model.__table__ for model in OPTIONAL_MODELS if model not in optional]
+    Base.metadata.create_all(engine, tables=[table for table in Base.metadata.sorted_tables
+                                             if table not in skipped])
+    return
@@ -0,0 +1,270 @@
+"""
+    The reverse of inv2schema: rebuilds obspy Inventory objects from the
+    AQMS tables station_data, channel_data, sensitivity and (optionally)
+    poles_zeros/pz_data.
+
+    Each table is read with one query per network for the whole NET/STA
+    selection and the rows are grouped in memory, so the number of
+    round trips does not grow with the number of channels. Networks are
+    produced one at a time, write_stationxml streams them to a file
+    without holding the complete inventory.
+
+        inventory = db2inventory(session, network="UW", station="S*")
+        write_stationxml(session, "UW.xml", network="UW")
+"""
+import datetime
+import io
+import logging
+
+from lxml import etree
+
+from obspy import UTCDateTime
+from obspy.core.inventory import Inventory, Network, Station, Channel, Site, Equipment
+from obspy.core.inventory.response import Response, InstrumentSensitivity, PolesZerosResponseStage
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from .compressed import open_output
+from .patterns import match_pattern
+from .rows import DEFAULT_ENDDATE
+from .schema import Abbreviation, Unit, Station as StationData, Channel as ChannelData
+from .schema import Sensitivity, Poles_Zeros, PZ_Data
+
+# StationXML level of detail, in increasing order
+LEVELS = ["network", "station", "channel", "response"]
+
+# channel_data.flags holds the first letter of each channel type
+CHANNEL_TYPES = dict((t[0], t) for t in ["TRIGGERED", "CONTINUOUS", "HEALTH", "GEOPHYSICAL", "WEATHER",
+                                         "FLAG", "SYNTHESIZED", "INPUT", "EXPERIMENTAL", "MAINTENANCE", "BEAM"])
+
+# poles_zeros.tf_type
+TRANSFER_FUNCTION_TYPES = {"A": "LAPLACE (RADIANS/SECOND)", "B": "LAPLACE (HERTZ)"}
+
+STATIONXML_NAMESPACE = "http://www.fdsn.org/xml/station/1"
+
+def db2inventory(session, network="*", station="*", location="*", channel="*", level="response",
+                 active=False, include_pz=True, source="AQMS"):
+    """
+        Returns an obspy Inventory with the selected networks, stations and channels.
+
+        :param network, station, location, channel: FDSN style selection, with
+            wildcards (* and ?) and comma separated lists
+        :param level: network, station, channel or response
+        :param active: only return epochs that are open now
+        :param include_pz: add the poles and zeros stage to the responses
+    """
+    networks = list(iter_networks(session, network=network, station=station, location=location,
+                                  channel=channel, level=level, active=active, include_pz=include_pz))
+    return Inventory(networks=networks, source=source)
+
+def iter_networks(session, network="*", station="*", location="*", channel="*", level="response",
+                  active=False, include_pz=True):
+    """
+        Generator of obspy Network objects, see db2inventory for the arguments.
+    """
+    if level not in LEVELS:
+        raise ValueError("level has to be one of {}".format(", ".join(LEVELS)))
+    selection = _Selection(network, station, location, channel, active)
+
+    query = select(StationData.net, Abbreviation.description).\
+            outerjoin(Abbreviation, StationData.net_id == Abbreviation.id).\
+            where(*selection.stations(StationData)).order_by(StationData.net, StationData.ondate)
+    descriptions = {}
+    for net, description in session.execute(query):
+        if net not in descriptions or description:
+            descriptions[net] = description
+
+    for net in sorted(descriptions):
+        obspy_network = Network(code=net, description=descriptions[net])
+        if LEVELS.index(level) >= LEVELS.index("station"):
+            obspy_network.stations = _stations(session, net, selection, level, include_pz)
+        yield obspy_network
+
+def write_stationxml(session, filename, network="*", station="*", location="*", channel="*",
+                     level="response", active=False, include_pz=True, source="AQMS", compression=None):
+    """
+        Writes the selection as FDSN StationXML to filename (a path or a binary
+        file object), one network at a time. Returns the number of networks written.
+        The output is compressed with compression (gzip or zstd), by default
+        according to the extension of filename (.gz, .zst).
+    """
+    header = _render(Inventory(networks=[], source=source, module="aqms-ir",
+                               module_uri="https://github.com/pnsn/aqms-ir"), level)
+    n = 0
+    with open_output(filename, compression) as fp, etree.xmlfile(fp, encoding="UTF-8") as xf:
+        xf.write_declaration()
+        with xf.element(header.tag, nsmap=header.nsmap, attrib=dict(header.attrib)):
+            for element in header:
+                xf.write(element)
+            for obspy_network in iter_networks(session, network=network, station=station, location=location,
+                                               channel=channel, level=level, active=active, include_pz=include_pz):
+                for element in _render(Inventory(networks=[obspy_network], source=source), level).\
+                        iterchildren(_tag("Network")):
+                    xf.write(element)
+                xf.flush()
+                n += 1
+                logging.info("Wrote network {} with {} stations".format(obspy_network.code, len(obspy_network.stations)))
+    return n
+
+def _render(inventory, level):
+    """ StationXML root element of inventory, written by obspy's public writer """
+    buf = io.BytesIO()
+    inventory.write(buf, format="STATIONXML", level=level)
+    return etree.fromstring(buf.getvalue())
+
+def _tag(name):
+    return "{{{}}}{}".format(STATIONXML_NAMESPACE, name)
+
+class _Selection(object):
+    """ FDSN style NET/STA/LOC/CHA selection translated to SQL conditions """
+
+    def __init__(self, network, station, location, channel, active):
+        self.network = network
+        self.station = station
+        self.location = location
+        self.channel = channel
+        self.active = active
+
+    def stations(self, model, net=None):
+        conditions = [match_pattern(model.net, net or self.network), match_pattern(model.sta, self.station)]
+        if self.active:
+            conditions.append(model.offdate > datetime.datetime.utcnow())
+        return [c for c in conditions if c is not None]
+
+    def channels(self, model, net=None):
+        conditions = self.stations(model, net)
+        location = match_pattern(model.location, self.location, location=True)
+        channel = match_pattern(model.seedchan, self.channel)
+        return conditions + [c for c in (location, channel) if c is not None]
+
+def _stations(session, net, selection, level, include_pz):
+    query = select(StationData).where(*selection.stations(StationData, net)).\
+            order_by(StationData.sta, StationData.ondate)
+    stations = []
+    epochs = {}
+    for row in session.execute(query).scalars():
+        obspy_station = Station(code=row.sta, latitude=_float(row.lat), longitude=_float(row.lon),
+                                elevation=_float(row.elev), site=Site(name=row.staname),
+                                start_date=UTCDateTime(row.ondate), end_date=_end_date(row.offdate))
+        stations.append(obspy_station)
+        epochs.setdefault(row.sta, []).append(obspy_station)
+
+    if stations and LEVELS.index(level) >= LEVELS.index("channel"):
+        for sta, channel in _channels(session, net, selection, level, include_pz):
+            station_epoch = _station_epoch(epochs.get(sta, []), channel.start_date)
+            if station_epoch is None:
+                logging.warning("No station epoch for {}.{}.{} starting {}".format(net, sta, channel.code, channel.start_date))
+                continue
+            station_epoch.channels.append(channel)
+    return stations
+
+def _station_epoch(epochs, start_date):
+    """ the station epoch that contains start_date, the last one that started before it otherwise """
+    candidate = None
+    for epoch in epochs:
+        if epoch.start_date <= start_date:
+            candidate = epoch
+            if epoch.end_date is None or start_date < epoch.end_date:
+                return epoch
+    return candidate
+
+def _channels(session, net, selection, level, include_pz):
+    """ list of (sta, obspy Channel) of a network, with responses when level is response """
+    SignalUnit = aliased(Unit)
+    CalibUnit = aliased(Unit)
+    query = select(ChannelData, Abbreviation.description, SignalUnit.name, SignalUnit.description,
+                   CalibUnit.name, CalibUnit.description).\
+            outerjoin(Abbreviation, ChannelData.inid == Abbreviation.id).\
+            outerjoin(SignalUnit, ChannelData.unit_signal == SignalUnit.id).\
+            outerjoin(CalibUnit, ChannelData.unit_calib == CalibUnit.id).\
+            where(*selection.channels(ChannelData, net)).\
+            order_by(ChannelData.sta, ChannelData.location, ChannelData.seedchan, ChannelData.ondate)
+
+    responses = {}
+    if level == "response":
+        responses = _responses(session, net, selection, include_pz)
+
+    channels = []
+    for row, instrument, signal_name, signal_description, calib_name, calib_description in session.execute(query):
+        location = row.location.strip() if row.location else ""
+        obspy_channel = Channel(code=row.seedchan, location_code=location,
+                                latitude=_float(row.lat), longitude=_float(row.lon), elevation=_float(row.elev),
+                                depth=_float(row.edepth), azimuth=_float(row.azimuth), dip=_float(row.dip),
+                                sample_rate=_float(row.samprate),
+                                types=[CHANNEL_TYPES[f] for f in (row.flags or "") if f in CHANNEL_TYPES],
+                                calibration_units=calib_name, calibration_units_description=calib_description,
+                                sensor=Equipment(description=instrument) if instrument else None,
+                                start_date=UTCDateTime(row.ondate), end_date=_end_date(row.offdate))
+        if level == "response":
+            obspy_channel.response = _response(responses.get(_key(row)), signal_name, signal_description)
+        channels.append((row.sta, obspy_channel))
+    return channels
+
+def _responses(session, net, selection, include_pz):
+    """
+        {(sta, seedchan, location, ondate): {"sensitivity": row, "pz": (row, input, output, zeros, poles)}}
+        for all channels of a network, with one query on sensitivity and one on poles_zeros/pz_data.
+    """
+    responses = {}
+    query = select(Sensitivity).where(*selection.channels(Sensitivity, net)).\
+            where(Sensitivity.stage_seq == 0)
+    for row in session.execute(query).scalars():
+        responses.setdefault(_key(row), {})["sensitivity"] = row
+
+    if not include_pz:
+        return responses
+
+    InputUnit = aliased(Unit)
+    OutputUnit = aliased(Unit)
+    query = select(Poles_Zeros, InputUnit.name, InputUnit.description, OutputUnit.name, OutputUnit.description,
+                   PZ_Data.pztype, PZ_Data.r_value, PZ_Data.i_value).\
+            outerjoin(InputUnit, Poles_Zeros.unit_in == InputUnit.id).\
+            outerjoin(OutputUnit, Poles_Zeros.unit_out == OutputUnit.id).\
+            outerjoin(PZ_Data, PZ_Data.key == Poles_Zeros.pz_key).\
+            where(*selection.channels(Poles_Zeros, net)).\
+            order_by(Poles_Zeros.sta, Poles_Zeros.seedchan, Poles_Zeros.location, Poles_Zeros.ondate,
+                     Poles_Zeros.stage_seq, PZ_Data.row_key)
+    for row, in_name, in_description, out_name, out_description, pz_type, r_value, i_value in session.execute(query):
+        response = responses.setdefault(_key(row), {})
+        if "pz" not in response:
+            response["pz"] = (row, (in_name, in_description), (out_name, out_description), [], [])
+        elif response["pz"][0] is not row:
+            # only the first poles and zeros stage of an epoch is used
+            continue
+        if pz_type is not None:
+            value = complex(float(r_value), float(i_value))
+            response["pz"][3 if pz_type.upper() == "Z" else 4].append(value)
+    return responses
+
+def _response(response, signal_name, signal_description):
+    """ obspy Response from the sensitivity and poles_zeros rows of a channel epoch """
+    if not response or "sensitivity" not in response:
+        return Response()
+    sensitivity = response["sensitivity"]
+    frequency = _float(sensitivity.frequency)
+    instrument_sensitivity = InstrumentSensitivity(_float(sensitivity.sensitivity), frequency,
+                                                   signal_name, "COUNTS",
+                                                   input_units_description=signal_description)
+    stages = []
+    if "pz" in response:
+        row, input_unit, output_unit, zeros, poles = response["pz"]
+        # the schema keeps no stage gains, the overall gain is in the instrument sensitivity
+        stages.append(PolesZerosResponseStage(1, 1.0, _float(row.af) or frequency, input_unit[0], output_unit[0],
+                                              TRANSFER_FUNCTION_TYPES.get(row.tf_type, TRANSFER_FUNCTION_TYPES["A"]),
+                                              _float(row.af) or frequency, zeros, poles,
+                                              normalization_factor=_float(row.ao),
+                                              input_units_description=input_unit[1],
+                                              output_units_description=output_unit[1]))
+    return Response(instrument_sensitivity=instrument_sensitivity, response_stages=stages)
+
+def _key(row):
+    return (row.sta, row.seedchan, row.location, row.ondate)
+
+def _end_date(offdate):
+    if offdate is None or offdate >= DEFAULT_ENDDATE:
+        return None
+    return UTCDateTime(offdate)
+
+def _float(value):
+    return float(value) if value is not None else None
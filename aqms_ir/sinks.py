@@ -0,0 +1,487 @@
+"""
+    Sinks persist the rows produced by aqms_ir.rows.
+
+    ORMSink      adds ORM objects to a session and commits each row (default)
+    CoreSink     buffers rows per table and writes them with executemany
+    CopySink     like CoreSink, but uses PostgreSQL COPY for the bulk writes
+    UpsertSink   like CoreSink, but updates existing epochs in place with
+                 INSERT ... ON CONFLICT DO UPDATE instead of re-inserting them
+    JSONLinesSink writes one JSON document per row to a file
+
+    All sinks implement write(rows), write_row(row), flush() and close().
+    The database sinks retry writes that fail for a transient reason (see
+    aqms_ir.retry) and raise the error when it persists, other errors are
+    recorded as failed rows.
+"""
+import csv
+import datetime
+import io
+import json
+import logging
+from collections import OrderedDict
+
+from sqlalchemy import and_, func, or_, select, tuple_
+
+from .dictionary import DictionaryCache, dialect_insert
+from .profiling import stage, count
+from .report import LoadReport
+from .retry import RETRIES, BACKOFF, retry, is_transient
+from .schema import Station, Channel, SimpleResponse, AmpParms, CodaParms, Sensitivity
+from .schema import PZ, PZ_Data, Poles_Zeros
+
+# ORM class of each table a row can belong to
+MODELS = dict((model.__tablename__, model) for model in
+              [Station, Channel, SimpleResponse, AmpParms, CodaParms, Sensitivity, Poles_Zeros])
+
+class Sink(object):
+    """ base class of all sinks """
+
+    def write(self, rows):
+        for row in rows:
+            self.write_row(row)
+        return
+
+    def write_row(self, row):
+        raise NotImplementedError
+
+    def flush(self):
+        return
+
+    def close(self):
+        self.flush()
+        return
+
+class DatabaseSink(Sink):
+    """
+        Base class of the sinks that write to the database. Resolves
+        the dictionary values of the rows to ids and records the outcome
+        of every row in a LoadReport.
+
+        :param session: sqlalchemy Session
+        :param report: aqms_ir.report.LoadReport, a new one when not provided
+        :param dictionary: aqms_ir.dictionary.DictionaryCache, a new one when not provided
+    """
+    # retries of a write that failed for a transient reason, and the first delay in seconds
+    retries = RETRIES
+    backoff = BACKOFF
+
+    def __init__(self, session, report=None, dictionary=None):
+        self.session = session
+        self.dictionary = dictionary if dictionary is not None else DictionaryCache(session)
+        self.report = report if report is not None else LoadReport()
+
+    def values(self, row):
+        """ column values of row, with the dictionary values replaced by ids """
+        values = row.columns()
+        for column, (kind, field) in row.lookups.items():
+            values[column] = self.dictionary.resolve(kind, getattr(row,field))
+        return values
+
+    def record(self, table, key, error=None):
+        """ records a written row, or a failed one when error is given """
+        if error is None:
+            self.report.success(table, key)
+        else:
+            self.report.failure(table, key, error)
+        return
+
+    def retry(self, function):
+        """ function(), retried when it fails for a transient reason """
+        return retry(function, self.retries, self.backoff, self.session)
+
+    def _record_clip(self, row):
+        if row.table == "channelmap_ampparms" and (not row.clip or row.clip == -1):
+            self.report.failure("clip", row.key(), "no valid clip level")
+        return
+
+class ORMSink(DatabaseSink):
+    """
+        Adds an ORM object to the session for every row and commits it
+        right away, so a failing row does not take others down with it.
+    """
+    def write_row(self, row):
+        if row.table == "poles_zeros":
+            return self._write_poles_zeros(row)
+
+        db_row = MODELS[row.table](**self.values(row))
+        if hasattr(db_row, "channel") and row.table != "channel_data":
+            db_row.channel = row.seedchan
+        self._record_clip(row)
+        try:
+            self.retry(lambda: self._commit([db_row], "insert." + row.table))
+            self.record(row.table, row.key())
+        except Exception as e:
+            self.session.rollback()
+            logging.error("Unable to add {} to {}: {}".format(row, row.table, e))
+            self.record(row.table, row.key(), e)
+            if is_transient(e):
+                raise
+        return
+
+    def _commit(self, objects, name):
+        # (re-)adds objects, a rollback before a retry removes them from the session
+        self.session.add_all(objects)
+        with stage(name):
+            self.session.flush()
+        with stage("commit"):
+            self.session.commit()
+        return
+
+    def _write_poles_zeros(self, row):
+        db_pz = PZ(name=row.pz_name)
+        try:
+            self.retry(lambda: self._commit([db_pz], "insert.pz"))
+            self.record("pz", row.key())
+        except Exception as error:
+            self.session.rollback()
+            logging.error("Unable to add pz {} to db: {}".format(db_pz,error))
+            self.record("pz", row.key(), error)
+            if is_transient(error):
+                raise
+            return
+        pz_key = db_pz.key
+
+        values = self.values(row)
+        values["pz_key"] = pz_key
+        db_poles_zeros = Poles_Zeros(**values)
+        objects = [db_poles_zeros] + [PZ_Data(**pz_data) for pz_data in _pz_data(pz_key, row)]
+        try:
+            self.retry(lambda: self._commit(objects, "insert." + row.table))
+            self.record(row.table, row.key())
+        except Exception as error:
+            self.session.rollback()
+            logging.error("Unable to add poleszeros {} to db: {}".format(db_poles_zeros,error))
+            self.record(row.table, row.key(), error)
+            if is_transient(error):
+                raise
+        return
+
+class CoreSink(DatabaseSink):
+    """
+        Buffers rows per table and inserts them with one executemany
+        per table every batch_size rows, committing once per flush.
+    """
+    def __init__(self, session, report=None, batch_size=1000, dictionary=None):
+        DatabaseSink.__init__(self, session, report, dictionary)
+        self.batch_size = batch_size
+        self.buffer = {}
+        self.size = 0
+
+    def write_row(self, row):
+        if row.table == "poles_zeros":
+            # needs the key of a new pz row first
+            self._flush_buffer()
+            return self._write_poles_zeros(row)
+        values = _with_defaults(MODELS[row.table].__table__, self.values(row))
+        if "channel" in MODELS[row.table].__table__.c and row.table != "channel_data":
+            values["channel"] = row.seedchan
+        self._record_clip(row)
+        self.buffer.setdefault(row.table, []).append((row.key(), values))
+        self.size += 1
+        if self.batch_size and self.size >= self.batch_size:
+            self._flush_buffer()
+        return
+
+    def flush(self):
+        self._flush_buffer()
+        return
+
+    def _flush_buffer(self):
+        """ inserts the buffered rows """
+        if not self.buffer:
+            return
+        # keep parents before children, i.e. stations before channels
+        buffer, self.buffer = self.buffer, {}
+        self.size = 0
+        for table in [t for t in MODELS if t in buffer]:
+            entries = buffer[table]
+            try:
+                self.retry(lambda: self._insert_batch(table, entries))
+                error = None
+            except Exception as e:
+                self.session.rollback()
+                logging.error("Unable to insert {} rows into {}: {}".format(len(entries), table, e))
+                error = e
+            for key, values in entries:
+                self.record(table, key, error)
+            if is_transient(error):
+                raise error
+        return
+
+    def _insert_batch(self, table, entries):
+        with stage("insert." + table):
+            self._bulk_insert(MODELS[table].__table__, [values for key, values in entries])
+        with stage("commit"):
+            self.session.commit()
+        return
+
+    def _bulk_insert(self, table, records):
+        self.session.execute(table.insert(), records)
+        return
+
+    def _write_poles_zeros(self, row):
+        try:
+            values = _with_defaults(Poles_Zeros.__table__, self.values(row))
+            self.retry(lambda: self._insert_poles_zeros(row, values))
+            error = None
+        except Exception as e:
+            self.session.rollback()
+            logging.error("Unable to add poleszeros {} to db: {}".format(row,e))
+            error = e
+        self.record("pz", row.key(), error)
+        self.record(row.table, row.key(), error)
+        if is_transient(error):
+            raise error
+        return
+
+    def _insert_poles_zeros(self, row, values):
+        with stage("insert.poles_zeros"):
+            result = self.session.execute(PZ.__table__.insert().values(name=row.pz_name))
+            pz_key = result.inserted_primary_key[0]
+            values["pz_key"] = pz_key
+            self.session.execute(Poles_Zeros.__table__.insert(), [values])
+            self.session.execute(PZ_Data.__table__.insert(), _pz_data(pz_key, row, type_key="type"))
+        with stage("commit"):
+            self.session.commit()
+        return
+
+class CopySink(CoreSink):
+    """
+        CoreSink that streams each batch into PostgreSQL with COPY ... FROM STDIN,
+        requires a psycopg2 connection.
+    """
+    NULL = "\\N"
+
+    def _bulk_insert(self, table, records):
+        columns = list(records[0].keys())
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for record in records:
+            writer.writerow([_copy_value(record.get(column), self.NULL) for column in columns])
+        buf.seek(0)
+        statement = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '{}')".format(
+                    table.name, ", ".join(columns), self.NULL)
+        cursor = self.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(statement, buf)
+        finally:
+            cursor.close()
+        return
+
+class UpsertSink(CoreSink):
+    """
+        CoreSink that writes the rows of each flush (one station when used by
+        inventory2db) with one multi-row INSERT ... ON CONFLICT (primary key)
+        DO UPDATE ... WHERE the values changed, per table. Unchanged epochs
+        are not touched at all and changed ones are updated in place. Rows
+        with the same primary key in one flush are written once, the last
+        one wins.
+
+        inventory2db does not delete the stations written to this sink first.
+        Instead, once the load has moved on to another station (at the next
+        flush) or at close(), the epochs of a station that the load did not
+        write are removed, with one DELETE per table, together with the pz
+        and pz_data rows that no poles_zeros row refers to any more. The
+        station epochs of a NET.STA that follow each other, e.g. in a file
+        read by iter_stationxml, are one station. A load that stops halfway
+        has cleaned up the stations it completed. Requires PostgreSQL or
+        SQLite.
+
+        The keys written are dropped once the old epochs of a station have
+        been removed, so memory does not grow with the size of the load. A
+        NET.STA that shows up again later in the input, e.g. in a second
+        Network element with the same code, is upserted without removing
+        epochs again, the epochs written the first time are kept.
+    """
+    replaces_stations = True
+
+    def __init__(self, session, report=None, dictionary=None):
+        CoreSink.__init__(self, session, report, batch_size=None, dictionary=dictionary)
+        self.insert = dialect_insert(session)
+        if self.insert is None:
+            raise ValueError("UpsertSink needs a PostgreSQL or SQLite database")
+        # (net, sta): {table: set of primary keys written}, until the old epochs are removed
+        self.written = {}
+        # stations written since the last flush
+        self.stations = set()
+        # stations flushed whose old epochs have not been removed yet
+        self.pending = set()
+        # stations whose old epochs have been removed
+        self.cleaned = set()
+        # (net, sta): pz keys of the poles_zeros epochs that have been replaced
+        self.pz_keys = {}
+
+    def write_row(self, row):
+        self.stations.add((row.net, row.sta))
+        stations = self.written.setdefault((row.net, row.sta), {})
+        stations.setdefault(row.table, set()).add(_primary_key(MODELS[row.table].__table__, row.as_dict()))
+        return CoreSink.write_row(self, row)
+
+    def _insert_poles_zeros(self, row, values):
+        # the pz and pz_data rows cannot be matched, replace the epoch in the
+        # same transaction, so that a retry after a rollback deletes it again
+        table = Poles_Zeros.__table__
+        condition = and_(*[column == getattr(row, column.key) for column in table.primary_key.columns])
+        with stage("delete"):
+            pz_keys = set(key for (key,) in self.session.execute(select(table.c.pz_key).where(condition)))
+            self.session.execute(table.delete().where(condition))
+        CoreSink._insert_poles_zeros(self, row, values)
+        self.pz_keys.setdefault((row.net, row.sta), set()).update(pz_keys)
+        return
+
+    def _bulk_insert(self, table, records):
+        # one statement can not insert and update the same row twice
+        unique = OrderedDict((_primary_key(table, record), record) for record in records)
+        if len(unique) < len(records):
+            count("upsert_duplicates." + table.name, len(records) - len(unique))
+            records = list(unique.values())
+        statement = self.insert(table).values(records)
+        keys = [column.key for column in table.primary_key.columns]
+        columns = [key for key in records[0] if key not in keys]
+        if not columns:
+            statement = statement.on_conflict_do_nothing(index_elements=keys)
+        else:
+            changed = or_(*[table.c[key].is_distinct_from(statement.excluded[key]) for key in columns])
+            updates = dict((key, statement.excluded[key]) for key in columns)
+            if "lddate" in table.c:
+                updates["lddate"] = func.now()
+            statement = statement.on_conflict_do_update(index_elements=keys, set_=updates, where=changed)
+        result = self.session.execute(statement)
+        if result.rowcount is not None and result.rowcount >= 0:
+            count("upsert_unchanged." + table.name, len(records) - result.rowcount)
+        return
+
+    def flush(self):
+        # stations that are complete, the rows of this flush belong to others
+        self._remove_pending(self.pending - self.stations)
+        self._flush_buffer()
+        self.pending.update(self.stations)
+        self.stations = set()
+        return
+
+    def close(self):
+        self.flush()
+        self._remove_pending(self.pending)
+        return
+
+    def _remove_pending(self, stations):
+        for net, sta in sorted(stations):
+            self.pending.discard((net, sta))
+            tables = self.written.pop((net, sta), {})
+            pz_keys = self.pz_keys.pop((net, sta), set())
+            again = (net, sta) in self.cleaned
+            self.cleaned.add((net, sta))
+            try:
+                self.retry(lambda: self._remove_old_epochs(net, sta, tables, pz_keys, again))
+            except Exception as e:
+                self.session.rollback()
+                logging.error("Unable to remove old epochs of {}.{}: {}".format(net, sta, e))
+                if is_transient(e):
+                    raise
+        return
+
+    def _remove_old_epochs(self, net, sta, tables, pz_keys, again=False):
+        """
+            removes the epochs of net.sta that were not written, with the pz rows
+            no longer used; only the unused pz rows when they have been removed before (again)
+        """
+        pz_keys = set(pz_keys)
+        with stage("delete"):
+            if not again:
+                pz_keys.update(self._delete_epochs(net, sta, tables))
+            _remove_unused_pz(self.session, pz_keys)
+        with stage("commit"):
+            self.session.commit()
+        return
+
+    def _delete_epochs(self, net, sta, tables):
+        """ deletes the rows of net.sta whose keys are not in tables, returns the pz keys of the poles_zeros rows """
+        pz_keys = set()
+        for table in [MODELS[t].__table__ for t in MODELS]:
+            keys = list(table.primary_key.columns)
+            condition = and_(table.c.net == net, table.c.sta == sta)
+            if tables.get(table.name):
+                condition = and_(condition, tuple_(*keys).notin_(sorted(tables[table.name])))
+            if table is Poles_Zeros.__table__:
+                pz_keys.update(key for (key,) in self.session.execute(select(table.c.pz_key).where(condition)))
+            result = self.session.execute(table.delete().where(condition))
+            if result.rowcount:
+                logging.info("Removed {} epochs of {}.{} from {}".format(result.rowcount, net, sta, table.name))
+        return pz_keys
+
+class JSONLinesSink(Sink):
+    """
+        Writes every row as a JSON document on its own line, with the
+        table name in "table". Dictionary values are written as descriptions,
+        complex poles and zeros as [real, imaginary].
+
+        :param fileobj: file object opened for writing text
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write_row(self, row):
+        document = row.as_dict()
+        document["table"] = row.table
+        self.fileobj.write(json.dumps(document, default=_json_value, sort_keys=True))
+        self.fileobj.write("\n")
+        return
+
+    def flush(self):
+        self.fileobj.flush()
+        return
+
+def _pz_data(pz_key, row, type_key="pztype"):
+    """
+        pz_data rows for the zeros and poles of a PolesZerosRow, type_key is
+        the name of the type column (pztype for the ORM class, type for the table).
+    """
+    pz_data = []
+    row_key = 0
+    for pz_type, values in (("Z", row.zeros), ("P", row.poles)):
+        for value in values:
+            pz_data.append({"key": pz_key, "row_key": row_key, type_key: pz_type,
+                            "r_value": value.real, "i_value": value.imag})
+            row_key += 1
+    return pz_data
+
+def _remove_unused_pz(session, keys):
+    """ removes the pz and pz_data rows of keys that no poles_zeros row refers to, returns their number """
+    keys = sorted(keys)
+    if not keys:
+        return 0
+    used = set(key for (key,) in session.execute(select(Poles_Zeros.pz_key).distinct().
+                                                 where(Poles_Zeros.pz_key.in_(keys))))
+    unused = [key for key in keys if key not in used]
+    if unused:
+        session.execute(PZ_Data.__table__.delete().where(PZ_Data.key.in_(unused)))
+        session.execute(PZ.__table__.delete().where(PZ.key.in_(unused)))
+        logging.info("Removed {} unused pz entries".format(len(unused)))
+    return len(unused)
+
+def _primary_key(table, values):
+    return tuple(values[column.key] for column in table.primary_key.columns)
+
+def _with_defaults(table, values):
+    """
+        Adds the python-side scalar column defaults (e.g. channelsrc='SEED') so that
+        all records in a batch have the same columns.
+    """
+    for column in table.columns:
+        if column.key not in values and column.default is not None and column.default.is_scalar:
+            values[column.key] = column.default.arg
+    return values
+
+def _copy_value(value, null):
+    if value is None:
+        return null
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(" ")
+    return value
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, complex):
+        return [value.real, value.imag]
+    return str(value)
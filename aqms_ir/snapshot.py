@@ -0,0 +1,118 @@
+"""
+    Export of the loaded Instrument Response tables to a compact, indexed
+    SQLite file, for hosts and scripts that only need to read channel
+    gains, corners and clip levels and should not depend on the central
+    database. The file uses the same aqms_ir.schema models, so it can be
+    queried with the same ORM classes:
+
+        engine = create_engine("sqlite:///snapshot.db")
+        session = sessionmaker(bind=engine)()
+        session.query(SimpleResponse).filter_by(net="UW", sta="SEP").all()
+"""
+import datetime
+import logging
+import os
+
+from sqlalchemy import create_engine, select, Column, MetaData, String, Table
+
+from .schema import Base, Abbreviation, Unit, Format, Station, Channel, SimpleResponse
+from .schema import AmpParms, CodaParms, Sensitivity, StaCorrection
+
+# tables copied into the snapshot, dictionary tables first
+SNAPSHOT_MODELS = [Abbreviation, Unit, Format, Station, Channel, SimpleResponse,
+                   AmpParms, CodaParms, Sensitivity, StaCorrection]
+
+# number of rows fetched from the source and inserted per batch
+BATCH_SIZE = 5000
+
+# key/value table describing the snapshot
+_info_metadata = MetaData()
+snapshot_info = Table("snapshot_info", _info_metadata,
+                      Column("name", String, primary_key=True),
+                      Column("value", String))
+
+def export_snapshot(session, filename, networks=None, stations=None, active=False, batch_size=BATCH_SIZE):
+    """
+        Copies the Instrument Response tables from the database of session
+        into a new SQLite file, replacing filename atomically when done.
+
+        :param networks: list of network codes to export, default all
+        :param stations: list of station codes to export, default all
+        :param active: only export epochs that are open now
+        :returns: dictionary with the number of rows exported per table
+    """
+    tmpfile = "{}.{}.tmp".format(filename, os.getpid())
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+    engine = create_engine("sqlite:///{}".format(tmpfile))
+    counts = {}
+    try:
+        Base.metadata.create_all(engine, tables=[model.__table__ for model in SNAPSHOT_MODELS])
+        _info_metadata.create_all(engine)
+        with engine.begin() as target:
+            target.exec_driver_sql("PRAGMA synchronous=OFF")
+            for model in SNAPSHOT_MODELS:
+                counts[model.__tablename__] = _copy_table(session, target, model, networks, stations,
+                                                          active, batch_size)
+                logging.info("Exported {} rows from {}".format(counts[model.__tablename__], model.__tablename__))
+            _create_indexes(target)
+            target.execute(snapshot_info.insert(), _info(session, networks, stations, active, counts))
+        with engine.connect() as target:
+            target.exec_driver_sql("ANALYZE")
+            target.exec_driver_sql("VACUUM")
+    except Exception:
+        engine.dispose()
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+    engine.dispose()
+    os.rename(tmpfile, filename)
+    return counts
+
+def _copy_table(session, target, model, networks, stations, active, batch_size):
+    table = model.__table__
+    query = select(table)
+    if "net" in table.c:
+        if networks:
+            query = query.where(table.c.net.in_(networks))
+        if stations:
+            query = query.where(table.c.sta.in_(stations))
+        if active:
+            query = query.where(table.c.offdate > datetime.datetime.utcnow())
+    result = session.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+    n = 0
+    for rows in result.partitions(batch_size):
+        records = [_sqlite_values(dict(row._mapping)) for row in rows]
+        target.execute(table.insert(), records)
+        n += len(records)
+    return n
+
+def _sqlite_values(record):
+    """ SQLite cannot bind Decimal, store numbers as floats """
+    for key, value in record.items():
+        if value is not None and value.__class__.__name__ == "Decimal":
+            record[key] = float(value)
+    return record
+
+def _create_indexes(target):
+    """
+        The primary keys already cover lookups by net, sta, seedchan, location, ondate.
+        Add indexes for finding the epoch of a channel that is open at a given time
+        and for the dictionary lookups.
+    """
+    for model in [Channel, SimpleResponse, AmpParms, CodaParms, Sensitivity, StaCorrection]:
+        target.exec_driver_sql("CREATE INDEX ix_{0}_scnl_offdate ON {0} (net, sta, seedchan, location, offdate)".\
+                               format(model.__tablename__))
+    target.exec_driver_sql("CREATE INDEX ix_d_abbreviation_description ON d_abbreviation (description)")
+    target.exec_driver_sql("CREATE INDEX ix_d_unit_name_description ON d_unit (name, description)")
+    return
+
+def _info(session, networks, stations, active, counts):
+    source = session.get_bind().url
+    info = [("created", datetime.datetime.utcnow().isoformat()),
+            ("source", source.render_as_string(hide_password=True) if hasattr(source, "render_as_string") else repr(source)),
+            ("networks", ",".join(networks) if networks else "*"),
+            ("stations", ",".join(stations) if stations else "*"),
+            ("active", str(bool(active)))]
+    info.extend(("rows.{}".format(table), str(n)) for table, n in sorted(counts.items()))
+    return [{"name": name, "value": value} for name, value in info]
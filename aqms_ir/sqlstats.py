@@ -0,0 +1,225 @@
+"""
+    Accounting of the SQL a load sends to the database: statements, round
+    trips, rows affected and seconds per table and per station, and a log
+    of the statements that took longer than a threshold.
+
+    instrument(engine) adds SQLAlchemy engine event listeners (once per
+    engine). Like aqms_ir.profiling, statements are only accounted inside
+    a collect() block, to the SQLStats object of the executing thread, so
+    concurrent loads on the same engine keep their own numbers. Statements
+    run inside a station() block are accounted to that station.
+
+        stats = SQLStats(slow=0.5)
+        instrument(engine)
+        with collect(stats):
+            with station("UW", "SEP"):
+                ...
+        print(stats.summary())
+        stats.write_csv("stations.csv")
+
+    A statement executed with many parameter sets (executemany) counts as
+    one round trip and len(parameters) statements. Commits and rollbacks
+    are round trips without statements, their time is in the commit stage
+    of aqms_ir.profiling. COPY by aqms_ir.sinks.CopySink bypasses SQLAlchemy
+    and is not accounted.
+"""
+import csv
+import logging
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+from sqlalchemy import event
+
+# statements that take longer than this many seconds are logged
+SLOW = 1.0
+
+# maximum number of slow statements kept
+MAX_SAMPLES = 100
+
+# characters of a slow statement that are logged and kept
+STATEMENT_LENGTH = 200
+
+# station of statements outside of a station() block
+NO_STATION = "-"
+
+FIELDS = ["statements", "round_trips", "rows", "seconds"]
+
+_current = threading.local()
+
+_TABLE = re.compile(r'^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|COPY)\s+"?(\w+)', re.IGNORECASE)
+_FROM = re.compile(r'\bFROM\s+"?(\w+)', re.IGNORECASE)
+
+_START = "aqms_ir.sqlstats.start"
+
+class SQLStats(object):
+    """
+        Statements, round trips, rows and seconds per station and table.
+
+        :param slow: statements taking longer than this many seconds are
+            logged and kept in slow_statements
+    """
+    def __init__(self, slow=SLOW, max_samples=MAX_SAMPLES):
+        self.slow = slow
+        self.max_samples = max_samples
+        # (station, table): [statements, round_trips, rows, seconds]
+        self.entries = OrderedDict()
+        self.slow_count = 0
+        self.slow_statements = []
+
+    def add(self, station, table, statements, rows, seconds, round_trips=1, statement=None):
+        entry = self.entries.setdefault((station, table), [0, 0, 0, 0.0])
+        entry[0] += statements
+        entry[1] += round_trips
+        entry[2] += rows
+        entry[3] += seconds
+        if statement is not None and self.slow is not None and seconds > self.slow:
+            self.slow_count += 1
+            logging.warning("Slow SQL statement, {:.3f} s on {} for {}: {}".format(seconds, table, station,
+                            statement[:STATEMENT_LENGTH]))
+            if len(self.slow_statements) < self.max_samples:
+                self.slow_statements.append(OrderedDict([("station", station), ("table", table),
+                                                         ("seconds", seconds),
+                                                         ("statement", statement[:STATEMENT_LENGTH])]))
+        return
+
+    def _totals(self, index):
+        """ entries summed per station (index 0) or per table (index 1) """
+        totals = OrderedDict()
+        for key, entry in self.entries.items():
+            total = totals.setdefault(key[index], [0, 0, 0, 0.0])
+            for i, value in enumerate(entry):
+                total[i] += value
+        return totals
+
+    def stations(self):
+        return self._totals(0)
+
+    def tables(self):
+        return self._totals(1)
+
+    def total(self):
+        total = [0, 0, 0, 0.0]
+        for entry in self.entries.values():
+            for i, value in enumerate(entry):
+                total[i] += value
+        return dict(zip(FIELDS, total))
+
+    def as_dict(self):
+        return OrderedDict([
+            ("total", self.total()),
+            ("tables", OrderedDict((table, dict(zip(FIELDS, entry))) for table, entry in self.tables().items())),
+            ("stations", OrderedDict((station, dict(zip(FIELDS, entry)))
+                                     for station, entry in self.stations().items())),
+            ("slow", self.slow_count),
+            ("slow_statements", self.slow_statements),
+        ])
+
+    def summary(self):
+        """ human readable table per table, most round trips first """
+        lines = ["{:<24} {:>10} {:>11} {:>10} {:>10}".format("table", "statements", "round trips", "rows",
+                                                               "seconds")]
+        tables = sorted(self.tables().items(), key=lambda item: -item[1][1])
+        total = self.total()
+        for table, (statements, round_trips, rows, seconds) in tables + [("total", [total[f] for f in FIELDS])]:
+            lines.append("{:<24} {:>10} {:>11} {:>10} {:>10.3f}".format(table, statements, round_trips, rows,
+                                                                       seconds))
+        stations = [s for s in self.stations() if s != NO_STATION]
+        if stations:
+            lines.append("{:<24} {:>10.1f} round trips per station".format("stations: {}".format(len(stations)),
+                         sum(self.stations()[s][1] for s in stations) / float(len(stations))))
+        if self.slow_count:
+            lines.append("{} statements slower than {} s".format(self.slow_count, self.slow))
+        return "\n".join(lines)
+
+    def write_csv(self, filename):
+        """ writes a line per station and table, with the station totals in table '*' """
+        with open(filename, "w") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(["station", "table"] + FIELDS)
+            tables = OrderedDict()
+            for (station, table), entry in self.entries.items():
+                tables.setdefault(station, []).append((table, entry))
+            for station, entries in tables.items():
+                total = [0, 0, 0, 0.0]
+                for table, entry in entries:
+                    writer.writerow([station, table] + entry[:3] + ["{:.6f}".format(entry[3])])
+                    for i, value in enumerate(entry):
+                        total[i] += value
+                writer.writerow([station, "*"] + total[:3] + ["{:.6f}".format(total[3])])
+        return
+
+def current():
+    """ the SQLStats object collecting in this thread, or None """
+    return getattr(_current, "stats", None)
+
+@contextmanager
+def collect(stats):
+    """ makes stats the active SQLStats object of this thread """
+    previous = current()
+    _current.stats = stats
+    try:
+        yield stats
+    finally:
+        _current.stats = previous
+
+@contextmanager
+def station(net, sta):
+    """ accounts the statements of the enclosed block to station net.sta """
+    previous = getattr(_current, "station", NO_STATION)
+    _current.station = "{}.{}".format(net, sta)
+    try:
+        yield
+    finally:
+        _current.station = previous
+
+def instrument(engine):
+    """ adds the event listeners to engine, does nothing when they are there already """
+    if event.contains(engine, "after_cursor_execute", _after_cursor_execute):
+        return engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "commit", _commit)
+    event.listen(engine, "rollback", _rollback)
+    return engine
+
+def table_name(statement):
+    """ table a statement writes to or (first) reads from, else its first keyword """
+    match = _TABLE.match(statement) or _FROM.search(statement)
+    if match:
+        return match.group(1).lower()
+    words = statement.split(None, 1)
+    return words[0].lower() if words else ""
+
+def _station():
+    return getattr(_current, "station", NO_STATION)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current() is not None:
+        conn.info[_START] = default_timer()
+    return
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current()
+    start = conn.info.pop(_START, None)
+    if stats is None or start is None:
+        return
+    seconds = default_timer() - start
+    statements = len(parameters) if executemany and parameters else 1
+    rows = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+    stats.add(_station(), table_name(statement), statements, rows, seconds, statement=statement)
+    return
+
+def _commit(conn):
+    stats = current()
+    if stats is not None:
+        stats.add(_station(), "commit", 0, 0, 0.0)
+    return
+
+def _rollback(conn):
+    stats = current()
+    if stats is not None:
+        stats.add(_station(), "rollback", 0, 0, 0.0)
+    return
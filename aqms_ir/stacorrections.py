@@ -0,0 +1,95 @@
+"""
+    Default magnitude station corrections.
+
+    Stations that have no entry in stacorrections yet get a default
+    correction for every correction type in the rules (ml 0.0 and me 1.0)
+    on their horizontal channels. All stations of a load are handled with
+    one INSERT INTO stacorrections ... SELECT ... FROM channel_data ...
+    WHERE NOT EXISTS (...) statement.
+
+    The channels and corrections are described by a rules dictionary, see
+    DEFAULT_RULES. Rules can be read from a JSON file with load_rules; keys
+    that are not in the file keep their default value, e.g.
+
+        {"samprates": [40, 100], "corrections": {"ml": 0.0, "me": 1.0, "mlr": 0.0}}
+"""
+import json
+import logging
+
+from sqlalchemy import and_, cast, exists, func, literal, select, true, tuple_, union_all
+from sqlalchemy import Numeric, String
+
+from .profiling import stage, count
+from .schema import Channel, StaCorrection
+
+DEFAULT_RULES = {
+    # horizontal channels that get default corrections
+    "seedchans": ["SNN", "SNE", "BNN", "BNE", "ENN", "ENE", "HNN", "HNE", "EHN", "EHE", "BHN", "BHE",
+                  "HHN", "HHE", "EH1", "EH2", "BH1", "BH2", "HH1", "HH2"],
+    # ... with one of these sample rates
+    "samprates": [20, 40, 50, 80, 100, 200],
+    # corr_type: corr
+    "corrections": {"ml": 0.0, "me": 1.0},
+    "auth": "UW",
+    "corr_flag": "C",
+}
+
+# maximum number of stations per statement
+CHUNK_SIZE = 500
+
+def load_rules(filename=None):
+    """ DEFAULT_RULES, updated with the JSON document in filename when given """
+    rules = dict(DEFAULT_RULES)
+    if filename:
+        with open(filename) as fp:
+            rules.update(json.load(fp))
+    return rules
+
+def insert_default_stacors(session, stations, rules=None):
+    """
+        Adds the default corrections of rules for all stations, a list of
+        (net, sta), that do not have any entry in stacorrections yet.
+        The corrections of a channel cover all its epochs in channel_data
+        (min(ondate) to max(offdate)). Returns the number of rows inserted.
+    """
+    if rules is None:
+        rules = DEFAULT_RULES
+    stations = sorted(set(stations))
+    inserted = 0
+    with stage("stacorrections"):
+        for i in range(0, len(stations), CHUNK_SIZE):
+            statement = _statement(stations[i:i + CHUNK_SIZE], rules)
+            try:
+                result = session.execute(statement)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logging.error("Unable to add default station corrections: {}".format(e))
+                continue
+            if result.rowcount and result.rowcount > 0:
+                inserted += result.rowcount
+    count("stacorrections_inserted", inserted)
+    logging.info("Added {} default station corrections".format(inserted))
+    return inserted
+
+def _statement(stations, rules):
+    corrections = union_all(*[select(cast(literal(corr_type), String).label("corr_type"),
+                                     cast(literal(corr), Numeric).label("corr"))
+                              for corr_type, corr in sorted(rules["corrections"].items())]).subquery("corrections")
+    existing = exists().where(and_(StaCorrection.net == Channel.net, StaCorrection.sta == Channel.sta))
+    channels = select(Channel.net, Channel.sta, Channel.seedchan, Channel.location,
+                      func.min(Channel.ondate), func.max(Channel.offdate),
+                      Channel.seedchan, literal("SEED"), literal(rules["auth"]),
+                      corrections.c.corr, literal(rules["corr_flag"]), corrections.c.corr_type).\
+               select_from(Channel).join(corrections, true()).\
+               where(tuple_(Channel.net, Channel.sta).in_(stations),
+                     Channel.seedchan.in_(rules["seedchans"]),
+                     Channel.samprate.in_(rules["samprates"]),
+                     ~existing).\
+               group_by(Channel.net, Channel.sta, Channel.seedchan, Channel.location,
+                        corrections.c.corr_type, corrections.c.corr)
+    table = StaCorrection.__table__
+    columns = [table.c.net, table.c.sta, table.c.seedchan, table.c.location, table.c.ondate, table.c.offdate,
+               table.c.channel, table.c.channelsrc, table.c.auth, table.c.corr, table.c.corr_flag,
+               table.c.corr_type]
+    return table.insert().from_select(columns, channels)
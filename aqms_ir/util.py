@@ -1,14 +1,106 @@
 import numpy as np
 import logging
+from collections import namedtuple
 
-try:
-    from obspy.signal.invsim import paz_to_freq_resp
-except:
-    from obspy.signal.invsim import pazToFreqResp as paz_to_freq_resp
-try:
-    from obspy.signal.invsim import paz_2_amplitude_value_of_freq_resp
-except:
-    from obspy.signal.invsim import paz2AmpValueOfFreqResp as paz_2_amplitude_value_of_freq_resp
+# tolerance for normalized amplitude of a pole-zero stage being off from 1.0,
+# and for the product of the stage gains being off from the reported sensitivity
+NORMALIZATION_TOLERANCE = 5e-02
+
+# outcome of one normalization check, see stage_diagnostics
+StageDiagnostic = namedtuple("StageDiagnostic", ["channel", "stage", "frequency", "expected", "calculated",
+                                                 "deviation", "ok"])
+
+def _paz_to_freq_resp():
+    """
+        paz_to_freq_resp of obspy.signal.invsim, imported on first use,
+        obspy.signal takes longer to import than the rest of aqms_ir
+    """
+    try:
+        from obspy.signal.invsim import paz_to_freq_resp
+    except:
+        from obspy.signal.invsim import pazToFreqResp as paz_to_freq_resp
+    return paz_to_freq_resp
+
+def paz_amplitudes(poles, zeros, gains, frequencies):
+    """
+        Amplitudes of n pole-zero transfer functions, each at its own frequency,
+        in one pass. Same as obspy's paz_2_amplitude_value_of_freq_resp for each.
+
+        :param poles, zeros: lists of n sequences of complex numbers (rad/s)
+        :param gains, frequencies: sequences of n floats
+        :returns: array of n floats
+    """
+    jw = 2j * np.pi * np.asarray(frequencies, dtype=float)
+    return np.asarray(gains, dtype=float) * _abs_product(jw, zeros) / _abs_product(jw, poles)
+
+def _abs_product(jw, roots):
+    """ |prod(jw[i] - roots[i])| for each row i of the ragged list roots """
+    width = max([len(r) for r in roots] + [0])
+    values = np.zeros((len(roots), width), dtype=complex)
+    used = np.zeros((len(roots), width), dtype=bool)
+    for i, r in enumerate(roots):
+        values[i, :len(r)] = [complex(root) for root in r]
+        used[i, :len(r)] = True
+    return np.abs(np.prod(np.where(used, jw[:, None] - values, 1.0), axis=1))
+
+def stage_diagnostics(responses, tolerance=NORMALIZATION_TOLERANCE):
+    """
+        Normalization checks of a batch of responses, all pole-zero stages
+        are evaluated with one paz_amplitudes call.
+
+        :param responses: list of (channel, obspy Response), channel is any
+            label, e.g. "UW.SEP..EHZ"
+        :returns: list of StageDiagnostic. One per pole-zero stage: the
+            amplitude at the normalization frequency (expected 1.0). One with
+            stage 0 per response: the product of the stage gains (those of
+            stages that are off corrected with their amplitude) compared with
+            the reported sensitivity. deviation is relative.
+    """
+    stages = [stage for channel, response in responses for stage in response.response_stages
+              if hasattr(stage, "stage_gain") and hasattr(stage, "poles")]
+    amplitudes = iter(paz_amplitudes([stage.poles for stage in stages], [stage.zeros for stage in stages],
+                                     [stage.normalization_factor for stage in stages],
+                                     [stage.normalization_frequency for stage in stages]) if stages else [])
+    diagnostics = []
+    for channel, response in responses:
+        total_gain = 1
+        for stage in response.response_stages:
+            if not hasattr(stage, "stage_gain"):
+                continue
+            stage_gain = stage.stage_gain
+            if hasattr(stage, "poles"):
+                amplitude = float(next(amplitudes))
+                ok = bool(np.abs(amplitude - 1.0) <= tolerance)
+                diagnostics.append(StageDiagnostic(channel, stage.stage_sequence_number,
+                                                   stage.normalization_frequency, 1.0, amplitude, amplitude - 1.0, ok))
+                if not ok:
+                    stage_gain = amplitude * stage.stage_gain
+            total_gain = total_gain*stage_gain
+        sensitivity = getattr(response, "instrument_sensitivity", None)
+        if sensitivity:
+            deviation = (total_gain - sensitivity.value)/sensitivity.value if sensitivity.value else float("nan")
+            diagnostics.append(StageDiagnostic(channel, 0, sensitivity.frequency, sensitivity.value, total_gain,
+                                               deviation, bool(np.abs(deviation) <= tolerance)))
+    return diagnostics
+
+def describe(diagnostic):
+    """ text of a failed StageDiagnostic, for logs and load reports """
+    if diagnostic.stage == 0:
+        return "Reported sensitivity: {:5.2f}, Calculated sensitivity: {:5.2f}".format(diagnostic.expected,
+               diagnostic.calculated)
+    return "normalized amplitude at normalization frequency of stage {} is {}, i.e. {:6.3f}% from 1, "\
+           "using the calculated gain instead".format(diagnostic.stage, diagnostic.calculated, 100*diagnostic.deviation)
+
+def inventory_diagnostics(inventory, tolerance=NORMALIZATION_TOLERANCE):
+    """ stage_diagnostics of all channels of an obspy Inventory, channel is NET.STA.LOC.CHA.ondate """
+    responses = []
+    for network in inventory:
+        for station in network:
+            for channel in station:
+                if channel.response and channel.response.response_stages:
+                    responses.append(("{}.{}.{}.{}.{}".format(network.code, station.code, channel.location_code,
+                                      channel.code, channel.start_date.datetime.isoformat()), channel.response))
+    return stage_diagnostics(responses, tolerance)
 
 def compute_corners(amplitude,frequency):
     """
@@ -98,12 +190,17 @@ def natural_frequency_and_damping(poles,f_hp,f_lp,sensor_type="VEL"):
     damp = b_candidate[i_min]
     return fn, damp
 
-def simple_response(sample_rate,response):
+def simple_response(sample_rate,response,diagnostics=None):
     """ 
         Given the obspy ResponseStages, calculate the simple response.
         i.e. the natural frequency, damping factor, low corner, high corner, and overall gain
+
+        diagnostics are the stage_diagnostics of response when they have been
+        calculated with those of other channels already; the caller reports
+        the failed checks then. Otherwise they are calculated here and the
+        failed checks are logged.
     """
-    EPSILON = 5e-02 # tolerance for normalized amplitude of a pole-zero stage being off from 1.0
+    paz_to_freq_resp = _paz_to_freq_resp()
     NFREQ = 2048 # number of frequency points to calculate amplitude spectrum for.
     delta_t = 1.0/sample_rate 
     poles = []
@@ -113,34 +210,28 @@ def simple_response(sample_rate,response):
     normalization_frequency = response.instrument_sensitivity.frequency
     signal_input_units = response.instrument_sensitivity.input_units
 
-    # Gather all the poles and zeros, and the stage gains.
-    total_gain = 1
+    # Gather all the poles and zeros
     for stage in response.response_stages:
         if hasattr(stage, "stage_gain"):
-            stage_gain = stage.stage_gain
             if hasattr(stage,"zeros"):
                 zeros.extend(stage.zeros)
             if hasattr(stage,"poles"):
                 poles.extend(stage.poles)
-                # check if normalization factor is correct 
-                paz = { "poles" : stage.poles, "zeros" : stage.zeros, "gain" : stage.normalization_factor}
-                calculated_amplitude = paz_2_amplitude_value_of_freq_resp(paz, stage.normalization_frequency)
-                if np.abs(calculated_amplitude - 1.0) > EPSILON:
-                    logging.warning("Warning: normalized amplitude at normalization frequency  is {}, i.e. {:6.3f}% from 1,\
-                           using calculated gain value {:5.2f} vs {:5.2f} instead".\
-                           format(calculated_amplitude, 100*(calculated_amplitude-1)/1,calculated_amplitude*stage.stage_gain, stage.stage_gain))
-                    stage_gain = calculated_amplitude * stage.stage_gain
-            total_gain = total_gain*stage_gain         
-
-    # log a warning if the total_gain is not similar to the reported instrument_sensitivity
-    if np.abs( (total_gain - response.instrument_sensitivity.value)/response.instrument_sensitivity.value) > EPSILON:
-        logging.warning("Warning: Reported sensitivity: {:5.2f}, \
-                        Calculated sensitivity: {:5.2f}". \
-              format(response.instrument_sensitivity.value, total_gain))
+
+    # check the normalization factors of the stages and the reported sensitivity,
+    # the total gain uses the calculated gain of stages that are off
+    total_gain = 1
+    log = diagnostics is None
+    if diagnostics is None:
+        diagnostics = stage_diagnostics([(None, response)])
+    for diagnostic in diagnostics:
+        if diagnostic.stage == 0:
+            total_gain = diagnostic.calculated
+        if log and not diagnostic.ok:
+            logging.warning("Warning: {}".format(describe(diagnostic)))
 
     #  calculate overall normalization factor at normalization frequency
-    paz = { "poles" : poles, "zeros" : zeros, "gain" : 1.0 }
-    calculated_amplitude = paz_2_amplitude_value_of_freq_resp(paz, normalization_frequency)
+    calculated_amplitude = paz_amplitudes([poles], [zeros], [1.0], [normalization_frequency])[0]
     normalization_factor = 1.0/calculated_amplitude
 
     # calculate the normalized frequency spectrum at NFREQ frequency points
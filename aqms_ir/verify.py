@@ -0,0 +1,188 @@
+"""
+    Compares the database with the rows inventory2db would write for an
+    obspy Inventory, without writing anything.
+
+    The database rows of all stations in the inventory are read with one
+    query per table and compared in memory with the rows produced by
+    aqms_ir.rows. Dictionary values are compared by description, so no
+    dictionary entries are created. The result is a VerifyReport listing
+    the missing, extra and differing epochs.
+
+        report = verify_inventory(session, inventory)
+        if not report:
+            print(report.summary())
+"""
+import datetime
+import json
+import math
+from collections import OrderedDict
+
+from .queries import database_rows, primary_key
+from .rows import inventory2rows
+from .sinks import MODELS
+
+# tables compared, in the order they are reported
+VERIFIED_TABLES = ["station_data", "channel_data", "simple_response", "channelmap_ampparms",
+                   "channelmap_codaparms", "sensitivity"]
+
+# maximum number of missing, extra or differing entries kept per table
+MAX_SAMPLES = 100
+
+# relative tolerance for comparing numbers
+RTOL = 1e-6
+
+class VerifyReport(object):
+    """
+        Outcome of verify_inventory: per table the number of matching,
+        missing, extra and differing epochs, and a bounded sample of each.
+    """
+    KINDS = ["missing", "extra", "differing"]
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.counts = OrderedDict()
+        self.samples = OrderedDict()
+
+    def _counts(self, table):
+        return self.counts.setdefault(table, OrderedDict([("matching", 0), ("missing", 0),
+                                                          ("extra", 0), ("differing", 0)]))
+
+    def matching(self, table, key):
+        self._counts(table)["matching"] += 1
+        return
+
+    def add(self, kind, table, key, differences=None):
+        """ kind is missing, extra or differing, differences a list of (column, expected, actual) """
+        self._counts(table)[kind] += 1
+        samples = self.samples.setdefault(table, OrderedDict((k, []) for k in self.KINDS))[kind]
+        if len(samples) < self.max_samples:
+            sample = OrderedDict([("key", key)])
+            if differences:
+                sample["differences"] = [OrderedDict([("column", column), ("expected", _json_value(expected)),
+                                                      ("actual", _json_value(actual))])
+                                         for column, expected, actual in differences]
+            samples.append(sample)
+        return
+
+    def problems(self, table=None):
+        """ number of missing, extra and differing epochs, of one table or all tables """
+        tables = [table] if table else list(self.counts)
+        return sum(self.counts.get(t, {}).get(kind, 0) for t in tables for kind in self.KINDS)
+
+    def __bool__(self):
+        """ True when the database matches the inventory """
+        return self.problems() == 0
+    __nonzero__ = __bool__
+
+    def as_dict(self):
+        return OrderedDict([("counts", self.counts), ("samples", self.samples)])
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def summary(self, bad_only=False, abbreviated=False):
+        """ text listing the counts per table and, unless abbreviated, the sampled problems """
+        indent = "    "
+        lines = []
+        for table, counts in self.counts.items():
+            if bad_only and not self.problems(table):
+                continue
+            lines.append("{}: {} matching, {} missing, {} extra, {} differing".format(
+                         table, counts["matching"], counts["missing"], counts["extra"], counts["differing"]))
+            if abbreviated:
+                continue
+            for kind, samples in self.samples.get(table, {}).items():
+                for sample in samples:
+                    lines.append("{}{} {}".format(indent, kind, sample["key"]))
+                    for difference in sample.get("differences", []):
+                        lines.append("{}{}{}: expected {}, found {}".format(indent, indent, difference["column"],
+                                     difference["expected"], difference["actual"]))
+                if counts[kind] > len(samples):
+                    lines.append("{}... {} more {}".format(indent, counts[kind] - len(samples), kind))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "VerifyReport: {}".format(", ".join("{}={}/{}/{}/{}".format(table, c["matching"], c["missing"],
+                                         c["extra"], c["differing"]) for table, c in self.counts.items()))
+
+def verify_inventory(session, inventory, active=False, rtol=RTOL, report=None):
+    """
+        Compares the database with the rows inventory2db would write for
+        inventory. Only stations present in the inventory are checked; all
+        their epochs in the database that the inventory does not produce
+        are reported as extra (only the open ones when active is True).
+
+        Returns a VerifyReport (report, when provided).
+    """
+    if report is None:
+        report = VerifyReport()
+
+    expected = OrderedDict((table, OrderedDict()) for table in VERIFIED_TABLES)
+    stations = set()
+    for network in inventory.networks:
+        for station in network.stations:
+            stations.add((network.code, station.code))
+    for row in inventory2rows(inventory, active=active):
+        if row.table in expected:
+            expected[row.table][primary_key(row.table, row)] = (row.key(), _expected_values(row))
+
+    for table in VERIFIED_TABLES:
+        actual = database_rows(session, table, stations, active)
+        for pk, (key, values) in expected[table].items():
+            if pk not in actual:
+                report.add("missing", table, key)
+                continue
+            differences = [(column, value, actual[pk].get(column)) for column, value in values.items()
+                           if not _equal(value, actual[pk].get(column), rtol)]
+            if differences:
+                report.add("differing", table, key, differences)
+            else:
+                report.matching(table, key)
+        for pk, values in actual.items():
+            if pk not in expected[table]:
+                report.add("extra", table, _key(table, pk))
+    return report
+
+def _key(table, pk):
+    """ NET.STA.LOC.CHA.ondate of a primary key, like Row.key() """
+    names = [column.key for column in MODELS[table].__table__.primary_key.columns]
+    values = dict(zip(names, pk))
+    ondate = values["ondate"].isoformat() if values.get("ondate") is not None else None
+    if table == "station_data":
+        return "{}.{}.{}".format(values["net"], values["sta"], ondate)
+    return "{}.{}.{}.{}.{}".format(values["net"], values["sta"], (values["location"] or "").strip(),
+                                   values["seedchan"], ondate)
+
+def _expected_values(row):
+    """ column values of a row, with the dictionary columns as descriptions """
+    values = row.columns()
+    for column, (kind, field) in row.lookups.items():
+        value = getattr(row, field)
+        if kind == "unit":
+            value = tuple(value) if value else None
+        elif kind == "format":
+            value = value or "UNKNOWN"
+        values[column] = value
+    return values
+
+def _equal(expected, actual, rtol):
+    if expected is None or actual is None:
+        return expected is None and actual is None
+    if isinstance(expected, (int, float)) and not isinstance(expected, bool):
+        try:
+            actual = float(actual)
+        except (TypeError, ValueError):
+            return False
+        if math.isnan(expected) or math.isnan(actual):
+            return math.isnan(expected) and math.isnan(actual)
+        return abs(expected - actual) <= rtol * max(abs(expected), abs(actual), 1e-30)
+    return expected == actual
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, tuple):
+        return list(value)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
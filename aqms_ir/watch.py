@@ -0,0 +1,159 @@
+"""
+    Loading of StationXML files as they appear in a spool directory.
+
+    A Spool polls the directory and loads every new or changed file with
+    one aqms_ir.loader.Loader, so the engine, its connection pool, the
+    dictionary ids and the calculated responses stay warm between files.
+    At most workers files are loaded at the same time. Every file gets its
+    own report, <report_dir>/<file>.report.json, which also records the
+    modification time and size of the file, so that a restarted spool
+    only loads the files that are new or changed. Files that can not be
+    loaded are moved to the quarantine directory, with the error in
+    <file>.error next to them.
+
+        spool = Spool("/data/spool", Loader(sessionmaker(bind=engine)), quarantine="/data/bad")
+        spool.run()
+"""
+import datetime
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from .profiling import Timings
+from .report import LoadReport
+
+class Spool(object):
+    """
+        :param directory: directory that is watched
+        :param loader: aqms_ir.loader.Loader
+        :param pattern: file name pattern of the files that are loaded
+        :param workers: maximum number of files loaded at the same time
+        :param interval: seconds between two scans of the directory
+        :param settle: files that changed less than settle seconds ago are
+            left for the next scan, they may still be written
+        :param quarantine: directory for the files that failed, default
+            <directory>/quarantine
+        :param report_dir: directory for the reports, default <directory>/reports
+        :param selection: keyword arguments of aqms_ir.xmlfilter.read_stationxml
+    """
+    def __init__(self, directory, loader, pattern="*.xml", workers=2, interval=10.0, settle=2.0,
+                 quarantine=None, report_dir=None, selection=None):
+        self.directory = directory
+        self.loader = loader
+        self.pattern = pattern
+        self.workers = workers
+        self.interval = interval
+        self.settle = settle
+        self.quarantine = quarantine or os.path.join(directory, "quarantine")
+        self.report_dir = report_dir or os.path.join(directory, "reports")
+        self.selection = selection or {}
+        # file name: (mtime, size) when it was loaded, from the reports of earlier runs
+        self.loaded = self._read_reports()
+        self._stop = threading.Event()
+
+    def scan(self):
+        """ names of the files that are new or changed since they were loaded """
+        now = time.time()
+        names = []
+        present = set()
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not fnmatch.fnmatch(name, self.pattern) or not os.path.isfile(path):
+                continue
+            present.add(name)
+            stat = os.stat(path)
+            if self.loaded.get(name) == (stat.st_mtime, stat.st_size):
+                continue
+            if now - stat.st_mtime < self.settle:
+                continue
+            names.append(name)
+        # files that have been removed from the spool
+        for name in set(self.loaded) - present:
+            del self.loaded[name]
+        return names
+
+    def run_once(self, executor=None):
+        """ loads the files found by one scan, returns {name: LoadReport or None when it failed} """
+        names = self.scan()
+        if not names:
+            return {}
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return self.run_once(executor)
+        futures = [(name, executor.submit(self.load, name)) for name in names]
+        return dict((name, future.result()) for name, future in futures)
+
+    def run(self):
+        """ scans the directory every interval seconds until stop() is called """
+        logging.info("Watching {} for {}, {} workers".format(self.directory, self.pattern, self.workers))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stop.is_set():
+                try:
+                    self.run_once(executor)
+                except Exception as e:
+                    logging.error("Unable to scan {}: {}".format(self.directory, e))
+                self._stop.wait(self.interval)
+        return
+
+    def stop(self):
+        self._stop.set()
+
+    def load(self, name):
+        """ loads one file, returns its LoadReport, or None when it has been quarantined """
+        path = os.path.join(self.directory, name)
+        stat = os.stat(path)
+        report = LoadReport()
+        timings = Timings()
+        logging.info("Loading {}".format(path))
+        try:
+            report = self.loader.load_file(path, report=report, timings=timings, **self.selection)
+        except Exception as e:
+            logging.error("Unable to load {}, moving it to {}: {}".format(path, self.quarantine, e))
+            self._quarantine(name, traceback.format_exc())
+            return None
+        self.loaded[name] = (stat.st_mtime, stat.st_size)
+        self._write_report(name, report, timings, stat)
+        logging.info("Loaded {}:\n{}".format(name, report.summary(bad_only=True, abbreviated=True)))
+        return report
+
+    def _quarantine(self, name, error):
+        if not os.path.isdir(self.quarantine):
+            os.makedirs(self.quarantine)
+        shutil.move(os.path.join(self.directory, name), os.path.join(self.quarantine, name))
+        with open(os.path.join(self.quarantine, name + ".error"), "w") as fp:
+            fp.write(error)
+        self.loaded.pop(name, None)
+        return
+
+    def _write_report(self, name, report, timings, stat):
+        if not os.path.isdir(self.report_dir):
+            os.makedirs(self.report_dir)
+        document = report.as_dict()
+        document["file"] = name
+        document["mtime"] = stat.st_mtime
+        document["size"] = stat.st_size
+        document["loaded"] = datetime.datetime.now().isoformat()
+        document["timings"] = timings.as_dict()
+        with open(os.path.join(self.report_dir, name + ".report.json"), "w") as fp:
+            json.dump(document, fp, indent=2)
+        return
+
+    def _read_reports(self):
+        """ {file name: (mtime, size)} of the files loaded by earlier runs, from their reports """
+        loaded = {}
+        if not os.path.isdir(self.report_dir):
+            return loaded
+        for report in fnmatch.filter(os.listdir(self.report_dir), "*.report.json"):
+            try:
+                with open(os.path.join(self.report_dir, report)) as fp:
+                    document = json.load(fp)
+                loaded[document["file"]] = (document["mtime"], document["size"])
+            except (IOError, ValueError, KeyError) as e:
+                logging.warning("Unable to read report {}: {}".format(report, e))
+        return loaded
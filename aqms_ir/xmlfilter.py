@@ -0,0 +1,243 @@
+"""
+    Reading of FDSN StationXML with the network, station, location and
+    channel selection and the time window applied while parsing.
+
+    The document is parsed incrementally with lxml; Network, Station and
+    Channel elements that do not match are dropped as soon as they have
+    been read, so their responses are never turned into obspy objects.
+    Only the remaining, pruned document is handed to obspy.
+
+        inventory = read_stationxml("UW.xml", station="SEP,ABC", channel="[BEHS][HNL][123ENZ]", active=True)
+
+    Patterns follow obspy's Inventory.select: * and ? wildcards, [...]
+    character sets and comma separated lists.
+
+    iter_stationxml reads the document one station at a time, for loads
+    that should not hold the whole inventory in memory:
+
+        for inventory in iter_stationxml("UW.xml", channel="HH?"):
+            ...
+
+    Both fill the optional fingerprints dictionary with a SHA-256 hash of
+    the canonical XML of every selected station, for aqms_ir.manifest, and
+    read gzip and zstd compressed files as they are parsed (see
+    aqms_ir.compressed).
+"""
+import copy
+import fnmatch
+import hashlib
+import io
+import logging
+
+from lxml import etree
+
+from .compressed import open_input
+from .profiling import count
+
+def read_stationxml(filename, network=None, station=None, location=None, channel=None,
+                    starttime=None, endtime=None, active=False, fingerprints=None):
+    """
+        Returns an obspy Inventory with the matching networks, stations and channels of
+        the StationXML file (path or binary file object, may be compressed).
+
+        :param starttime, endtime: only keep epochs that overlap this time window
+        :param active: only keep epochs that are open now
+        :param fingerprints: dictionary that receives {(net, sta): fingerprint}
+            of the selected stations
+    """
+    from obspy import read_inventory
+
+    selector = Selector(network=network, station=station, location=location, channel=channel,
+                        starttime=starttime, endtime=endtime, active=active)
+    with open_input(filename) as source:
+        if selector.everything() and fingerprints is None:
+            return read_inventory(source, format="STATIONXML")
+        root = prune(source, selector, fingerprints)
+    buf = io.BytesIO()
+    etree.ElementTree(root).write(buf, xml_declaration=True, encoding="UTF-8")
+    buf.seek(0)
+    return read_inventory(buf, format="STATIONXML")
+
+def prune(filename, selector, fingerprints=None):
+    """
+        root element of the StationXML document without the elements selector rejects,
+        the fingerprints of the remaining stations are added to fingerprints when given
+    """
+    root = None
+    # parents that lost children, they are dropped as well when none are left
+    pruned = set()
+    skipped = 0
+    for event, element in etree.iterparse(filename, events=("start", "end"), remove_comments=True):
+        if root is None:
+            root = element
+        if event != "end":
+            continue
+        name = etree.QName(element).localname
+        if name == "Channel":
+            station = element.getparent()
+            network = station.getparent()
+            if not selector.channel_matches(network.get("code"), station.get("code"), element):
+                station.remove(element)
+                pruned.add(station)
+                skipped += 1
+        elif name == "Station":
+            network = element.getparent()
+            if not selector.station_matches(network.get("code"), element) or \
+                    (element in pruned and not _children(element, "Channel")):
+                network.remove(element)
+                pruned.add(network)
+                skipped += len(_children(element, "Channel"))
+            elif fingerprints is not None:
+                _add_fingerprint(fingerprints, network.get("code"), element)
+            pruned.discard(element)
+        elif name == "Network":
+            if not selector.network_matches(element) or \
+                    (element in pruned and not _children(element, "Station")):
+                element.getparent().remove(element)
+            pruned.discard(element)
+    count("channels_skipped", skipped)
+    logging.info("Skipped {} channels while parsing".format(skipped))
+    return root
+
+def iter_stationxml(filename, network=None, station=None, location=None, channel=None,
+                    starttime=None, endtime=None, active=False, fingerprints=None):
+    """
+        Generator of obspy Inventory objects with one station each (or a
+        network without stations) of the StationXML file, with the same
+        selection as read_stationxml. Stations are removed from the parsed
+        document once they have been produced, so memory does not grow
+        with the size of the file. The fingerprint of a station is added
+        to fingerprints before the station is produced.
+    """
+    from obspy import read_inventory
+
+    selector = Selector(network=network, station=station, location=location, channel=channel,
+                        starttime=starttime, endtime=endtime, active=active)
+    root = None
+    # stations that lost channels, they are dropped when none are left
+    pruned = set()
+    stations = 0
+    skipped = 0
+    with open_input(filename) as source:
+        for event, element in etree.iterparse(source, events=("start", "end"), remove_comments=True):
+            if root is None:
+                root = element
+            name = etree.QName(element).localname
+            if event == "start":
+                if name == "Network":
+                    stations = 0
+                continue
+            if name == "Channel":
+                station_element = element.getparent()
+                network_code = station_element.getparent().get("code")
+                if not selector.channel_matches(network_code, station_element.get("code"), element):
+                    station_element.remove(element)
+                    pruned.add(station_element)
+                    skipped += 1
+            elif name == "Station":
+                network_element = element.getparent()
+                stations += 1
+                keep = selector.station_matches(network_element.get("code"), element) and \
+                       not (element in pruned and not _children(element, "Channel"))
+                if not keep:
+                    skipped += len(_children(element, "Channel"))
+                else:
+                    if fingerprints is not None:
+                        _add_fingerprint(fingerprints, network_element.get("code"), element)
+                    yield read_inventory(_document(root, network_element, element), format="STATIONXML")
+                network_element.remove(element)
+                pruned.discard(element)
+            elif name == "Network":
+                # networks without any stations only carry a description
+                if stations == 0 and selector.network_matches(element):
+                    yield read_inventory(_document(root, element), format="STATIONXML")
+                root.remove(element)
+    count("channels_skipped", skipped)
+    logging.info("Skipped {} channels while parsing".format(skipped))
+    return
+
+def _add_fingerprint(fingerprints, network_code, element):
+    """ chains the canonical XML of Station element to the fingerprint of the station (all its epochs) """
+    key = (network_code, element.get("code"))
+    digest = hashlib.sha256(fingerprints.get(key, "").encode("ascii"))
+    digest.update(etree.tostring(element, method="c14n"))
+    fingerprints[key] = digest.hexdigest()
+    return
+
+def _document(root, network, station=None):
+    """ StationXML document with the header of root, network without its stations and station """
+    document = etree.Element(root.tag, root.attrib, nsmap=root.nsmap)
+    for child in root:
+        if isinstance(child.tag, str) and etree.QName(child).localname != "Network":
+            document.append(copy.deepcopy(child))
+    network_copy = etree.SubElement(document, network.tag, network.attrib)
+    for child in network:
+        if isinstance(child.tag, str) and etree.QName(child).localname != "Station":
+            network_copy.append(copy.deepcopy(child))
+    if station is not None:
+        network_copy.append(copy.deepcopy(station))
+    buf = io.BytesIO()
+    etree.ElementTree(document).write(buf, xml_declaration=True, encoding="UTF-8")
+    buf.seek(0)
+    return buf
+
+class Selector(object):
+    """ the selection of read_stationxml, applied to StationXML elements """
+
+    def __init__(self, network=None, station=None, location=None, channel=None,
+                 starttime=None, endtime=None, active=False):
+        self.network = _patterns(network)
+        self.station = _patterns(station)
+        self.location = _patterns(location, location=True)
+        self.channel = _patterns(channel)
+        self.starttime = _utc(starttime) if starttime is not None else None
+        self.endtime = _utc(endtime) if endtime is not None else None
+        if active:
+            now = _utc()
+            self.starttime = max(self.starttime, now) if self.starttime is not None else now
+
+    def everything(self):
+        return not (self.network or self.station or self.location or self.channel or
+                    self.starttime is not None or self.endtime is not None)
+
+    def network_matches(self, element):
+        return _match(element.get("code"), self.network) and self._in_window(element)
+
+    def station_matches(self, network_code, element):
+        return _match(network_code, self.network) and _match(element.get("code"), self.station) and \
+               self._in_window(element)
+
+    def channel_matches(self, network_code, station_code, element):
+        return _match(network_code, self.network) and _match(station_code, self.station) and \
+               _match(element.get("locationCode", ""), self.location) and \
+               _match(element.get("code"), self.channel) and self._in_window(element)
+
+    def _in_window(self, element):
+        """ True when the epoch of element overlaps the time window """
+        if self.starttime is not None and element.get("endDate"):
+            if _utc(element.get("endDate")) < self.starttime:
+                return False
+        if self.endtime is not None and element.get("startDate"):
+            if _utc(element.get("startDate")) > self.endtime:
+                return False
+        return True
+
+def _utc(*args):
+    from obspy import UTCDateTime
+    return UTCDateTime(*args)
+
+def _patterns(pattern, location=False):
+    if pattern is None or pattern == "*":
+        return None
+    patterns = [p.strip() for p in pattern.split(",")]
+    if location:
+        patterns = ["" if p == "--" else p for p in patterns]
+    return patterns
+
+def _match(code, patterns):
+    if not patterns:
+        return True
+    return any(fnmatch.fnmatch((code or "").upper(), p.upper()) for p in patterns)
+
+def _children(element, name):
+    return [child for child in element if isinstance(child.tag, str) and etree.QName(child).localname == name]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+    Loads a StationXML file into a new SQLite database and prints the
+    number of channels and the peak resident set size of this process
+    as JSON. Used by the load_peak_rss benchmarks of bench.py, which run
+    it in a new process so that every mode starts from the same memory.
+
+        python benchmarks/load_rss.py synthetic.xml --constant-memory
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from aqms_ir.loader import Loader
+from aqms_ir.schema import Base, Channel
+from aqms_ir.sinks import CoreSink
+
+def peak_rss_kb():
+    """
+        peak resident set size of this process in kB. On Linux VmHWM, as
+        ru_maxrss includes the memory of the parent when started with fork/exec
+    """
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Loads a StationXML file into a scratch SQLite database \
+        and prints the peak RSS")
+    parser.add_argument("xmlfile", help="StationXML file")
+    parser.add_argument("-m", "--constant-memory", action="store_true", help="load one station at a time")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    engine = create_engine("sqlite:///{}".format(os.path.join(directory, "ir.db")))
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    loader = Loader(Session, sink_factory=CoreSink, constant_memory=args.constant_memory)
+    loader.load_file(args.xmlfile)
+
+    session = Session()
+    channels = session.query(Channel).count()
+    session.close()
+    engine.dispose()
+    os.remove(os.path.join(directory, "ir.db"))
+    os.rmdir(directory)
+    print(json.dumps({"channels": channels, "peak_rss_kb": peak_rss_kb()}))
@@ -0,0 +1,123 @@
+"""
+    Generator of realistic synthetic obspy Inventory objects for benchmarks.
+
+    Each station gets a mix of broadband (HH?), strong-motion (EN?) and
+    short-period (EHZ) channels with full responses (a poles and zeros
+    sensor stage and a digitizer gain stage) and PNSN style instrument
+    identifiers, e.g. TR120-1234=Q330-5678, ES-T-1234=Q330-5678 and
+    L4C-1234=VCO-1=DISC-1=Wrm-1234.
+
+        from synthetic import synthetic_inventory
+        inventory = synthetic_inventory(networks=2, stations=50, channels=7, epochs=3)
+"""
+import random
+
+import numpy as np
+
+from obspy import UTCDateTime
+from obspy.core.inventory import Inventory, Network, Station, Channel, Site, Equipment
+from obspy.core.inventory.response import Response, InstrumentSensitivity
+from obspy.core.inventory.response import PolesZerosResponseStage, CoefficientsTypeResponseStage
+
+NETWORK_CODES = ["UW", "CC", "UO", "HW", "XX", "YY", "ZZ", "XA", "XB", "XC"]
+
+# sensor templates: poles, zeros, sensitivity (V per input unit), input units,
+# normalization frequency, PNSN sensor shorthand, sample rate
+SENSORS = {
+    "BB": dict(poles=[-0.03852+0.03658j, -0.03852-0.03658j, -178.0+0j, -135.0+160.0j, -135.0-160.0j,
+                      -671.0+1154.0j, -671.0-1154.0j],
+               zeros=[0j, 0j, -90.0+0j, -160.7+0j, -3108.0+0j], sensitivity=1201.0, units="M/S",
+               frequency=1.0, name="TR120", samprate=100.0),
+    "SM": dict(poles=[-981.0+1009.0j, -981.0-1009.0j, -3290.0+1263.0j, -3290.0-1263.0j],
+               zeros=[], sensitivity=0.2548, units="M/S**2", frequency=1.0,
+               name="ES-T", samprate=100.0),
+    "SP": dict(poles=[-4.398+4.487j, -4.398-4.487j], zeros=[0j, 0j],
+               sensitivity=171.0, units="M/S", frequency=5.0,
+               name="L4C", samprate=100.0),
+}
+
+# channel code, orientation (azimuth, dip) and sensor type, in the order they are added to a station
+CHANNELS = [("HHZ", 0., -90., "BB"), ("HHN", 0., 0., "BB"), ("HHE", 90., 0., "BB"),
+            ("ENZ", 0., -90., "SM"), ("ENN", 0., 0., "SM"), ("ENE", 90., 0., "SM"),
+            ("EHZ", 0., -90., "SP")]
+
+# digitizer gain in counts/V
+LOGGERS = {"Q330": 419430.0, "130": 629327.0, "Wrm": 409.6}
+
+def synthetic_inventory(networks=1, stations=10, channels=7, epochs=1, seed=0, source="IRIS-DMC"):
+    """
+        Returns an obspy Inventory with networks x stations x channels x epochs
+        channel epochs. channels is the number of channels per station, taken
+        round robin from CHANNELS (with increasing location codes when there
+        are more than len(CHANNELS)). The last epoch of each channel is open.
+    """
+    rng = random.Random(seed)
+    inventory = Inventory(networks=[], source=source)
+    for n in range(networks):
+        code = NETWORK_CODES[n] if n < len(NETWORK_CODES) else "N{}".format(n)
+        network = Network(code=code, description="Synthetic network {}".format(code))
+        for s in range(stations):
+            network.stations.append(_station(rng, "S{:04d}".format(s), channels, epochs))
+        inventory.networks.append(network)
+    return inventory
+
+def _station(rng, code, nchannels, epochs):
+    latitude = rng.uniform(42., 49.)
+    longitude = rng.uniform(-124., -117.)
+    elevation = rng.uniform(0., 2000.)
+    start = UTCDateTime(2000, 1, 1) + rng.randint(0, 3650) * 86400
+    station = Station(code=code, latitude=latitude, longitude=longitude, elevation=elevation,
+                      site=Site(name="Synthetic station {}".format(code)), start_date=start)
+
+    for c in range(nchannels):
+        channel_code, azimuth, dip, kind = CHANNELS[c % len(CHANNELS)]
+        location = "{:02d}".format(c // len(CHANNELS)) if c >= len(CHANNELS) else ""
+        epoch_start = start
+        for e in range(epochs):
+            epoch_end = None if e == epochs - 1 else epoch_start + rng.randint(200, 2000) * 86400
+            station.channels.append(_channel(rng, channel_code, location, azimuth, dip, kind,
+                                             latitude, longitude, elevation, epoch_start, epoch_end))
+            epoch_start = epoch_end
+    return station
+
+def _channel(rng, code, location, azimuth, dip, kind, latitude, longitude, elevation, start, end):
+    sensor = SENSORS[kind]
+    if kind == "SP":
+        logger = "Wrm"
+        identifier = "{}-{:04d}=VCO-{}=DISC-{}={}-{:04d}".format(sensor["name"], rng.randint(1, 9999),
+                     rng.randint(1, 99), rng.randint(1, 99), logger, rng.randint(1, 9999))
+    else:
+        logger = rng.choice(["Q330", "130"])
+        identifier = "{}-{:04d}={}-{:04d}".format(sensor["name"], rng.randint(1, 9999), logger, rng.randint(1, 9999))
+
+    channel = Channel(code=code, location_code=location, latitude=latitude, longitude=longitude,
+                      elevation=elevation, depth=0.0, azimuth=azimuth, dip=dip,
+                      types=["CONTINUOUS", "GEOPHYSICAL"], sample_rate=sensor["samprate"],
+                      calibration_units="A", calibration_units_description="Amperes",
+                      sensor=Equipment(type=sensor["name"], description=identifier),
+                      data_logger=Equipment(type=logger),
+                      start_date=start, end_date=end)
+    channel.response = _response(sensor, LOGGERS[logger] * rng.uniform(0.98, 1.02))
+    return channel
+
+def _response(sensor, logger_gain):
+    from obspy.signal.invsim import paz_2_amplitude_value_of_freq_resp
+
+    frequency = sensor["frequency"]
+    paz = {"poles": sensor["poles"], "zeros": sensor["zeros"], "gain": 1.0}
+    normalization_factor = 1.0 / paz_2_amplitude_value_of_freq_resp(paz, frequency)
+
+    stages = [PolesZerosResponseStage(1, sensor["sensitivity"], frequency, sensor["units"], "V",
+                                      "LAPLACE (RADIANS/SECOND)", frequency, sensor["zeros"],
+                                      sensor["poles"], normalization_factor=normalization_factor),
+              CoefficientsTypeResponseStage(2, logger_gain, frequency, "V", "COUNTS", "DIGITAL",
+                                            numerator=[], denominator=[])]
+    sensitivity = InstrumentSensitivity(sensor["sensitivity"] * logger_gain, frequency, sensor["units"], "COUNTS")
+    return Response(instrument_sensitivity=sensitivity, response_stages=stages)
+
+def instrument_identifiers(inventory):
+    """ all channel sensor descriptions of the inventory """
+    return [channel.sensor.description for network in inventory for station in network for channel in station]
+
+def channel_count(inventory):
+    return int(np.sum([len(station.channels) for network in inventory for station in network]))
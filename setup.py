@@ -13,7 +13,8 @@ setup(name="aqms-ir",
         'Intended Audience :: Science/Research',
     ],
     packages=["aqms_ir"],
-    scripts=["loadStationXML","getStationXML","deleteStation"],
-    install_requires=["numpy","obspy>=0.10.2","SQLAlchemy",],
+    scripts=["loadStationXML","getStationXML","deleteStation","exportSnapshot","dumpStationXML","migrateSchema","closeStation","watchStationXML"],
+    install_requires=["numpy","obspy>=0.10.2","SQLAlchemy>=1.4",],
+    extras_require={"zstd": ["zstandard"]},
     zip_safe=False)
 
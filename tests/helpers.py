@@ -0,0 +1,34 @@
+"""
+    Helpers shared by the tests: in-memory databases and test inventories.
+"""
+import copy
+
+from obspy import UTCDateTime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from aqms_ir.schema import Base
+
+def session_factory(tables=None):
+    """ sessionmaker bound to a new in-memory SQLite database with tables, default all """
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=tables)
+    return sessionmaker(bind=engine)
+
+def memory_session(tables=None):
+    """ session of a new in-memory SQLite database with tables, default all """
+    return session_factory(tables)()
+
+def two_epochs(inventory, sta="FUR"):
+    """ splits station sta of the first network into a 2006-2010 and a 2010-open station epoch """
+    network = inventory[0]
+    station = [station for station in network if station.code == sta][0]
+    split = UTCDateTime(2010, 1, 1)
+    later = copy.deepcopy(station)
+    for epoch in [station] + station.channels:
+        epoch.end_date = split
+    for epoch in [later] + later.channels:
+        epoch.start_date = split
+    network.stations.insert(network.stations.index(station) + 1, later)
+    return inventory
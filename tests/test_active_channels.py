@@ -0,0 +1,53 @@
+import datetime
+
+from obspy import read_inventory
+
+from aqms_ir.active_channels import active_channel, refresh_active_channels
+from aqms_ir.close import close_epochs
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.loader import Loader
+from aqms_ir.schema import Base, ActiveChannel, Channel, SimpleResponse, AmpParms, StaCorrection
+from aqms_ir.sinks import CoreSink
+
+from helpers import session_factory
+
+def test_refreshed_by_load_and_close():
+    factory = session_factory()
+    Loader(factory, sink_factory=CoreSink).load(read_inventory().select(network="GR"))
+    session = factory()
+    assert session.query(ActiveChannel).count() == session.query(Channel).count()
+
+    channel = active_channel(session, "GR", "FUR", "BHN", "")
+    response = session.query(SimpleResponse).filter_by(sta="FUR", seedchan="BHN").one()
+    assert channel.gain == response.gain
+    assert channel.gain_units == response.gain_units
+    assert channel.clip == session.query(AmpParms).filter_by(sta="FUR", seedchan="BHN").one().clip
+    corrections = dict((row.corr_type, row.corr) for row in
+                       session.query(StaCorrection).filter_by(sta="FUR", seedchan="BHN"))
+    assert (channel.ml_corr, channel.me_corr, channel.md_corr) == (corrections["ml"], corrections["me"], None)
+
+    # closed channels are no longer active
+    close_epochs(session, ["GR.FUR"], channel="BH?", endtime=datetime.datetime(2020, 1, 1))
+    assert active_channel(session, "GR", "FUR", "BHN", "--") is None
+    assert active_channel(session, "GR", "WET", "BHN", "") is not None
+    assert session.query(ActiveChannel).count() == session.query(Channel).count() - 3
+
+def test_only_loaded_stations_are_refreshed():
+    factory = session_factory()
+    session = factory()
+    inventory = read_inventory().select(network="GR")
+    inventory2db(session, inventory)
+    session.query(ActiveChannel).filter_by(sta="WET").delete()
+    session.commit()
+
+    inventory2db(session, inventory.select(station="FUR"))
+    assert session.query(ActiveChannel).filter_by(sta="FUR").count() > 0
+    assert session.query(ActiveChannel).filter_by(sta="WET").count() == 0
+    # all stations, at a time before the epochs opened
+    assert refresh_active_channels(session, now=datetime.datetime(1990, 1, 1)) == 0
+    assert refresh_active_channels(session) == session.query(Channel).count()
+
+def test_without_table():
+    factory = session_factory([table for table in Base.metadata.sorted_tables if table is not ActiveChannel.__table__])
+    report = Loader(factory, sink_factory=CoreSink).load(read_inventory().select(station="FUR"))
+    assert report.good("channel_data") > 0
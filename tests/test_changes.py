@@ -0,0 +1,42 @@
+import json
+
+from obspy import read_inventory
+
+from aqms_ir.changes import ChangeSet, _payloads
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.schema import ChangeLog, SimpleResponse
+
+from helpers import memory_session
+
+def _load(session, inventory, **kwargs):
+    changes = ChangeSet()
+    inventory2db(session, inventory, changes=changes, **kwargs)
+    return changes
+
+def test_change_set():
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    n_channels = len(inventory.get_contents()["channels"])
+
+    changes = _load(session, inventory)
+    assert len(changes.changes["inserted"]) == n_channels and len(changes) == n_channels
+
+    # deleted and written again with the same values: no changes
+    assert len(_load(session, inventory)) == 0
+
+    session.query(SimpleResponse).filter_by(sta="FUR", seedchan="BHZ").one().gain = 3
+    session.commit()
+    changes = _load(session, inventory)
+    assert [(e["change"], e["sta"], e["seedchan"]) for e in changes.entries()] == [("updated", "FUR", "BHZ")]
+
+    changes = _load(session, inventory.select(channel="BH?"))
+    assert len(changes.changes["deleted"]) == n_channels - len(inventory.select(channel="BH?").get_contents()["channels"])
+    assert changes.as_dict()["deleted"] == len(changes)
+    assert changes.log(session) == len(changes) == session.query(ChangeLog).count()
+
+def test_payloads():
+    entries = [{"change": "inserted", "net": "UW", "sta": "S{:04d}".format(i)} for i in range(1000)]
+    payloads = list(_payloads(entries))
+    assert len(payloads) > 1
+    assert all(len(payload) < 8000 for payload in payloads)
+    assert sum(len(json.loads(payload)) for payload in payloads) == 1000
@@ -0,0 +1,161 @@
+import json
+
+import pytest
+from obspy import read_inventory
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, IntegrityError, ProgrammingError
+
+from aqms_ir.checkpoint import Checkpoint, file_hash
+from aqms_ir.inv2schema import inventory2db, stream2db
+from aqms_ir.retry import retry, is_transient
+from aqms_ir.schema import Channel, Station
+from aqms_ir.sinks import CoreSink, UpsertSink
+from aqms_ir.verify import verify_inventory
+from aqms_ir.xmlfilter import iter_stationxml
+
+from helpers import memory_session, two_epochs
+
+class FlakySink(CoreSink):
+    """ CoreSink whose inserts for station sta fail failures times with a dropped connection """
+    backoff = 0
+
+    def __init__(self, session, sta, failures):
+        CoreSink.__init__(self, session)
+        self.sta = sta
+        self.failures = failures
+
+    def _bulk_insert(self, table, records):
+        if self.failures and records[0].get("sta") == self.sta:
+            self.failures -= 1
+            raise OperationalError("INSERT", {}, Exception("server closed the connection unexpectedly"),
+                                   connection_invalidated=True)
+        return CoreSink._bulk_insert(self, table, records)
+
+def _setup(tmp_path):
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    filename = str(tmp_path / "GR.xml")
+    inventory.write(filename, format="STATIONXML")
+    return session, inventory, filename
+
+def test_transient_errors_are_retried(tmp_path):
+    session, inventory, filename = _setup(tmp_path)
+    sink = FlakySink(session, "WET", FlakySink.retries)
+    report = inventory2db(session, inventory, sink=sink)
+    assert report.good("channel_data") == len(inventory.get_contents()["channels"])
+    assert verify_inventory(session, inventory)
+
+def test_resume_after_outage(tmp_path):
+    session, inventory, filename = _setup(tmp_path)
+    name = str(tmp_path / "GR.checkpoint")
+
+    # the database goes away while loading the second station
+    checkpoint = Checkpoint(name, file_hash(filename), batch=1)
+    with pytest.raises(OperationalError):
+        inventory2db(session, inventory, sink=FlakySink(session, "WET", 100), checkpoint=checkpoint)
+    with open(name) as fp:
+        assert json.load(fp)["stations"] == ["GR.FUR"]
+    assert session.query(Channel).filter_by(sta="WET").count() == 0
+
+    checkpoint = Checkpoint(name, file_hash(filename), resume=True)
+    report = inventory2db(session, inventory, sink=CoreSink(session), checkpoint=checkpoint)
+    # only WET was loaded again
+    assert report.good("channel_data") == len(inventory.select(station="WET").get_contents()["channels"])
+    assert verify_inventory(session, inventory)
+    with open(name) as fp:
+        assert json.load(fp)["stations"] == ["GR.FUR", "GR.WET"]
+
+def test_resume_station_epochs(tmp_path):
+    session, inventory, filename = _setup(tmp_path)
+    two_epochs(inventory)
+    inventory.write(filename, format="STATIONXML")
+    name = str(tmp_path / "GR.checkpoint")
+    channels = len(inventory.select(station="FUR").get_contents()["channels"])
+
+    # every epoch of FUR is loaded before FUR is completed
+    checkpoint = Checkpoint(name, file_hash(filename), batch=1)
+    with pytest.raises(OperationalError):
+        inventory2db(session, inventory, sink=FlakySink(session, "WET", 100), checkpoint=checkpoint)
+    assert session.query(Station).filter_by(sta="FUR").count() == 2
+    assert session.query(Channel).filter_by(sta="FUR").count() == channels == 24
+
+    checkpoint = Checkpoint(name, file_hash(filename), resume=True)
+    inventory2db(session, inventory, sink=UpsertSink(session), checkpoint=checkpoint)
+    assert verify_inventory(session, inventory)
+
+    # so are the epochs streamed one at a time
+    session.query(Station).delete()
+    session.query(Channel).delete()
+    session.commit()
+    checkpoint = Checkpoint(str(tmp_path / "stream.checkpoint"), file_hash(filename))
+    stream2db(session, iter_stationxml(filename), sink=CoreSink(session), checkpoint=checkpoint)
+    assert session.query(Station).filter_by(sta="FUR").count() == 2
+    assert session.query(Channel).filter_by(sta="FUR").count() == channels
+
+def _fail_delete(session, sta, errors):
+    """ the DELETE FROM station_data of station sta raises the errors, one per attempt """
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if errors and statement.startswith("DELETE FROM station_data") and sta in parameters:
+            raise errors.pop(0)
+    event.listen(session.get_bind(), "before_cursor_execute", before_cursor_execute)
+    return
+
+def test_transient_error_while_removing(tmp_path):
+    session, inventory, filename = _setup(tmp_path)
+    inventory2db(session, inventory, sink=CoreSink(session))
+    dropped = OperationalError("DELETE", {}, Exception("server closed the connection unexpectedly"),
+                               connection_invalidated=True)
+    _fail_delete(session, "FUR", [dropped])
+    report = inventory2db(session, inventory, sink=CoreSink(session))
+    assert report.good("channel_data") == len(inventory.get_contents()["channels"])
+    assert verify_inventory(session, inventory)
+
+def test_station_that_can_not_be_removed_fails(tmp_path):
+    session, inventory, filename = _setup(tmp_path)
+    _fail_delete(session, "FUR", [ProgrammingError("DELETE", {}, Exception("permission denied"))])
+    report = inventory2db(session, inventory, sink=CoreSink(session))
+    assert report.bad("station_data") == 1
+    assert report.failures["station_data"][0]["key"] == "GR.FUR"
+    assert session.query(Station).filter_by(sta="FUR").count() == 0
+    assert session.query(Station).filter_by(sta="WET").count() == 1
+
+def test_checkpoint_of_other_input(tmp_path):
+    name = str(tmp_path / "checkpoint")
+    Checkpoint(name, "abc").save()
+    with pytest.raises(ValueError):
+        Checkpoint(name, "def", resume=True)
+
+def test_checkpoint_of_other_options(tmp_path):
+    name = str(tmp_path / "checkpoint")
+    options = {"station": "F*", "channel": "BH?", "active": False, "include_pz": False}
+    Checkpoint(name, "abc", options=options).save()
+    with open(name) as fp:
+        assert json.load(fp)["options"] == options
+    assert Checkpoint(name, "abc", resume=True, options=dict(options)).options == options
+    # another selection would skip stations it never loaded
+    with pytest.raises(ValueError):
+        Checkpoint(name, "abc", resume=True, options=dict(options, station="W*"))
+    with pytest.raises(ValueError):
+        Checkpoint(name, "abc", resume=True, options=dict(options, include_pz=True))
+    # without resume the checkpoint starts over
+    assert not Checkpoint(name, "def").stations
+
+def test_retry_only_transient_errors():
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise IntegrityError("INSERT", {}, Exception("duplicate key"))
+
+    with pytest.raises(IntegrityError):
+        retry(fail, retries=3, backoff=0)
+    assert len(calls) == 1
+
+def test_transient_errors():
+    class Deadlock(Exception):
+        pgcode = "40P01"
+
+    assert is_transient(OperationalError("UPDATE", {}, Deadlock("deadlock detected")))
+    assert is_transient(OperationalError("SELECT", {}, Exception("terminated"), connection_invalidated=True))
+    assert not is_transient(OperationalError("SELECT", {}, Exception("no such table: station_data")))
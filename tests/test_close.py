@@ -0,0 +1,74 @@
+import datetime
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+from obspy import read_inventory
+
+from aqms_ir.close import close_epochs, read_stations
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.rows import DEFAULT_ENDDATE
+from aqms_ir.schema import Station, Channel, SimpleResponse, StaCorrection
+
+from helpers import memory_session
+
+def _session():
+    session = memory_session()
+    inventory2db(session, read_inventory().select(network="GR"))
+    return session
+
+def test_close_channels():
+    session = _session()
+    endtime = datetime.datetime(2020, 1, 1)
+    closed = close_epochs(session, ["GR.F*", ("GR", "WET")], channel="[BH]H[NE]", endtime=endtime, dry_run=True)
+    assert closed["channel_data"] == 8
+    assert session.query(Channel).filter(Channel.offdate == endtime).count() == 0
+
+    closed = close_epochs(session, ["GR.F*", ("GR", "WET")], channel="[BH]H[NE]", endtime=endtime)
+    assert "station_data" not in closed
+    assert closed["channel_data"] == 8
+    assert closed["stacorrections"] == 16
+    assert session.query(SimpleResponse).filter(SimpleResponse.offdate == endtime).count() == 8
+    assert session.query(Station).filter(Station.offdate == DEFAULT_ENDDATE).count() == 2
+
+    # already closed epochs are not touched again
+    assert close_epochs(session, ["GR.FUR"], channel="BHN", endtime=datetime.datetime(2021, 1, 1))["channel_data"] == 0
+
+def test_close_stations():
+    session = _session()
+    closed = close_epochs(session, ["GR.*"])
+    assert closed["station_data"] == 2
+    assert closed["channel_data"] == session.query(Channel).count()
+    assert session.query(StaCorrection).filter(StaCorrection.offdate == DEFAULT_ENDDATE).count() == 0
+    # closed now, in UTC like the offdates of the loads
+    offdate = session.query(Station).first().offdate
+    assert abs((offdate - datetime.datetime.utcnow()).total_seconds()) < 60
+
+def test_read_stations():
+    stations = read_stations(io.StringIO("# stations to close\nGR.FUR\n\n  GR.WET  # moved\n"))
+    assert stations == [("GR", "FUR"), ("GR", "WET")]
+    with pytest.raises(ValueError) as error:
+        read_stations(io.StringIO("GR.FUR\nGRWET\nGR.W.ET\n"))
+    assert "line 2" in str(error.value) and "line 3" in str(error.value)
+
+    # nothing is closed when one of the stations is malformed
+    session = _session()
+    with pytest.raises(ValueError):
+        close_epochs(session, ["GR.FUR", "GR"])
+    assert session.query(Station).filter(Station.offdate == DEFAULT_ENDDATE).count() == 2
+
+def test_bad_arguments(tmp_path):
+    # rejected before connecting to the database
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    env.pop("DB_PASSWORD", None)
+    stations = tmp_path / "stations.txt"
+    stations.write_text(u"GR.FUR\nGR WET\n")
+    for arguments in (["GR", "FUR", "-e", "2020-01-01"], ["-f", str(stations)]):
+        process = subprocess.run([sys.executable, os.path.join(root, "closeStation")] + arguments, env=env,
+                                 cwd=str(tmp_path), stdin=subprocess.DEVNULL, capture_output=True)
+        assert process.returncode == 2
+        assert b"usage" in process.stderr
+    assert b"line 2" in process.stderr
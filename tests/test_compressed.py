@@ -0,0 +1,64 @@
+import gzip
+import io
+
+import pytest
+from obspy import read_inventory
+
+from aqms_ir.compressed import open_input, open_output, compression_of
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.schema2inv import write_stationxml
+from aqms_ir.xmlfilter import read_stationxml, iter_stationxml
+
+from helpers import memory_session
+
+def _channels(inventory):
+    return sorted(inventory.get_contents()["channels"])
+
+def _write(filename, inventory, compression=None):
+    with open_output(filename, compression) as fp:
+        inventory.write(fp, format="STATIONXML")
+    return filename
+
+def test_gzip(tmp_path):
+    inventory = read_inventory()
+    filename = _write(str(tmp_path / "inventory.xml.gz"), inventory)
+    with open(filename, "rb") as fp:
+        assert fp.read(2) == b"\x1f\x8b"
+    # the same document compresses to the same file
+    with open(filename, "rb") as fp, open(_write(str(tmp_path / "again.xml.gz"), inventory), "rb") as again:
+        assert fp.read() == again.read()
+
+    assert _channels(read_stationxml(filename)) == _channels(inventory)
+    assert _channels(read_stationxml(filename, channel="BH?")) == _channels(inventory.select(channel="BH?"))
+    streamed = [channel for part in iter_stationxml(filename, network="GR") for channel in _channels(part)]
+    assert sorted(streamed) == _channels(inventory.select(network="GR"))
+
+def test_recognized_by_magic_bytes(tmp_path):
+    inventory = read_inventory().select(network="GR")
+    # gzip compressed, whatever the name says
+    filename = _write(str(tmp_path / "inventory.xml"), inventory, compression="gzip")
+    assert compression_of(filename) is None
+    assert _channels(read_stationxml(filename)) == _channels(inventory)
+    # file objects without peek, compressed or not
+    with open(filename, "rb") as fp:
+        assert _channels(read_stationxml(io.BytesIO(fp.read()))) == _channels(inventory)
+    with open(filename, "rb") as fp:
+        plain = io.BytesIO(gzip.decompress(fp.read()))
+    with open_input(plain) as source:
+        assert source.read(5) == b"<?xml"
+
+def test_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    inventory = read_inventory().select(network="GR")
+    filename = _write(str(tmp_path / "inventory.xml.zst"), inventory)
+    assert _channels(read_stationxml(filename, channel="BH?")) == _channels(inventory.select(channel="BH?"))
+
+def test_write_stationxml(tmp_path):
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    inventory2db(session, inventory)
+
+    filename = str(tmp_path / "dump.xml.gz")
+    assert write_stationxml(session, filename) == 1
+    with gzip.open(filename) as fp:
+        assert _channels(read_inventory(fp, format="STATIONXML")) == _channels(inventory)
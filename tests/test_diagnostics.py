@@ -0,0 +1,64 @@
+import logging
+
+import numpy as np
+
+from obspy import read_inventory
+from obspy.signal.invsim import paz_2_amplitude_value_of_freq_resp
+
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.schema import SimpleResponse
+from aqms_ir.sinks import CoreSink
+from aqms_ir.util import paz_amplitudes, stage_diagnostics, inventory_diagnostics, simple_response
+
+from helpers import memory_session
+
+def test_paz_amplitudes():
+    poles = [[-4.44 + 4.44j, -4.44 - 4.44j], [-0.037 + 0.037j, -0.037 - 0.037j, -251.3], []]
+    zeros = [[0j, 0j], [0j], [0j]]
+    gains = [0.4, 60077000.0, 2.0]
+    frequencies = [1.0, 0.02, 5.0]
+    expected = [paz_2_amplitude_value_of_freq_resp({"poles": p, "zeros": z, "gain": g}, f)
+                for p, z, g, f in zip(poles, zeros, gains, frequencies)]
+    np.testing.assert_allclose(paz_amplitudes(poles, zeros, gains, frequencies), expected, rtol=1e-12)
+
+def test_stage_diagnostics():
+    inventory = read_inventory().select(network="GR", channel="BHZ")
+    diagnostics = inventory_diagnostics(inventory)
+    channels = set(diagnostic.channel for diagnostic in diagnostics)
+    assert len(channels) == len(inventory.get_contents()["channels"])
+    # one sensitivity check per channel
+    assert len([d for d in diagnostics if d.stage == 0]) == len(channels)
+    assert all(d.ok for d in diagnostics)
+
+    # a wrong normalization factor is reported, and the stage gain is scaled
+    # with the calculated amplitude in the total gain, as in simple_response
+    response = inventory[0][0][0].response
+    response.response_stages[0].normalization_factor *= 2
+    stage, total = stage_diagnostics([("X", response)], tolerance=0.05)
+    assert not stage.ok and abs(stage.deviation - 1.0) < 0.05
+    assert total.stage == 0 and not total.ok
+    assert abs(total.calculated / total.expected - 2) < 0.1
+
+def test_load_reports_diagnostics(monkeypatch, caplog):
+    inventory = read_inventory().select(network="GR")
+    inventory[0][0].select(channel="BHZ")[0].response.response_stages[0].normalization_factor *= 2
+
+    calls = []
+    def counted(responses, *args, **kwargs):
+        calls.append(len(responses))
+        return stage_diagnostics(responses, *args, **kwargs)
+    monkeypatch.setattr("aqms_ir.util.stage_diagnostics", counted)
+
+    session = memory_session()
+    with caplog.at_level(logging.WARNING):
+        report = inventory2db(session, inventory, sink=CoreSink(session))
+    # one pass per station, nothing logged per channel
+    assert len(calls) == 2
+    assert not [record for record in caplog.records if "normaliz" in record.getMessage()]
+    assert report.bad("normalization") == 1
+    assert report.failures["normalization"][0]["key"].startswith("GR.FUR..BHZ.")
+    assert "stage 1" in report.failures["normalization"][0]["error"]
+    # the same gain as a check of the channel on its own
+    channel = inventory.select(station="WET", channel="BHZ")[0][0][0]
+    gain = float(session.query(SimpleResponse).filter_by(sta="WET", seedchan="BHZ").one().gain)
+    assert abs(gain - simple_response(channel.sample_rate, channel.response)[4]) < 1e-6 * gain
@@ -0,0 +1,62 @@
+import datetime
+
+from obspy import read_inventory, UTCDateTime
+
+from aqms_ir.epoch_index import ChannelIndex
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.schema import Channel, SimpleResponse
+
+from helpers import memory_session
+
+def test_channel_index():
+    session = memory_session()
+    inventory2db(session, read_inventory())
+
+    index = ChannelIndex(session, margin=datetime.timedelta(0))
+    assert len(index) == session.query(SimpleResponse).count()
+
+    row = session.query(SimpleResponse).filter_by(net="GR", sta="FUR", seedchan="BHZ").one()
+    epoch = index.lookup("GR", "FUR", "BHZ", "", UTCDateTime(2010, 1, 1))
+    assert epoch.gain == float(row.gain)
+    assert epoch.gain_units == row.gain_units
+    assert epoch.clip is not None and epoch.cutoff is not None
+    assert index.lookup("GR", "FUR", "BHZ", "--", UTCDateTime(2000, 1, 1)) is None
+    assert index.lookup("GR", "FUR", "XXX", "", UTCDateTime(2010, 1, 1)) is None
+
+    # a reload of the station shows up after refresh
+    row.gain = 2.0
+    row.lddate = datetime.datetime(2999, 1, 1)
+    session.commit()
+    assert index.lookup("GR", "FUR", "BHZ", "", datetime.datetime(2010, 1, 1)).gain != 2.0
+    assert index.refresh() == 1
+    assert index.lookup("GR", "FUR", "BHZ", "", datetime.datetime(2010, 1, 1)).gain == 2.0
+    assert len(index) == session.query(SimpleResponse).count()
+
+def test_refresh_after_deletes():
+    session = memory_session()
+    inventory2db(session, read_inventory().select(network="GR"))
+    index = ChannelIndex(session, margin=datetime.timedelta(0))
+
+    # deleted station and epochs, the remaining rows keep their lddate
+    session.query(Channel).filter_by(sta="WET").delete()
+    session.query(Channel).filter_by(sta="FUR", seedchan="BHN").delete()
+    session.commit()
+    assert index.refresh() == 2
+    assert index.lookup("GR", "WET", "BHZ", "", UTCDateTime(2010, 1, 1)) is None
+    assert index.lookup("GR", "FUR", "BHN", "", UTCDateTime(2010, 1, 1)) is None
+    assert len(index) == session.query(Channel).count()
+    assert index.refresh() == 0
+
+def test_refresh_with_backdated_lddate():
+    session = memory_session()
+    inventory2db(session, read_inventory().select(network="GR"))
+    index = ChannelIndex(session, margin=datetime.timedelta(hours=1))
+
+    # committed after the build by a transaction that started ten minutes before it
+    row = session.query(SimpleResponse).filter_by(sta="FUR", seedchan="BHZ").one()
+    row.gain = 2.0
+    row.lddate = index.lddate - datetime.timedelta(minutes=10)
+    session.commit()
+    index.refresh()
+    assert index.lookup("GR", "FUR", "BHZ", "", UTCDateTime(2010, 1, 1)).gain == 2.0
+
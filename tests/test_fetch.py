@@ -0,0 +1,89 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from obspy import read_inventory
+
+from aqms_ir.fetch import fetch_inventories, merge_inventories
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds each stand-in service takes to answer
+DELAY = 0.5
+
+def _server(inventory, delay=DELAY):
+    """ stand-in FDSN station webservice that answers every query with inventory """
+    buf = io.BytesIO()
+    inventory.write(buf, format="STATIONXML")
+    body = buf.getvalue()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            return
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+def _services():
+    inventory = read_inventory()
+    first = inventory.select(station="FUR")
+    # overlaps the FUR epoch of the first service, with another elevation
+    second = inventory.select(network="GR")
+    for station in second[0]:
+        station.elevation = 1000.0
+    third = inventory.select(network="BW")
+    return [_server(first), _server(second), _server(third)]
+
+def test_concurrent_fetch_and_merge():
+    servers = _services()
+    try:
+        start = time.time()
+        results = fetch_inventories([url for server, url in servers] + ["http://127.0.0.1:1"], level="response")
+        elapsed = time.time() - start
+    finally:
+        for server, url in servers:
+            server.shutdown()
+    # the services answered at the same time
+    assert elapsed < 2 * DELAY
+    assert isinstance(list(results.values())[-1], Exception)
+
+    inventory = merge_inventories([(service, result) for service, result in results.items()
+                                   if not isinstance(result, Exception)])
+    assert [network.code for network in inventory] == ["BW", "GR"]
+    stations = dict((station.code, station) for station in inventory.select(network="GR")[0])
+    assert sorted(stations) == ["FUR", "WET"]
+    # FUR of the first service, WET only the second service has
+    assert float(stations["FUR"].elevation) != 1000.0
+    assert float(stations["WET"].elevation) == 1000.0
+    # the order of the services, not of their answers, decides
+    reverse = merge_inventories([(service, result) for service, result in reversed(list(results.items()))
+                                 if not isinstance(result, Exception)])
+    assert float(reverse.select(network="GR", station="FUR")[0][0].elevation) == 1000.0
+
+def test_get_stationxml(tmp_path):
+    servers = _services()
+    try:
+        command = [sys.executable, os.path.join(ROOT, "getStationXML"), "GR,BW", "-f", "merged.xml",
+                   "-ws", ",".join(url for server, url in servers[:2]), "-ws", servers[2][1]]
+        subprocess.check_call(command, cwd=str(tmp_path), env=dict(os.environ, PYTHONPATH=ROOT),
+                              stdout=subprocess.DEVNULL)
+    finally:
+        for server, url in servers:
+            server.shutdown()
+    inventory = read_inventory(str(tmp_path / "merged.xml"))
+    assert sorted(set(station.code for network in inventory for station in network)) == \
+           sorted(set(station.code for network in read_inventory() for station in network))
@@ -0,0 +1,54 @@
+import threading
+
+from obspy import read_inventory
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from aqms_ir.loader import Loader
+from aqms_ir.profiling import Timings
+from aqms_ir.schema import Base, Channel, PZ
+from aqms_ir.sinks import CoreSink
+from aqms_ir.verify import verify_inventory
+
+from helpers import session_factory
+
+def test_concurrent_loads(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "ir.db"), connect_args={"timeout": 30})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    inventory = read_inventory().select(network="GR")
+
+    # different options for each network, loaded at the same time
+    loaders = {"FUR": Loader(factory, include_pz=True),
+               "WET": Loader(factory, sink_factory=CoreSink)}
+    reports, timings = {}, {}
+
+    def run(sta):
+        timings[sta] = Timings()
+        reports[sta] = loaders[sta].load(inventory.select(station=sta), timings=timings[sta])
+
+    threads = [threading.Thread(target=run, args=(sta,)) for sta in loaders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    session = factory()
+    for sta in loaders:
+        assert reports[sta].good("channel_data") == session.query(Channel).filter_by(sta=sta).count()
+        assert timings[sta].as_dict()["stages"]
+    assert session.query(Channel).count() == len(inventory.get_contents()["channels"])
+    # only the FUR load included the poles and zeros
+    assert session.query(PZ).count() > 0
+    assert not loaders["WET"].include_pz
+
+def test_constant_memory(tmp_path):
+    factory = session_factory()
+    inventory = read_inventory().select(network="GR")
+    filename = str(tmp_path / "GR.xml")
+    inventory.write(filename, format="STATIONXML")
+
+    report = Loader(factory, sink_factory=CoreSink, constant_memory=True).load_file(filename)
+    assert report.good("channel_data") == len(inventory.get_contents()["channels"])
+    assert verify_inventory(factory(), inventory)
@@ -0,0 +1,139 @@
+import copy
+
+from obspy import read_inventory
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from aqms_ir.close import close_epochs
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.loader import Loader
+from aqms_ir.manifest import Manifest, MANIFEST_VERSION
+from aqms_ir.profiling import Timings
+from aqms_ir.schema import Channel, LoadManifest, Station, create_tables
+from aqms_ir.sinks import CoreSink, UpsertSink
+from aqms_ir.verify import verify_inventory
+from aqms_ir.xmlfilter import read_stationxml, iter_stationxml
+
+from helpers import session_factory, two_epochs
+
+def _setup(tmp_path):
+    factory = session_factory()
+    inventory = read_inventory().select(network="GR")
+    filename = str(tmp_path / "GR.xml")
+    inventory.write(filename, format="STATIONXML")
+    return factory, inventory, filename
+
+def test_unchanged_stations_are_skipped(tmp_path):
+    factory, inventory, filename = _setup(tmp_path)
+    loader = Loader(factory, sink_factory=CoreSink, manifest=True)
+    report = loader.load_file(filename)
+    assert report.good("channel_data") == len(inventory.get_contents()["channels"])
+    assert [row.version for row in factory().query(LoadManifest)] == [MANIFEST_VERSION] * 2
+
+    timings = Timings()
+    report = loader.load_file(filename, timings=timings)
+    assert report.good("channel_data") == 0
+    assert timings.as_dict()["counters"]["stations_unchanged"] == 2
+
+    # only the station that changed is loaded again
+    station = [station for station in inventory[0] if station.code == "WET"][0]
+    station.elevation = float(station.elevation) + 1.0
+    inventory.write(filename, format="STATIONXML")
+    report = loader.load_file(filename)
+    assert report.good("station_data") == 1
+    assert report.good("channel_data") == len(inventory.select(station="WET").get_contents()["channels"])
+    assert verify_inventory(factory(), inventory)
+
+    # so is every station when the load options change
+    report = Loader(factory, sink_factory=CoreSink, manifest=True, active=True).load_file(filename)
+    assert report.good("station_data") == 2
+
+    # and when the rows of a load change
+    fingerprints = {}
+    read_stationxml(filename, fingerprints=fingerprints)
+    manifest = Manifest(factory(), fingerprints, options={"active": True, "include_pz": False})
+    assert manifest.unchanged("GR", "FUR")
+    manifest = Manifest(factory(), fingerprints, options={"active": True, "include_pz": False}, version="0")
+    assert not manifest.unchanged("GR", "FUR")
+
+
+def test_other_changes_invalidate_the_manifest(tmp_path):
+    factory, inventory, filename = _setup(tmp_path)
+    Loader(factory, manifest=True).load_file(filename)
+    session = factory()
+
+    inventory2db(session, inventory.select(station="FUR"))
+    assert [row.sta for row in session.query(LoadManifest)] == ["WET"]
+    close_epochs(session, ["GR.WET"])
+    assert session.query(LoadManifest).count() == 0
+
+def test_fingerprints(tmp_path):
+    factory, inventory, filename = _setup(tmp_path)
+    parsed, streamed, selected = {}, {}, {}
+    read_stationxml(filename, fingerprints=parsed)
+    list(iter_stationxml(filename, fingerprints=streamed))
+    assert parsed == streamed
+    assert sorted(parsed) == [("GR", "FUR"), ("GR", "WET")]
+
+    # the fingerprint chained over the epochs of a station is the same when streamed
+    two_epochs(inventory)
+    inventory.write(filename, format="STATIONXML")
+    epochs, streamed = {}, {}
+    read_stationxml(filename, fingerprints=epochs)
+    list(iter_stationxml(filename, fingerprints=streamed))
+    assert epochs == streamed
+    assert epochs[("GR", "FUR")] != parsed[("GR", "FUR")]
+    assert epochs[("GR", "WET")] == parsed[("GR", "WET")]
+
+    # the fingerprint covers the selected channels only
+    read_stationxml(filename, channel="BH?", fingerprints=selected)
+    assert selected[("GR", "FUR")] != parsed[("GR", "FUR")]
+
+def test_station_epochs(tmp_path):
+    factory, inventory, filename = _setup(tmp_path)
+    two_epochs(inventory)
+    inventory.write(filename, format="STATIONXML")
+    channels = len(inventory.select(station="FUR").get_contents()["channels"])
+    session = factory()
+    inventory2db(session, inventory, sink=UpsertSink(session))
+
+    for constant_memory in (False, True):
+        loader = Loader(factory, sink_factory=UpsertSink, manifest=True, constant_memory=constant_memory)
+        session.query(LoadManifest).delete()
+        session.commit()
+        # the second epoch of FUR is not skipped after the first one has been loaded
+        report = loader.load_file(filename)
+        assert report.good("station_data") == 3
+        assert session.query(Station).filter_by(sta="FUR").count() == 2
+        assert session.query(Channel).filter_by(sta="FUR").count() == channels == 24
+
+        # both epochs are skipped together
+        timings = Timings()
+        report = loader.load_file(filename, timings=timings)
+        assert report.good("station_data") == 0
+        assert timings.as_dict()["counters"]["stations_unchanged"] == 2
+        assert session.query(Channel).filter_by(sta="FUR").count() == channels
+    assert verify_inventory(session, inventory)
+
+    # a station in two networks with the same code is loaded, or skipped, as a whole
+    network = copy.deepcopy(inventory[0])
+    network.stations = [inventory[0].stations.pop(1)]
+    network.stations[0].elevation = float(network.stations[0].elevation) + 1.0
+    inventory.networks.append(network)
+    inventory.write(filename, format="STATIONXML")
+    for count in (2, 0):
+        report = Loader(factory, sink_factory=UpsertSink, manifest=True).load_file(filename)
+        assert report.good("station_data") == count
+        assert session.query(Channel).filter_by(sta="FUR").count() == channels
+
+def test_optional_tables():
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+    assert not inspect(engine).has_table(LoadManifest.__tablename__)
+    session = sessionmaker(bind=engine)()
+    report = inventory2db(session, read_inventory().select(station="FUR"), sink=CoreSink(session))
+    assert report.good("station_data") == 1
+
+    create_tables(engine, [LoadManifest])
+    assert inspect(engine).has_table(LoadManifest.__tablename__)
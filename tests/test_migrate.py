@@ -0,0 +1,71 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from aqms_ir.dictionary import get_abbreviation_id, get_unit_id, get_format_id, _insert
+from aqms_ir.migrate import migrate, has_index, UNIT_INDEX
+from aqms_ir.schema import Base, Abbreviation, Unit
+
+def test_migrate():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+
+    results = dict(migrate(engine, dry_run=True))
+    assert set(results.values()) == set(["pending"])
+    results = dict(migrate(engine))
+    assert set(results.values()) == set(["created"])
+    assert set(dict(migrate(engine)).values()) == set(["exists"])
+    indexes = [index["name"] for index in inspect(engine).get_indexes("d_abbreviation")]
+    assert "ux_d_abbreviation_description" in indexes
+
+def test_migrate_duplicates():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Abbreviation(description="STS-2"), Abbreviation(description="STS-2")])
+    session.commit()
+    assert dict(migrate(engine))["ux_d_abbreviation_description"] == "duplicates"
+
+def test_dictionary_insert():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    migrate(engine)
+    session = sessionmaker(bind=engine)()
+
+    abbreviation_id = get_abbreviation_id(session, "STS-2")
+    assert get_abbreviation_id(session, "STS-2") == abbreviation_id
+    # another loader added the entry between the lookup and the insert
+    assert _insert(session, Abbreviation, description="STS-2") == abbreviation_id
+    assert session.query(Abbreviation).count() == 1
+
+    assert get_unit_id(session, "M/S", "Velocity") == get_unit_id(session, "M/S", "Velocity")
+    assert get_format_id(session) == get_format_id(session, "UNKNOWN")
+
+def test_unit_without_description():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Unit(name="COUNTS"), Unit(name="COUNTS")])
+    session.commit()
+    # NULL descriptions are duplicates as well
+    assert dict(migrate(engine))["ux_d_unit_name_description"] == "duplicates"
+    assert not has_index(engine, UNIT_INDEX)
+
+    session.query(Unit).delete()
+    session.commit()
+    assert dict(migrate(engine))["ux_d_unit_name_description"] == "created"
+    assert dict(migrate(engine))["ux_d_unit_name_description"] == "exists"
+    assert has_index(engine, UNIT_INDEX)
+
+    unit_id = get_unit_id(session, "COUNTS", None)
+    assert _insert(session, Unit, name="COUNTS", description=None) == unit_id
+    assert get_unit_id(session, "COUNTS", "") == unit_id
+    assert session.query(Unit).count() == 1
+
+def test_plain_unit_index_is_replaced():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE UNIQUE INDEX ux_d_unit_name_description ON d_unit (name, description)"))
+    assert not has_index(engine, UNIT_INDEX)
+    assert dict(migrate(engine))["ux_d_unit_name_description"] == "created"
+    assert has_index(engine, UNIT_INDEX)
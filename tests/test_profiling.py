@@ -0,0 +1,43 @@
+import json
+
+from aqms_ir.profiling import Timings, collect, stage, count, current
+
+def test_stage_outside_collect():
+    assert current() is None
+    with stage("nothing"):
+        count("nothing")
+
+def test_collect():
+    timings = Timings()
+    with collect(timings):
+        for i in range(3):
+            with stage("simple_response"):
+                pass
+        count("channels", 3)
+        inner = Timings()
+        with collect(inner):
+            with stage("commit"):
+                pass
+        assert current() is timings
+    assert timings.stages["simple_response"][0] == 3
+    assert timings.counters["channels"] == 3
+    assert "commit" not in timings.stages
+    assert timings.merge(inner).stages["commit"][0] == 1
+
+def test_write(tmpdir):
+    timings = Timings()
+    timings.add("insert.channel_data", 0.5, calls=10)
+    timings.count("stations")
+
+    filename = str(tmpdir.join("load.json"))
+    timings.write(filename)
+    with open(filename) as fp:
+        document = json.load(fp)
+    assert document["stages"]["insert.channel_data"] == {"calls": 10, "seconds": 0.5}
+
+    filename = str(tmpdir.join("load.prom"))
+    timings.write(filename)
+    with open(filename) as fp:
+        content = fp.read()
+    assert 'aqms_ir_load_stage_calls_total{stage="insert.channel_data"} 10' in content
+    assert 'aqms_ir_load_count_total{name="stations"} 1' in content
@@ -0,0 +1,28 @@
+from aqms_ir.report import LoadReport
+
+def test_counts_and_samples():
+    report = LoadReport(max_samples=2)
+    report.success("channel_data", "UW.ABC..HNZ.2000-01-01T00:00:00")
+    for i in range(3):
+        report.failure("simple_response", "UW.ABC..HN{}.2000-01-01T00:00:00".format(i), ValueError("bad"))
+    assert report.good("channel_data") == 1
+    assert report.bad("simple_response") == 3
+    assert len(report.failures["simple_response"]) == 2
+    assert report.failures["simple_response"][0]["error"] == "bad"
+    assert report.tables_with_failures() == ["simple_response"]
+    assert not report
+    assert "1 more" in report.summary()
+
+def test_merge_and_json():
+    first = LoadReport(max_samples=2)
+    first.success("station_data", "UW.ABC.2000-01-01T00:00:00")
+    first.failure("clip", "UW.ABC..HNZ.2000-01-01T00:00:00", "no valid clip level")
+    second = LoadReport.from_json(first.to_json())
+    assert second.as_dict() == first.as_dict()
+
+    second.failure("clip", "UW.DEF..HNZ.2000-01-01T00:00:00", "no valid clip level")
+    second.failure("clip", "UW.GHI..HNZ.2000-01-01T00:00:00", "no valid clip level")
+    first.merge(second)
+    assert first.good("station_data") == 2
+    assert first.bad("clip") == 4
+    assert len(first.failures["clip"]) == 2
@@ -0,0 +1,54 @@
+import io
+import json
+
+from obspy import read_inventory
+
+from aqms_ir.rows import inventory2rows, ChannelRow, SimpleResponseRow, AmpParmsRow, StationRow
+from aqms_ir.rows import DEFAULT_ENDDATE
+from aqms_ir.sinks import JSONLinesSink
+
+def test_inventory2rows():
+    inventory = read_inventory()
+    rows = list(inventory2rows(inventory))
+
+    stations = [row for row in rows if isinstance(row, StationRow)]
+    channels = [row for row in rows if isinstance(row, ChannelRow)]
+    assert len(stations) == sum(len(network.stations) for network in inventory.networks)
+    assert len(channels) == len(inventory.get_contents()["channels"])
+
+    responses = [row for row in rows if isinstance(row, SimpleResponseRow)]
+    assert len(responses) == len(channels)
+    for row in responses:
+        assert row.gain > 0
+        assert row.high_freq_corner <= row.low_freq_corner
+        assert row.channel == row.seedchan
+
+    # the traversal does not modify the inventory
+    assert inventory.networks[0].stations[0].channels[0].sensor.description == read_inventory().networks[0].stations[0].channels[0].sensor.description
+
+def test_row_columns():
+    row = AmpParmsRow(net="UW", sta="ABC", seedchan="HNZ", location="  ", clip=1.0)
+    assert row.columns()["clip"] == 1.0
+    assert row.offdate is None
+    assert row.key() == "UW.ABC..HNZ.None"
+
+    row = ChannelRow(net="UW", sta="ABC", seedchan="HNZ", instrument="ES-T-1234=Q330-5678")
+    assert "instrument" not in row.columns()
+    assert row.as_dict()["instrument"] == "ES-T-1234=Q330-5678"
+
+def test_active_only():
+    inventory = read_inventory()
+    for network in inventory.networks:
+        for station in network.stations:
+            station.end_date = station.start_date + 1
+    assert list(inventory2rows(inventory, active=True)) == []
+    assert all(row.offdate != DEFAULT_ENDDATE for row in inventory2rows(inventory) if isinstance(row, StationRow))
+
+def test_jsonlines_sink():
+    buf = io.StringIO()
+    JSONLinesSink(buf).write(inventory2rows(read_inventory(), include_pz=True))
+    documents = [json.loads(line) for line in buf.getvalue().splitlines()]
+    tables = set(document["table"] for document in documents)
+    assert "poles_zeros" in tables and "channel_data" in tables
+    pz = [document for document in documents if document["table"] == "poles_zeros"][0]
+    assert len(pz["poles"][0]) == 2
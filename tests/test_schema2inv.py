@@ -0,0 +1,58 @@
+import datetime
+import io
+import time
+
+from obspy import read_inventory
+
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.schema import Channel, SimpleResponse
+from aqms_ir.schema2inv import db2inventory, write_stationxml
+
+from helpers import memory_session
+
+def _session():
+    session = memory_session()
+    inventory2db(session, read_inventory(), include_pz=True)
+    return session
+
+def test_db2inventory():
+    session = _session()
+    inventory = db2inventory(session, network="GR", station="F*", channel="BH?,HHZ")
+    assert [network.code for network in inventory] == ["GR"]
+    assert [station.code for station in inventory[0]] == ["FUR"]
+    channels = inventory[0][0].channels
+    assert sorted(channel.code for channel in channels) == ["BHE", "BHN", "BHZ", "HHZ"]
+
+    original = read_inventory().select(network="GR", station="FUR", channel="BHZ")[0][0][0]
+    channel = [channel for channel in channels if channel.code == "BHZ"][0]
+    assert channel.location_code == ""
+    assert channel.end_date is None
+    assert abs(channel.response.instrument_sensitivity.value - original.response.instrument_sensitivity.value) < 1.0
+    assert channel.response.get_paz().poles == original.response.get_paz().poles
+
+    assert len(db2inventory(session, network="GR", level="station")[0][0].channels) == 0
+
+def test_write_stationxml():
+    session = _session()
+    buf = io.BytesIO()
+    assert write_stationxml(session, buf, location="--") == 2
+    inventory = read_inventory(io.BytesIO(buf.getvalue()))
+    assert (inventory.source, inventory.module) == ("AQMS", "aqms-ir")
+    assert len(inventory.get_contents()["channels"]) == len(db2inventory(session).get_contents()["channels"])
+
+def test_active_in_utc(monkeypatch):
+    # a host east of UTC, where local time is ahead of the offdates
+    monkeypatch.setenv("TZ", "Asia/Tokyo")
+    time.tzset()
+    try:
+        session = _session()
+        # closes in an hour, UTC
+        offdate = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        for model in (Channel, SimpleResponse):
+            session.query(model).filter_by(sta="FUR", seedchan="BHZ").update({"offdate": offdate})
+        session.commit()
+        inventory = db2inventory(session, network="GR", station="FUR", channel="BHZ", active=True)
+        assert [channel.code for channel in inventory[0][0]] == ["BHZ"]
+    finally:
+        monkeypatch.undo()
+        time.tzset()
@@ -0,0 +1,142 @@
+import copy
+
+import pytest
+from obspy import read_inventory
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.profiling import Timings, collect
+from aqms_ir.schema import Channel, SimpleResponse, PZ, PZ_Data, Poles_Zeros
+from aqms_ir.sinks import CoreSink, UpsertSink
+from aqms_ir.verify import verify_inventory
+
+from helpers import memory_session, two_epochs
+
+def test_core_sink():
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    report = inventory2db(session, inventory, sink=CoreSink(session))
+    assert report.good("simple_response") == session.query(SimpleResponse).count()
+
+def test_upsert_sink():
+    session = memory_session()
+    inventory = read_inventory()
+    inventory2db(session, inventory, sink=UpsertSink(session))
+    assert verify_inventory(session, inventory)
+
+    # an unchanged reload does not write, a changed epoch is updated in place
+    session.query(SimpleResponse).filter_by(sta="FUR", seedchan="BHZ").one().gain = 3
+    session.commit()
+    timings = Timings()
+    with collect(timings):
+        report = inventory2db(session, inventory, sink=UpsertSink(session))
+    assert report.tables_with_failures() == ["clip"]
+    counters = timings.as_dict()["counters"]
+    assert counters["upsert_unchanged.channel_data"] == session.query(Channel).count()
+    assert counters["upsert_unchanged.simple_response"] == session.query(SimpleResponse).count() - 1
+    assert verify_inventory(session, inventory)
+
+    # epochs that are no longer in the inventory are removed
+    inventory2db(session, inventory.select(channel="?HZ"), sink=UpsertSink(session))
+    assert set(channel.seedchan[2] for channel in session.query(Channel)) == set(["Z"])
+
+class FailingUpsertSink(UpsertSink):
+    """ UpsertSink whose inserts for station sta fail with a dropped connection """
+    backoff = 0
+
+    def __init__(self, session, sta):
+        UpsertSink.__init__(self, session)
+        self.sta = sta
+
+    def _bulk_insert(self, table, records):
+        if records[0].get("sta") == self.sta:
+            raise OperationalError("INSERT", {}, Exception("server closed the connection unexpectedly"),
+                                   connection_invalidated=True)
+        return UpsertSink._bulk_insert(self, table, records)
+
+def test_upsert_sink_removes_old_epochs_of_completed_stations():
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    inventory2db(session, inventory, sink=UpsertSink(session))
+
+    # the load stops at WET, FUR has been cleaned up already
+    with pytest.raises(OperationalError):
+        inventory2db(session, inventory.select(channel="?HZ"), sink=FailingUpsertSink(session, "WET"))
+    assert set(channel.seedchan[2] for channel in session.query(Channel).filter_by(sta="FUR")) == set(["Z"])
+    assert session.query(Channel).filter_by(sta="WET").count() == \
+           len(inventory.select(station="WET").get_contents()["channels"])
+
+def test_upsert_sink_duplicate_epochs():
+    session = memory_session()
+    inventory = read_inventory().select(station="FUR")
+    station = inventory[0][0]
+    station.channels.append(copy.deepcopy(station.channels[0]))
+    report = inventory2db(session, inventory, sink=UpsertSink(session))
+    assert report.bad("channel_data") == 0
+    assert session.query(Channel).count() == len(station.channels) - 1
+
+def test_upsert_sink_removes_unused_pz():
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    inventory2db(session, inventory, include_pz=True, sink=UpsertSink(session))
+    pz = session.query(PZ).count()
+    pz_data = session.query(PZ_Data).count()
+    assert pz == session.query(Poles_Zeros).count() > 0
+
+    # replaced epochs do not leave pz rows behind
+    inventory2db(session, inventory, include_pz=True, sink=UpsertSink(session))
+    assert (session.query(PZ).count(), session.query(PZ_Data).count()) == (pz, pz_data)
+    inventory2db(session, inventory.select(channel="?HZ"), include_pz=True, sink=UpsertSink(session))
+    assert session.query(PZ).count() == session.query(Poles_Zeros).count() < pz
+    assert session.query(PZ_Data).filter(~PZ_Data.key.in_(session.query(PZ.key))).count() == 0
+
+def test_upsert_sink_retries_replaced_pz():
+    session = memory_session()
+    inventory = read_inventory().select(station="FUR", channel="BHZ")
+    inventory2db(session, inventory, include_pz=True, sink=UpsertSink(session))
+    pz = session.query(PZ).count()
+
+    # the connection drops after the old poles_zeros epoch has been deleted
+    errors = [OperationalError("INSERT", {}, Exception("server closed the connection unexpectedly"),
+                               connection_invalidated=True)]
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if errors and statement.startswith("INSERT INTO pz_data"):
+            raise errors.pop(0)
+    event.listen(session.get_bind(), "before_cursor_execute", before_cursor_execute)
+    sink = UpsertSink(session)
+    sink.backoff = 0
+    report = inventory2db(session, inventory, include_pz=True, sink=sink)
+    assert not errors
+    assert report.bad("poles_zeros") == 0
+    assert session.query(PZ).count() == session.query(Poles_Zeros).count() == pz
+    assert session.query(PZ_Data).filter(~PZ_Data.key.in_(session.query(PZ.key))).count() == 0
+
+def test_upsert_sink_drops_written_keys():
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    inventory2db(session, inventory, include_pz=True, sink=UpsertSink(session))
+
+    # the keys of a station are dropped once its old epochs have been removed
+    sink = UpsertSink(session)
+    inventory2db(session, inventory, include_pz=True, sink=sink)
+    assert sink.written == {} and sink.pz_keys == {} and sink.pending == set()
+    assert sink.cleaned == set([("GR", "FUR"), ("GR", "WET")])
+    assert session.query(PZ).count() == session.query(Poles_Zeros).count()
+
+def test_upsert_sink_station_again():
+    session = memory_session()
+    inventory = two_epochs(read_inventory().select(network="GR"))
+    channels = len(inventory.select(station="FUR").get_contents()["channels"])
+    inventory2db(session, inventory, sink=UpsertSink(session))
+
+    # the second epoch of FUR comes after WET, in another network element
+    network = copy.deepcopy(inventory[0])
+    network.stations = [inventory[0].stations.pop(1)]
+    inventory.networks.append(network)
+    sink = UpsertSink(session)
+    inventory2db(session, inventory, sink=sink)
+    assert session.query(Channel).filter_by(sta="FUR").count() == channels == 24
+    assert sink.written == {}
+    assert verify_inventory(session, inventory)
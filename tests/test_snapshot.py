@@ -0,0 +1,38 @@
+import datetime
+import sqlite3
+
+from obspy import read_inventory
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.schema import SimpleResponse
+from aqms_ir.snapshot import export_snapshot
+
+from helpers import memory_session
+
+def test_export_snapshot(tmpdir):
+    session = memory_session()
+    inventory2db(session, read_inventory())
+
+    filename = str(tmpdir.join("snapshot.db"))
+    counts = export_snapshot(session, filename, networks=["GR"])
+    assert counts["channel_data"] > 0
+    assert counts["simple_response"] == session.query(SimpleResponse).filter_by(net="GR").count()
+
+    snapshot = sqlite3.connect(filename)
+    nets = snapshot.execute("select distinct net from channel_data").fetchall()
+    assert nets == [("GR",)]
+    indexes = [row[0] for row in snapshot.execute("select name from sqlite_master where type='index'")]
+    assert "ix_simple_response_scnl_offdate" in indexes
+    info = dict(snapshot.execute("select name, value from snapshot_info").fetchall())
+    assert info["networks"] == "GR"
+    # in UTC, like the offdates
+    created = datetime.datetime.fromisoformat(info["created"])
+    assert abs((created - datetime.datetime.utcnow()).total_seconds()) < 60
+    snapshot.close()
+
+    # readable with the same ORM classes
+    reader = sessionmaker(bind=create_engine("sqlite:///" + filename))()
+    assert reader.query(SimpleResponse).count() == counts["simple_response"]
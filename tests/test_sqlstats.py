@@ -0,0 +1,47 @@
+import csv
+
+from obspy import read_inventory
+
+from aqms_ir.loader import Loader
+from aqms_ir.sinks import CoreSink
+from aqms_ir.sqlstats import SQLStats, table_name
+
+from helpers import session_factory
+
+def test_round_trips_per_station(tmp_path):
+    factory = session_factory()
+    inventory = read_inventory().select(network="GR")
+    sql = SQLStats()
+    Loader(factory, sink_factory=CoreSink).load(inventory, sql=sql)
+
+    stations = sql.stations()
+    assert sorted(s for s in stations if s != "-") == ["GR.FUR", "GR.WET"]
+    for sta in ("FUR", "WET"):
+        channels = len(inventory.select(station=sta).get_contents()["channels"])
+        statements, round_trips, rows, seconds = sql.entries[("GR." + sta, "channel_data")]
+        # one DELETE and one executemany, however many channels the station has
+        assert round_trips == 2
+        assert statements == channels + 1
+        assert rows >= channels
+    assert sql.total()["round_trips"] == sum(entry[1] for entry in stations.values())
+
+    filename = str(tmp_path / "sql.csv")
+    sql.write_csv(filename)
+    with open(filename) as fp:
+        lines = list(csv.DictReader(fp))
+    assert [line["round_trips"] for line in lines if line["station"] == "GR.FUR" and line["table"] == "*"] == \
+           [str(stations["GR.FUR"][1])]
+
+def test_slow_statements():
+    factory = session_factory()
+    sql = SQLStats(slow=0.0, max_samples=3)
+    Loader(factory, sink_factory=CoreSink).load(read_inventory().select(station="FUR"), sql=sql)
+    assert sql.slow_count > 3
+    assert len(sql.slow_statements) == 3
+    assert sql.as_dict()["slow"] == sql.slow_count
+
+def test_table_name():
+    assert table_name("INSERT INTO channel_data (net, sta) VALUES (?, ?)") == "channel_data"
+    assert table_name('DELETE FROM "Station_Data" WHERE net = ?') == "station_data"
+    assert table_name("SELECT d_unit.id FROM d_unit WHERE d_unit.name = ?") == "d_unit"
+    assert table_name("SELECT pg_notify(%(channel)s, %(payload)s)") == "select"
@@ -0,0 +1,33 @@
+import json
+
+from obspy import read_inventory
+
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.schema import StaCorrection
+from aqms_ir.stacorrections import insert_default_stacors, load_rules
+
+from helpers import memory_session
+
+def test_default_stacors(tmpdir):
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    inventory2db(session, inventory)
+
+    # BHN, BHE (20 sps) and HHN, HHE (100 sps) of FUR and WET, ml and me each
+    stacors = session.query(StaCorrection).all()
+    assert len(stacors) == 2 * 2 * 2 * 2
+    assert set((s.corr_type, float(s.corr)) for s in stacors) == set([("ml", 0.0), ("me", 1.0)])
+    assert all(s.channel == s.seedchan and s.offdate is not None for s in stacors)
+
+    # stations with corrections are left alone
+    assert insert_default_stacors(session, [("GR", "FUR"), ("GR", "WET")]) == 0
+
+    filename = str(tmpdir.join("rules.json"))
+    with open(filename, "w") as fp:
+        json.dump({"samprates": [100], "corrections": {"mlr": 0.5}}, fp)
+    rules = load_rules(filename)
+    assert rules["auth"] == "UW"
+    session.query(StaCorrection).delete()
+    session.commit()
+    assert insert_default_stacors(session, [("GR", "FUR"), ("GR", "WET")], rules) == 4
+    assert set(s.seedchan for s in session.query(StaCorrection)) == set(["HHN", "HHE"])
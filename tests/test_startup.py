@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_lazy_imports():
+    # the modules the scripts import must not pull in obspy or obspy.signal
+    code = "import sys; import aqms_ir.inv2schema, aqms_ir.close, aqms_ir.loader, aqms_ir.migrate; " \
+           "print(sorted(m for m in sys.modules if m.split('.')[0] in ('obspy', 'numpy', 'scipy')))"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT)
+    assert output.strip() == b"[]"
+
+# the scripts whose --help must not import obspy, numpy or scipy, getStationXML needs obspy
+SCRIPTS = ["loadStationXML", "deleteStation", "closeStation", "dumpStationXML", "exportSnapshot", "migrateSchema",
+           "watchStationXML"]
+
+def test_lazy_script_imports():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("DB_PASSWORD", None)
+    for script in SCRIPTS:
+        code = "import runpy, sys; sys.argv = [{0!r}, '--help']\n" \
+               "try:\n    runpy.run_path({0!r}, run_name='__main__')\nexcept SystemExit:\n    pass\n" \
+               "print(sorted(m for m in sys.modules if m.split('.')[0] in ('obspy', 'numpy', 'scipy')))".\
+               format(os.path.join(ROOT, script))
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT, env=env,
+                                         stdin=subprocess.DEVNULL)
+        assert output.strip().splitlines()[-1] == b"[]", script
+
+def test_help_without_database():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("DB_PASSWORD", None)
+    output = subprocess.check_output([sys.executable, os.path.join(ROOT, "closeStation"), "--help"],
+                                     env=env, stdin=subprocess.DEVNULL)
+    assert b"usage" in output
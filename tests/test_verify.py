@@ -0,0 +1,30 @@
+from obspy import read_inventory
+
+from aqms_ir.inv2schema import inventory2db
+from aqms_ir.schema import Channel, SimpleResponse
+from aqms_ir.verify import verify_inventory
+
+from helpers import memory_session
+
+def test_verify_inventory():
+    session = memory_session()
+    inventory = read_inventory().select(network="GR")
+    inventory2db(session, inventory)
+
+    report = verify_inventory(session, inventory)
+    assert report
+    assert report.counts["channel_data"]["matching"] == len(inventory.get_contents()["channels"])
+
+    session.query(SimpleResponse).filter_by(sta="FUR", seedchan="BHZ").one().gain = 3
+    session.query(Channel).filter_by(sta="WET", seedchan="BHN").delete()
+    session.commit()
+
+    report = verify_inventory(session, inventory.select(channel="BH?"))
+    assert not report
+    assert report.counts["channel_data"]["missing"] == 1
+    assert report.samples["channel_data"]["missing"][0]["key"] == "GR.WET..BHN.2007-02-02T00:00:00"
+    differing = report.samples["simple_response"]["differing"][0]
+    assert differing["key"] == "GR.FUR..BHZ.2006-12-16T00:00:00"
+    assert [d["column"] for d in differing["differences"]] == ["gain"]
+    # the HH?, LH? (and VH? of FUR) channels of both stations
+    assert report.counts["channel_data"]["extra"] == 15
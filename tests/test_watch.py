@@ -0,0 +1,50 @@
+import json
+import os
+
+from obspy import read_inventory
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from aqms_ir.loader import Loader
+from aqms_ir.schema import Base, Channel
+from aqms_ir.watch import Spool
+
+def test_spool(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "ir.db"), connect_args={"timeout": 30})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    inventory = read_inventory().select(network="GR")
+    inventory.select(station="FUR").write(str(spool_dir / "FUR.xml"), format="STATIONXML")
+    inventory.select(station="WET").write(str(spool_dir / "WET.xml"), format="STATIONXML")
+    (spool_dir / "broken.xml").write_text("<FDSNStationXML>")
+
+    spool = Spool(str(spool_dir), Loader(factory), workers=2, settle=0)
+    results = spool.run_once()
+    assert sorted(results) == ["FUR.xml", "WET.xml", "broken.xml"]
+    assert results["broken.xml"] is None
+    assert os.path.exists(str(spool_dir / "quarantine" / "broken.xml.error"))
+    assert not os.path.exists(str(spool_dir / "broken.xml"))
+    with open(str(spool_dir / "reports" / "FUR.xml.report.json")) as fp:
+        report = json.load(fp)
+    assert report["counts"]["channel_data"]["good"] == factory().query(Channel).filter_by(sta="FUR").count()
+
+    # nothing changed, nothing to load
+    assert spool.run_once() == {}
+    assert len(spool.loader.responses.responses) > 0
+
+    # a restarted spool does not load the files again, a changed one is
+    spool = Spool(str(spool_dir), Loader(factory), workers=2, settle=0)
+    assert spool.loaded == dict((name, (os.stat(str(spool_dir / name)).st_mtime,
+                                        os.stat(str(spool_dir / name)).st_size)) for name in ["FUR.xml", "WET.xml"])
+    assert spool.run_once() == {}
+    inventory.select(station="WET", channel="BH?").write(str(spool_dir / "WET.xml"), format="STATIONXML")
+    os.utime(str(spool_dir / "WET.xml"), (1, 1))
+    assert sorted(spool.run_once()) == ["WET.xml"]
+
+    # removed files are forgotten
+    os.remove(str(spool_dir / "FUR.xml"))
+    assert spool.run_once() == {}
+    assert sorted(spool.loaded) == ["WET.xml"]
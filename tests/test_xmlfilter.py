@@ -0,0 +1,45 @@
+import io
+
+from obspy import read_inventory, UTCDateTime
+
+from aqms_ir.profiling import Timings, collect
+from aqms_ir.xmlfilter import read_stationxml, iter_stationxml
+
+def _stationxml():
+    buf = io.BytesIO()
+    read_inventory().write(buf, format="STATIONXML")
+    return buf.getvalue()
+
+def test_read_stationxml():
+    data = _stationxml()
+    timings = Timings()
+    with collect(timings):
+        inventory = read_stationxml(io.BytesIO(data), channel="[BEHS][HNL][123ENZ]")
+    assert inventory.get_contents()["channels"] == read_inventory().select(channel="[BEHS][HNL][123ENZ]").get_contents()["channels"]
+    assert timings.as_dict()["counters"]["channels_skipped"] == 9
+
+    inventory = read_stationxml(io.BytesIO(data), station="FUR,RJOB", channel="?HZ", location="--")
+    assert sorted(set(inventory.get_contents()["stations"])) == ["BW.RJOB (Jochberg, Bavaria, BW-Net)",
+                                                                "GR.FUR (Fuerstenfeldbruck, Bavaria, GR-Net)"]
+    assert len(inventory.get_contents()["channels"]) == 7
+
+    # stations and networks without matching channels are dropped
+    inventory = read_stationxml(io.BytesIO(data), channel="BHZ")
+    assert [network.code for network in inventory] == ["GR"]
+    assert read_stationxml(io.BytesIO(data), network="XX").networks == []
+
+def test_read_stationxml_time_window():
+    data = _stationxml()
+    assert len(read_stationxml(io.BytesIO(data), network="BW", active=True).get_contents()["channels"]) == \
+        len(read_inventory().select(network="BW", time=UTCDateTime()).get_contents()["channels"])
+    inventory = read_stationxml(io.BytesIO(data), endtime="2007-01-01")
+    expected = read_inventory().select(endtime=UTCDateTime("2007-01-01"))
+    assert inventory.get_contents()["channels"] == expected.get_contents()["channels"]
+
+def test_iter_stationxml():
+    data = _stationxml()
+    for selection in ({}, {"channel": "BH?"}, {"station": "FUR,WET", "location": "--"}):
+        inventories = list(iter_stationxml(io.BytesIO(data), **selection))
+        assert all(len(inventory.networks) == 1 and len(inventory[0].stations) == 1 for inventory in inventories)
+        channels = [c for inventory in inventories for c in inventory.get_contents()["channels"]]
+        assert sorted(channels) == sorted(read_stationxml(io.BytesIO(data), **selection).get_contents()["channels"])